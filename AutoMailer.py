@@ -1,5 +1,7 @@
 import pandas as pd
 
+import numpy as np
+
 import requests
 
 import streamlit as st
@@ -8,6 +10,8 @@ from serpapi import GoogleSearch
 
 import gspread
 
+from gspread.utils import numericise_all, rowcol_to_a1
+
 from gspread_dataframe import set_with_dataframe
 
 from dotenv import load_dotenv
@@ -26,10 +30,26 @@ from email.mime.base import MIMEBase
 
 from email import encoders
 
-import schedule
+from email.message import EmailMessage
+
+import email.policy
+
+import email.quoprimime
+
+import functools
+
+import contextlib
 
 import threading
 
+import asyncio
+
+import queue
+
+import atexit
+
+from concurrent.futures import ThreadPoolExecutor
+
 import re
 
 import plotly.express as px
@@ -40,13 +60,67 @@ from datetime import datetime, timedelta
 
 import uuid
 
+import json
+
+import hashlib
+
 import sqlite3
 
 from pathlib import Path
 
 import base64
 
-from urllib.parse import quote
+import itertools
+
+import calendar
+
+import heapq
+
+import signal
+
+from urllib.parse import quote, unquote, parse_qs
+
+import hmac
+
+from collections import OrderedDict
+
+import html
+
+from string import Template
+
+import socket
+
+import logging
+
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+
+try:
+
+    import dns.resolver
+
+    import dns.exception
+
+except ImportError:  # dnspython is optional; without it only A/AAAA lookups are possible
+
+    dns = None
+
+
+
+try:
+
+    import pyarrow as pa
+
+    import pyarrow.ipc
+
+except ImportError:  # pyarrow is optional; only needed for saved recipient lists
+
+    pa = None
+
+
+
+logger = logging.getLogger(__name__)
 
 
 
@@ -70,950 +144,7486 @@ MAILJET_API_KEY = os.getenv("MAILJET_API_KEY")
 
 MAILJET_SECRET_KEY = os.getenv("MAILJET_SECRET_KEY")
 
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
 
 
-# Database setup for email tracking
 
-def init_database():
+# LLM response cache settings
 
-    """Initialize SQLite database for email tracking"""
+LLM_CACHE_PATH = "llm_cache.db"
 
-    db_path = Path("email_tracking.db")
+LLM_CACHE_TTL = 7 * 24 * 3600
 
-    conn = sqlite3.connect(db_path)
+LLM_CACHE_MAX_ENTRIES = 50000
 
-    cursor = conn.cursor()
 
-    
 
-    cursor.execute('''
+# Search result cache settings
 
-        CREATE TABLE IF NOT EXISTS email_logs (
+SERP_CACHE_PATH = "serp_cache.db"
 
-            id TEXT PRIMARY KEY,
+SERP_CACHE_TTL = 30 * 24 * 3600
 
-            recipient_email TEXT,
 
-            company_name TEXT,
 
-            subject TEXT,
+# Search context trimming for contact extraction
 
-            sent_time TIMESTAMP,
+SEARCH_CONTEXT_TOKEN_BUDGET = 800
 
-            status TEXT,
+SEARCH_CONTEXT_TOP_K = 10
 
-            delivery_status TEXT,
+CONTACT_CONFIDENCE_THRESHOLD = 0.8
 
-            opened BOOLEAN DEFAULT FALSE,
 
-            clicked BOOLEAN DEFAULT FALSE,
 
-            bounced BOOLEAN DEFAULT FALSE,
+# SMTP transport settings
 
-            spam_score REAL,
+SMTP_HOST = os.getenv("SMTP_HOST", "in-v3.mailjet.com")
 
-            error_message TEXT
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 
-        )
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
 
-    ''')
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
 
-    
+SMTP_KEEPALIVE_INTERVAL = 30
 
-    conn.commit()
 
-    conn.close()
 
+# Per-provider sending limits (messages per second, burst size, concurrent SMTP sessions)
 
+PROVIDER_LIMITS = {
 
-def log_email_status(email_id, recipient_email, company_name, subject, status, delivery_status="pending", error_message=None):
+    "mailjet": {"rate": 10, "burst": 10, "max_connections": SMTP_POOL_SIZE},
 
-    """Log email status to database"""
+    "serpapi": {"rate": 5, "burst": 5, "max_connections": 4},
 
-    conn = sqlite3.connect("email_tracking.db")
+    "groq": {"rate": 0.5, "burst": 2, "max_connections": 4},
 
-    cursor = conn.cursor()
+}
 
-    
 
-    cursor.execute('''
 
-        INSERT OR REPLACE INTO email_logs 
+# Groq request pacing for bulk personalization
 
-        (id, recipient_email, company_name, subject, sent_time, status, delivery_status, error_message)
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "8"))
 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+GROQ_TOKENS_PER_MINUTE = int(os.getenv("GROQ_TOKENS_PER_MINUTE", "30000"))
 
-    ''', (email_id, recipient_email, company_name, subject, datetime.now(), status, delivery_status, error_message))
 
-    
 
-    conn.commit()
+# Email tracking database settings
 
-    conn.close()
+DB_PATH = "email_tracking.db"
 
+LOG_BATCH_SIZE = 500
 
+LOG_FLUSH_INTERVAL = 1.0
 
-def get_email_stats():
+LOG_MAX_PENDING = 100000  # rows kept for retry while the database is unwritable
 
-    """Get email statistics from database"""
+LOG_FLUSH_TIMEOUT = 30
 
-    conn = sqlite3.connect("email_tracking.db")
 
-    df = pd.read_sql_query("SELECT * FROM email_logs ORDER BY sent_time DESC", conn)
 
-    conn.close()
+# Persistent campaign scheduler (run with run_scheduler_worker)
 
-    return df
+SCHEDULER_MAX_CONCURRENT_JOBS = int(os.getenv("SCHEDULER_MAX_CONCURRENT_JOBS", "4"))
 
+SCHEDULER_LEASE_SECONDS = 300
 
+SCHEDULER_REFRESH_INTERVAL = 30
 
-# Email validation function (enhanced)
+SCHEDULER_PREFETCH = 1000
 
-def is_valid_email(email):
+SCHEDULER_MISFIRE_GRACE = 3600
 
-    """Enhanced email validation"""
+SCHEDULER_MAX_ATTEMPTS = 3
 
-    if not email or pd.isna(email):
+SCHEDULER_RETRY_DELAY = 300
 
-        return False
 
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
 
-    return re.match(pattern, str(email)) is not None
+# A recipient claimed for sending longer ago than this is treated as abandoned (e.g. the process died)
 
+CAMPAIGN_CLAIM_TIMEOUT = 600
 
+CAMPAIGN_MARK_RETRIES = 3  # attempts to record a delivered recipient as sent before leaving it to reconciliation
 
-def validate_email_deliverability(email):
 
-    """Check email deliverability factors"""
 
-    score = 100
+# Send-time optimization
 
-    warnings = []
+SEND_TIME_PRIOR_STRENGTH = 50  # pseudo-sends pulling sparse domain/hour cells toward the overall curve
 
-    
+SEND_TIME_CLICK_WEIGHT = 2.0
 
-    # Check for disposable email domains
+SEND_TIME_OPEN_WINDOW_DAYS = 14  # recent rollup days re-read on refresh, since opens arrive after sends
 
-    disposable_domains = ['temp-mail.org', '10minutemail.com', 'guerrillamail.com', 'mailinator.com']
+SEND_TIME_HORIZON_HOURS = 24
 
-    if any(domain in email.lower() for domain in disposable_domains):
+SEND_TIME_SLOT_HEADROOM = 1.5
 
-        score -= 30
+SEND_TIME_PASS_SECONDS = 3600
 
-        warnings.append("Disposable email domain")
 
-    
 
-    # Check for common personal domains vs business domains
+_db_local = threading.local()
 
-    personal_domains = ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com']
 
-    if any(domain in email.lower() for domain in personal_domains):
 
-        score -= 10
+def connect_database(db_path=DB_PATH):
 
-        warnings.append("Personal email domain - may have stricter spam filters")
+    """Open a tuned SQLite connection to the tracking database"""
 
-    
+    conn = sqlite3.connect(db_path, timeout=30)
 
-    return score, warnings
+    conn.execute("PRAGMA journal_mode=WAL")
 
+    conn.execute("PRAGMA synchronous=NORMAL")
 
+    # Lets INSERT OR REPLACE fire delete triggers so the daily rollup stays exact
 
-# Enhanced data processing functions
+    conn.execute("PRAGMA recursive_triggers=ON")
 
-def find_email_column(df):
+    return conn
 
-    """Automatically detect email column in the dataframe"""
 
-    possible_email_columns = ['email', 'gmail', 'mail', 'e-mail', 'email_address', 'contact_email', 'business_email']
 
-    
+def get_db_connection():
 
-    # Check for exact matches first
+    """Return this thread's SQLite connection, opened once in WAL mode"""
 
-    for col in df.columns:
+    conn = getattr(_db_local, "conn", None)
 
-        if col.lower() in possible_email_columns:
+    if conn is None:
 
-            return col
+        conn = connect_database()
 
-    
+        _db_local.conn = conn
 
-    # Check for partial matches
+    return conn
 
-    for col in df.columns:
 
-        if any(email_term in col.lower() for email_term in ['email', 'mail', 'gmail']):
 
-            return col
+def _rollup_bucket(row):
 
-    
+    """SQL expressions for the rollup bucket of a trigger's NEW or OLD row"""
 
-    # Check column content for email patterns
+    return f"""
 
-    for col in df.columns:
+        date({row}.sent_time),
 
-        if df[col].dtype == 'object':
+        CAST(strftime('%H', {row}.sent_time) AS INTEGER),
 
-            sample_values = df[col].dropna().head(10)
+        COALESCE({row}.status, ''),
 
-            email_count = sum(1 for val in sample_values if is_valid_email(str(val)))
+        COALESCE({row}.delivery_status, ''),
 
-            if email_count > len(sample_values) * 0.5:  # If more than 50% look like emails
+        CASE WHEN instr({row}.recipient_email, '@') > 0
 
-                return col
+             THEN lower(substr({row}.recipient_email, instr({row}.recipient_email, '@') + 1))
 
-    
+             ELSE '' END"""
 
-    return None
 
 
+ROLLUP_TRIGGERS_SQL = f'''
 
-def find_company_name_column(df):
+    CREATE TRIGGER IF NOT EXISTS email_logs_rollup_insert AFTER INSERT ON email_logs
 
-    """Automatically detect company name column in the dataframe"""
+    WHEN NEW.sent_time IS NOT NULL
 
-    possible_company_columns = ['company', 'company_name', 'business', 'organization', 'org', 'firm', 'business_name', 'name']
+    BEGIN
 
-    
+        INSERT INTO email_stats_daily (date, hour, status, delivery_status, domain, count, opened, clicked)
 
-    # Check for exact matches first
+        VALUES ({_rollup_bucket("NEW")}, 1, COALESCE(NEW.opened, 0), COALESCE(NEW.clicked, 0))
 
-    for col in df.columns:
+        ON CONFLICT (date, hour, status, delivery_status, domain) DO UPDATE SET
 
-        if col.lower() in possible_company_columns:
+            count = count + 1, opened = opened + excluded.opened, clicked = clicked + excluded.clicked;
 
-            return col
+    END;
 
-    
 
-    # Check for partial matches
 
-    for col in df.columns:
+    CREATE TRIGGER IF NOT EXISTS email_logs_rollup_delete AFTER DELETE ON email_logs
 
-        if any(company_term in col.lower() for company_term in ['company', 'business', 'organization', 'name']):
+    WHEN OLD.sent_time IS NOT NULL
 
-            return col
+    BEGIN
 
-    
+        INSERT INTO email_stats_daily (date, hour, status, delivery_status, domain, count, opened, clicked)
 
-    # Return first column if no obvious match
+        VALUES ({_rollup_bucket("OLD")}, -1, -COALESCE(OLD.opened, 0), -COALESCE(OLD.clicked, 0))
 
-    return df.columns[0] if len(df.columns) > 0 else None
+        ON CONFLICT (date, hour, status, delivery_status, domain) DO UPDATE SET
 
+            count = count - 1, opened = opened + excluded.opened, clicked = clicked + excluded.clicked;
 
+    END;
 
-def process_excel_data(df):
 
-    """Process Excel data to ensure email column exists and extract company information"""
 
-    processed_df = df.copy()
+    CREATE TRIGGER IF NOT EXISTS email_logs_rollup_update AFTER UPDATE ON email_logs
 
-    
+    BEGIN
 
-    # Find existing email column
+        INSERT INTO email_stats_daily (date, hour, status, delivery_status, domain, count, opened, clicked)
 
-    email_col = find_email_column(processed_df)
+        SELECT {_rollup_bucket("OLD")}, -1, -COALESCE(OLD.opened, 0), -COALESCE(OLD.clicked, 0)
+
+        WHERE OLD.sent_time IS NOT NULL
+
+        ON CONFLICT (date, hour, status, delivery_status, domain) DO UPDATE SET
+
+            count = count - 1, opened = opened + excluded.opened, clicked = clicked + excluded.clicked;
+
+        INSERT INTO email_stats_daily (date, hour, status, delivery_status, domain, count, opened, clicked)
+
+        SELECT {_rollup_bucket("NEW")}, 1, COALESCE(NEW.opened, 0), COALESCE(NEW.clicked, 0)
+
+        WHERE NEW.sent_time IS NOT NULL
+
+        ON CONFLICT (date, hour, status, delivery_status, domain) DO UPDATE SET
+
+            count = count + 1, opened = opened + excluded.opened, clicked = clicked + excluded.clicked;
+
+    END;
+
+'''
 
-    company_col = find_company_name_column(processed_df)
+
+
+# Database setup for email tracking
+
+def init_database():
+
+    """Initialize SQLite database for email tracking"""
+
+    conn = get_db_connection()
+
+    cursor = conn.cursor()
 
     
 
-    # If no email column found, create one
+    cursor.execute('''
 
-    if email_col is None:
+        CREATE TABLE IF NOT EXISTS email_logs (
 
-        processed_df['Gmail'] = ''
+            id TEXT PRIMARY KEY,
 
-        email_col = 'Gmail'
+            recipient_email TEXT,
 
-        st.warning("No email column found. Created 'Gmail' column. You may need to fill it manually or use search functionality.")
+            company_name TEXT,
 
-    else:
+            subject TEXT,
 
-        # Rename to standardize
+            sent_time TIMESTAMP,
+
+            status TEXT,
+
+            delivery_status TEXT,
+
+            opened BOOLEAN DEFAULT FALSE,
+
+            clicked BOOLEAN DEFAULT FALSE,
+
+            bounced BOOLEAN DEFAULT FALSE,
+
+            spam_score REAL,
+
+            error_message TEXT
+
+        )
+
+    ''')
+
+
+
+    # Indexes for dashboard aggregates and log lookups
+
+    for column in ["sent_time", "status", "delivery_status", "recipient_email"]:
+
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_email_logs_{column} ON email_logs ({column})")
+
+
+
+    # Daily rollup kept in step with email_logs by triggers
+
+    cursor.execute('''
+
+        CREATE TABLE IF NOT EXISTS email_stats_daily (
+
+            date TEXT NOT NULL,
+
+            hour INTEGER NOT NULL,
+
+            status TEXT NOT NULL,
+
+            delivery_status TEXT NOT NULL,
+
+            domain TEXT NOT NULL,
+
+            count INTEGER NOT NULL DEFAULT 0,
+
+            opened INTEGER NOT NULL DEFAULT 0,
+
+            clicked INTEGER NOT NULL DEFAULT 0,
+
+            PRIMARY KEY (date, hour, status, delivery_status, domain)
+
+        )
+
+    ''')
+
+    cursor.executescript(ROLLUP_TRIGGERS_SQL)
+
+
+
+    if cursor.execute("SELECT 1 FROM email_stats_daily LIMIT 1").fetchone() is None:
+
+        rebuild_daily_rollup(conn)
+
+
+
+    # Cached MX/A lookups per recipient domain
+
+    cursor.execute('''
+
+        CREATE TABLE IF NOT EXISTS domain_dns_cache (
+
+            domain TEXT PRIMARY KEY,
+
+            status TEXT NOT NULL,
+
+            mx_hosts TEXT,
+
+            checked REAL NOT NULL
+
+        )
+
+    ''')
+
+
+
+    # Campaign runs and per-recipient send state for resumable campaigns
+
+    cursor.execute('''
+
+        CREATE TABLE IF NOT EXISTS campaign_runs (
+
+            run_id TEXT PRIMARY KEY,
+
+            name TEXT,
+
+            created TIMESTAMP,
+
+            updated TIMESTAMP,
+
+            status TEXT,
+
+            checkpoint INTEGER DEFAULT 0
+
+        )
+
+    ''')
+
+    cursor.execute('''
+
+        CREATE TABLE IF NOT EXISTS campaign_recipients (
+
+            run_id TEXT NOT NULL,
+
+            message_key TEXT NOT NULL,
+
+            recipient_email TEXT,
+
+            status TEXT NOT NULL,
+
+            updated TIMESTAMP,
+
+            error_message TEXT,
+
+            claimed_at REAL,
+
+            PRIMARY KEY (run_id, message_key)
+
+        )
+
+    ''')
+
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(campaign_recipients)")}
+
+    if "claimed_at" not in columns:
+
+        cursor.execute("ALTER TABLE campaign_recipients ADD COLUMN claimed_at REAL")
+
+
+
+    # Persistent scheduled jobs, claimed by scheduler workers through expiring leases
+
+    cursor.execute('''
+
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+
+            job_id TEXT PRIMARY KEY,
+
+            name TEXT,
+
+            kind TEXT NOT NULL,
+
+            payload TEXT NOT NULL,
+
+            status TEXT NOT NULL,
+
+            next_run REAL,
+
+            interval_seconds REAL,
+
+            misfire_policy TEXT NOT NULL DEFAULT 'run_once',
+
+            misfire_grace REAL,
+
+            run_id TEXT,
+
+            occurrence REAL,
+
+            lease_owner TEXT,
+
+            lease_expires REAL,
+
+            attempts INTEGER NOT NULL DEFAULT 0,
+
+            last_run REAL,
+
+            last_error TEXT,
+
+            created TIMESTAMP,
+
+            updated TIMESTAMP
+
+        )
+
+    ''')
+
+    # Raw open/click hits from the tracking service; one open per message is kept
+
+    cursor.execute('''
+
+        CREATE TABLE IF NOT EXISTS email_events (
+
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+
+            email_id TEXT NOT NULL,
+
+            event TEXT NOT NULL,
+
+            url TEXT,
+
+            occurred REAL NOT NULL,
+
+            ip TEXT,
+
+            user_agent TEXT
+
+        )
+
+    ''')
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_email_events_email_id ON email_events (email_id)")
+
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_email_events_open ON email_events (email_id) WHERE event = 'open'")
+
+
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_due ON scheduled_jobs (status, next_run)")
+
+
+
+    # Optimized send time per recipient of a campaign run
+
+    cursor.execute('''
+
+        CREATE TABLE IF NOT EXISTS campaign_send_slots (
+
+            run_id TEXT NOT NULL,
+
+            message_key TEXT NOT NULL,
+
+            send_at REAL NOT NULL,
+
+            PRIMARY KEY (run_id, message_key)
+
+        )
+
+    ''')
+
+    
+
+    conn.commit()
+
+
+
+def rebuild_daily_rollup(conn=None):
+
+    """Regenerate the email_stats_daily rollup from the raw email logs"""
+
+    flush_email_logs()
+
+    conn = conn or get_db_connection()
+
+    conn.execute("DELETE FROM email_stats_daily")
+
+    conn.execute(f"""
+
+        INSERT INTO email_stats_daily (date, hour, status, delivery_status, domain, count, opened, clicked)
+
+        SELECT {_rollup_bucket("email_logs")}, COUNT(*), SUM(COALESCE(opened, 0)), SUM(COALESCE(clicked, 0))
+
+        FROM email_logs
+
+        WHERE sent_time IS NOT NULL
+
+        GROUP BY 1, 2, 3, 4, 5
+
+    """)
+
+    conn.commit()
+
+
+
+class EmailLogWriter:
+
+    """Buffers email status rows and writes them in batches from a single background thread"""
+
+
+
+    THREAD_NAME = "email-log-writer"
+
+    INSERT_SQL = '''
+
+        INSERT OR REPLACE INTO email_logs 
+
+        (id, recipient_email, company_name, subject, sent_time, status, delivery_status, error_message)
+
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+
+    '''
+
+
+
+    def __init__(self, db_path=DB_PATH, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL):
+
+        self.db_path = db_path
+
+        self.batch_size = batch_size
+
+        self.flush_interval = flush_interval
+
+        self.last_error = None  # why the last write failed, cleared once a write succeeds
+
+        self._queue = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, name=self.THREAD_NAME, daemon=True)
+
+        self._thread.start()
+
+
+
+    def write(self, row):
+
+        self._queue.put(row)
+
+
+
+    def flush(self, timeout=LOG_FLUSH_TIMEOUT):
+
+        """Block until every row queued so far has been written.
+
+
+
+        Returns False if the write failed (the rows are kept and retried) or timed out.
+
+        """
+
+        if not self._thread.is_alive():
+
+            raise RuntimeError(f"{self.THREAD_NAME} thread is not running")
+
+        done = threading.Event()
+
+        done.written = False
+
+        self._queue.put(done)
+
+        return done.wait(timeout) and done.written
+
+
+
+    def close(self):
+
+        """Flush pending rows and stop the writer thread"""
+
+        if self._thread.is_alive():
+
+            self._queue.put(None)
+
+            self._thread.join()
+
+
+
+    def _write_batch(self, conn, batch):
+
+        if batch:
+
+            conn.executemany(self.INSERT_SQL, batch)
+
+            conn.commit()
+
+            batch.clear()
+
+
+
+    def _try_write(self, conn, batch):
+
+        """Write a batch, keeping its rows for the next attempt if the write fails"""
+
+        try:
+
+            self._write_batch(conn, batch)
+
+            self.last_error = None
+
+            return True
+
+        except sqlite3.Error as e:
+
+            conn.rollback()
+
+            self.last_error = str(e)
+
+            logger.error("%s: failed to write %d rows, will retry: %s", self.THREAD_NAME, len(batch), e)
+
+            if len(batch) > LOG_MAX_PENDING:
+
+                logger.error("%s: dropping %d oldest rows", self.THREAD_NAME, len(batch) - LOG_MAX_PENDING)
+
+                del batch[:len(batch) - LOG_MAX_PENDING]
+
+            return False
+
+
+
+    def _run(self):
+
+        conn = connect_database(self.db_path)
+
+        batch = []
+
+        healthy = True
+
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+
+            try:
+
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+
+            except queue.Empty:
+
+                item = ()
+
+            if item is None:
+
+                self._try_write(conn, batch)
+
+                conn.close()
+
+                return
+
+            if isinstance(item, threading.Event):
+
+                try:
+
+                    healthy = item.written = self._try_write(conn, batch)
+
+                finally:
+
+                    item.set()
+
+            elif item:
+
+                batch.append(item)
+
+            # After a failed write, wait for the next interval instead of retrying on every row
+
+            if (healthy and len(batch) >= self.batch_size) or time.monotonic() >= deadline:
+
+                healthy = self._try_write(conn, batch)
+
+                deadline = time.monotonic() + self.flush_interval
+
+
+
+_log_writer = None
+
+_log_writer_lock = threading.Lock()
+
+
+
+def get_log_writer():
+
+    """Return the process-wide log writer, starting it on first use"""
+
+    global _log_writer
+
+    with _log_writer_lock:
+
+        if _log_writer is None:
+
+            _log_writer = EmailLogWriter()
+
+            atexit.register(_log_writer.close)
+
+        return _log_writer
+
+
+
+def flush_email_logs():
+
+    """Commit any buffered email status rows; returns False if they could not be written yet"""
+
+    if _log_writer is not None:
+
+        return _log_writer.flush()
+
+    return True
+
+
+
+def _flush_email_logs_for_display():
+
+    """Flush before a dashboard read, warning in the app when rows are still waiting to be written"""
+
+    if not flush_email_logs():
+
+        reason = getattr(_log_writer, "last_error", None) or "timed out"
+
+        st.warning(f"Some email status rows are not saved yet and will be retried ({reason}).")
+
+
+
+def log_email_status(email_id, recipient_email, company_name, subject, status, delivery_status="pending", error_message=None):
+
+    """Queue an email status row for the batched database writer"""
+
+    get_log_writer().write((email_id, recipient_email, company_name, subject, datetime.now(), status, delivery_status, error_message))
+
+
+
+def get_email_stats():
+
+    """Get email statistics from database"""
+
+    _flush_email_logs_for_display()
+
+    return pd.read_sql_query("SELECT * FROM email_logs ORDER BY sent_time DESC", get_db_connection())
+
+
+
+def _log_filters(start_date=None, end_date=None, status=None):
+
+    """Build a WHERE clause and parameters for date range and status filters"""
+
+    clauses, params = [], []
+
+    if start_date is not None:
+
+        clauses.append("sent_time >= ?")
+
+        params.append(str(start_date))
+
+    if end_date is not None:
+
+        clauses.append("sent_time < ?")
+
+        params.append(str(end_date))
+
+    if status is not None:
+
+        clauses.append("status = ?")
+
+        params.append(status)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    return where, params
+
+
+
+def _rollup_filters(start_date=None, end_date=None):
+
+    """Build a WHERE clause for whole-day filters on the daily rollup"""
+
+    clauses, params = [], []
+
+    if start_date is not None:
+
+        clauses.append("date >= date(?)")
+
+        params.append(str(start_date))
+
+    if end_date is not None:
+
+        clauses.append("date < date(?)")
+
+        params.append(str(end_date))
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    return where, params
+
+
+
+def get_email_summary(start_date=None, end_date=None):
+
+    """Get pre-aggregated email counts from the daily rollup"""
+
+    _flush_email_logs_for_display()
+
+    conn = get_db_connection()
+
+    where, params = _rollup_filters(start_date, end_date)
+
+
+
+    by_status = dict(conn.execute(f"SELECT status, SUM(count) FROM email_stats_daily {where} GROUP BY status", params).fetchall())
+
+    by_delivery = dict(conn.execute(f"SELECT delivery_status, SUM(count) FROM email_stats_daily {where} GROUP BY delivery_status", params).fetchall())
+
+    daily = pd.read_sql_query(f"""
+
+        SELECT date, status, SUM(count) AS count
+
+        FROM email_stats_daily {where}
+
+        GROUP BY date, status
+
+        ORDER BY date
+
+    """, conn, params=params)
+
+    hourly = pd.read_sql_query(f"""
+
+        SELECT hour, status, SUM(count) AS count, SUM(opened) AS opened, SUM(clicked) AS clicked
+
+        FROM email_stats_daily {where}
+
+        GROUP BY hour, status
+
+        ORDER BY hour
+
+    """, conn, params=params)
+
+    by_domain = pd.read_sql_query(f"""
+
+        SELECT domain, SUM(count) AS count, SUM(opened) AS opened, SUM(clicked) AS clicked
+
+        FROM email_stats_daily {where}
+
+        GROUP BY domain
+
+        ORDER BY count DESC
+
+    """, conn, params=params)
+
+
+
+    return {
+
+        "total": sum(by_status.values()),
+
+        "by_status": by_status,
+
+        "by_delivery_status": by_delivery,
+
+        "daily": daily,
+
+        "hourly": hourly,
+
+        "by_domain": by_domain,
+
+    }
+
+
+
+def get_email_logs(limit=100, offset=0, start_date=None, end_date=None, status=None):
+
+    """Get one page of raw email logs, newest first"""
+
+    _flush_email_logs_for_display()
+
+    where, params = _log_filters(start_date, end_date, status)
+
+    return pd.read_sql_query(
+
+        f"SELECT * FROM email_logs {where} ORDER BY sent_time DESC LIMIT ? OFFSET ?",
+
+        get_db_connection(), params=params + [limit, offset]
+
+    )
+
+
+
+# Resumable campaign runs
+
+def start_campaign_run(name=None, run_id=None):
+
+    """Create a campaign run, or reopen an existing one when run_id is given"""
+
+    run_id = run_id or str(uuid.uuid4())
+
+    conn = get_db_connection()
+
+    now = datetime.now()
+
+    conn.execute('''
+
+        INSERT INTO campaign_runs (run_id, name, created, updated, status, checkpoint)
+
+        VALUES (?, ?, ?, ?, 'running', 0)
+
+        ON CONFLICT (run_id) DO UPDATE SET status = 'running', updated = excluded.updated
+
+    ''', (run_id, name, now, now))
+
+    conn.commit()
+
+    return run_id
+
+
+
+def finish_campaign_run(run_id, status="finished"):
+
+    conn = get_db_connection()
+
+    conn.execute("UPDATE campaign_runs SET status = ?, updated = ? WHERE run_id = ?", (status, datetime.now(), run_id))
+
+    conn.commit()
+
+
+
+def get_campaign_run(run_id):
+
+    """Get a run's checkpoint and recipient counts by status"""
+
+    conn = get_db_connection()
+
+    row = conn.execute("SELECT name, status, checkpoint FROM campaign_runs WHERE run_id = ?", (run_id,)).fetchone()
+
+    if row is None:
+
+        return None
+
+    counts = dict(conn.execute(
+
+        "SELECT status, COUNT(*) FROM campaign_recipients WHERE run_id = ? GROUP BY status", (run_id,)
+
+    ).fetchall())
+
+    return {"run_id": run_id, "name": row[0], "status": row[1], "checkpoint": row[2], "recipients": counts}
+
+
+
+def save_campaign_checkpoint(run_id, checkpoint):
+
+    """Record that every row before `checkpoint` has been sent, has failed or was skipped"""
+
+    conn = get_db_connection()
+
+    conn.execute("UPDATE campaign_runs SET checkpoint = MAX(checkpoint, ?), updated = ? WHERE run_id = ?",
+
+                 (checkpoint, datetime.now(), run_id))
+
+    conn.commit()
+
+
+
+def campaign_message_key(run_id, recipient_email):
+
+    """Deterministic per-recipient key, also used as the email id / Message-ID"""
+
+    normalized = str(recipient_email or '').strip().lower()
+
+    return hashlib.sha256(f"{run_id}:{normalized}".encode("utf-8")).hexdigest()[:32]
+
+
+
+def reconcile_campaign_run(run_id):
+
+    """Mark in-flight recipients whose send was logged as sent, e.g. after a crash between send and update"""
+
+    flush_email_logs()
+
+    conn = get_db_connection()
+
+    conn.execute('''
+
+        UPDATE campaign_recipients SET status = 'sent', updated = ?
+
+        WHERE run_id = ? AND status = 'in_flight'
+
+          AND message_key IN (SELECT id FROM email_logs WHERE status = 'sent')
+
+    ''', (datetime.now(), run_id))
+
+    conn.commit()
+
+
+
+def campaign_recipient_pending(run_id, message_key, claim_timeout=CAMPAIGN_CLAIM_TIMEOUT):
+
+    """True unless the recipient was already sent or is held by a live claim"""
+
+    row = get_db_connection().execute(
+
+        "SELECT status, claimed_at FROM campaign_recipients WHERE run_id = ? AND message_key = ?", (run_id, message_key)
+
+    ).fetchone()
+
+    if row is None:
+
+        return True
+
+    status, claimed_at = row
+
+    if status == 'in_flight':
+
+        return (claimed_at or 0) < time.time() - claim_timeout
+
+    return status != 'sent'
+
+
+
+def claim_campaign_recipient(run_id, message_key, recipient_email, claim_timeout=CAMPAIGN_CLAIM_TIMEOUT):
+
+    """Mark a recipient in flight just before sending; returns False if it was already sent or is in flight.
+
+
+
+    A claim older than claim_timeout was abandoned and is taken over, unless email_logs shows the
+
+    message went out.
+
+    """
+
+    now = time.time()
+
+    conn = get_db_connection()
+
+    cursor = conn.execute('''
+
+        INSERT INTO campaign_recipients (run_id, message_key, recipient_email, status, updated, claimed_at)
+
+        VALUES (?, ?, ?, 'in_flight', ?, ?)
+
+        ON CONFLICT (run_id, message_key) DO UPDATE SET
+
+            status = 'in_flight', updated = excluded.updated, claimed_at = excluded.claimed_at
+
+        WHERE campaign_recipients.status NOT IN ('sent', 'in_flight')
+
+           OR (campaign_recipients.status = 'in_flight' AND COALESCE(campaign_recipients.claimed_at, 0) < ?
+
+               AND NOT EXISTS (SELECT 1 FROM email_logs WHERE id = excluded.message_key AND status = 'sent'))
+
+    ''', (run_id, message_key, recipient_email, datetime.now(), now, now - claim_timeout))
+
+    conn.commit()
+
+    return cursor.rowcount > 0
+
+
+
+def mark_campaign_recipient(run_id, message_key, status, error_message=None, recipient_email=None):
+
+    conn = get_db_connection()
+
+    conn.execute('''
+
+        INSERT INTO campaign_recipients (run_id, message_key, recipient_email, status, updated, error_message)
+
+        VALUES (?, ?, ?, ?, ?, ?)
+
+        ON CONFLICT (run_id, message_key) DO UPDATE SET
+
+            status = excluded.status, error_message = excluded.error_message, updated = excluded.updated
+
+    ''', (run_id, message_key, recipient_email, status, datetime.now(), error_message))
+
+    conn.commit()
+
+
+
+# Email validation function (enhanced)
+
+EMAIL_PATTERN = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+
+EMAIL_REGEX = re.compile(EMAIL_PATTERN)
+
+
+
+# Built-in domain lists, used when no blocklist file is configured
+
+DISPOSABLE_DOMAINS = frozenset(['temp-mail.org', '10minutemail.com', 'guerrillamail.com', 'mailinator.com'])
+
+PERSONAL_DOMAINS = frozenset(['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com'])
+
+
+
+DISPOSABLE_DOMAINS_FILE = os.getenv("DISPOSABLE_DOMAINS_FILE", "disposable_domains.txt")
+
+PERSONAL_DOMAINS_FILE = os.getenv("PERSONAL_DOMAINS_FILE", "personal_domains.txt")
+
+DOMAIN_LIST_CHECK_INTERVAL = 5
+
+
+
+# Open/click tracking endpoint embedded in outgoing HTML
+
+TRACKING_BASE_URL = os.getenv("TRACKING_BASE_URL", "https://your-tracking-domain.com")
+
+TRACKING_SECRET = os.getenv("TRACKING_SECRET", "")  # signs click links; click tracking is off without it
+
+TRACKING_HOST = os.getenv("TRACKING_HOST", "0.0.0.0")
+
+TRACKING_PORT = int(os.getenv("TRACKING_PORT", "8080"))
+
+TRACKING_BATCH_SIZE = 2000
+
+TRACKING_FLUSH_INTERVAL = 1.0
+
+TRACKING_DEDUPE_SIZE = 1000000
+
+TRACKING_MAX_BODY_BYTES = 8192  # tracking requests carry no body; anything larger is refused
+
+
+
+# Google Sheets write-back limits
+
+SHEETS_MAX_CELLS_PER_REQUEST = 40000
+
+SHEETS_MAX_RANGES_PER_REQUEST = 500
+
+
+
+# Google Sheets reads
+
+SHEET_PAGE_SIZE = 5000
+
+SHEET_SNAPSHOT_DIR = Path("sheet_snapshots")
+
+
+
+# Rows per chunk when streaming large recipient files
+
+RECIPIENT_CHUNK_SIZE = 10000
+
+
+
+# Saved, columnar recipient lists (Arrow IPC files)
+
+RECIPIENT_STORE_DIR = Path("recipient_lists")
+
+
+
+# MX/DNS deliverability checks
+
+DNS_NAMESERVERS = [ns.strip() for ns in os.getenv("DNS_NAMESERVERS", "").split(",") if ns.strip()]
+
+DNS_TIMEOUT = 3.0
+
+DNS_CACHE_TTL = 24 * 3600
+
+DNS_MAX_WORKERS = 32
+
+NO_MAIL_WARNING = "Domain has no MX or A record - cannot receive mail"
+
+NO_MX_WARNING = "Domain has no MX record - relying on A record fallback"
+
+
+
+DISPOSABLE_WARNING = "Disposable email domain"
+
+PERSONAL_WARNING = "Personal email domain - may have stricter spam filters"
+
+
+
+class DomainList:
+
+    """Domain set loaded lazily from a file (one domain per line) and reloaded when the file changes"""
+
+
+
+    def __init__(self, path, defaults=frozenset()):
+
+        self.path = Path(path)
+
+        self.defaults = frozenset(defaults)
+
+        self._domains = None
+
+        self._mtime = None
+
+        self._checked = 0.0
+
+        self._lock = threading.Lock()
+
+
+
+    def _load(self):
+
+        try:
+
+            mtime = self.path.stat().st_mtime
+
+        except OSError:
+
+            self._domains, self._mtime = self.defaults, None
+
+            return
+
+        if mtime == self._mtime and self._domains is not None:
+
+            return
+
+        with open(self.path, encoding="utf-8") as f:
+
+            entries = (line.split('#', 1)[0].strip().lower().lstrip('.') for line in f)
+
+            self._domains = frozenset(entry for entry in entries if entry)
+
+        self._mtime = mtime
+
+
+
+    def domains(self):
+
+        """Current domain set, re-checking the file at most every DOMAIN_LIST_CHECK_INTERVAL seconds"""
+
+        now = time.monotonic()
+
+        if self._domains is None or now - self._checked > DOMAIN_LIST_CHECK_INTERVAL:
+
+            with self._lock:
+
+                self._load()
+
+                self._checked = now
+
+        return self._domains
+
+
+
+    def contains(self, domain, domains=None):
+
+        """True if the domain or any parent domain is listed"""
+
+        domains = domains if domains is not None else self.domains()
+
+        labels = str(domain).lower().strip('.').split('.')
+
+        return any('.'.join(labels[i:]) in domains for i in range(len(labels) - 1))
+
+
+
+disposable_domain_list = DomainList(DISPOSABLE_DOMAINS_FILE, DISPOSABLE_DOMAINS)
+
+personal_domain_list = DomainList(PERSONAL_DOMAINS_FILE, PERSONAL_DOMAINS)
+
+
+
+def email_domain(email):
+
+    """Lower-cased domain part of an address"""
+
+    return str(email).strip().rsplit('@', 1)[-1].lower()
+
+
+
+@functools.lru_cache(maxsize=8)
+
+def _dns_resolver(nameservers=()):
+
+    """Shared resolver per nameserver set, so the system resolver config is read once rather than per domain"""
+
+    resolver = dns.resolver.Resolver()
+
+    if nameservers:
+
+        resolver.nameservers = list(nameservers)
+
+    return resolver
+
+
+
+def resolve_mail_domain(domain, nameservers=None, timeout=DNS_TIMEOUT):
+
+    """Look up MX (then A/AAAA) records for a domain.
+
+
+
+    Returns a dict with status "ok", "a_only", "no_mail" or "unknown" (lookup failed or timed out)
+
+    and the MX hosts found.
+
+    """
+
+    if dns is not None:
+
+        try:
+
+            resolver = _dns_resolver(tuple(nameservers or DNS_NAMESERVERS or ()))
+
+            answer = resolver.resolve(domain, "MX", lifetime=timeout)
+
+            hosts = sorted(str(record.exchange).rstrip('.') for record in answer)
+
+            # A null MX ("." per RFC 7505) means the domain explicitly accepts no mail
+
+            if hosts and hosts != ['']:
+
+                return {"status": "ok", "mx_hosts": hosts}
+
+            return {"status": "no_mail", "mx_hosts": []}
+
+        except dns.resolver.NXDOMAIN:
+
+            return {"status": "no_mail", "mx_hosts": []}
+
+        except dns.resolver.NoAnswer:
+
+            pass
+
+        except (dns.exception.DNSException, ValueError):
+
+            # Timeouts, no reachable nameservers, malformed names such as "x..com"
+
+            return {"status": "unknown", "mx_hosts": []}
+
+    try:
+
+        socket.getaddrinfo(domain, 25, proto=socket.IPPROTO_TCP)
+
+        # Without dnspython an address record is the best available signal
+
+        return {"status": "a_only" if dns is not None else "ok", "mx_hosts": []}
+
+    except socket.gaierror as e:
+
+        # Without dnspython an MX-only domain also has no address record, so that proves nothing
+
+        if dns is not None and e.errno in (socket.EAI_NONAME, getattr(socket, "EAI_NODATA", socket.EAI_NONAME)):
+
+            return {"status": "no_mail", "mx_hosts": []}
+
+        return {"status": "unknown", "mx_hosts": []}
+
+    except (UnicodeError, ValueError, OSError):
+
+        return {"status": "unknown", "mx_hosts": []}
+
+
+
+def check_domains_deliverability(domains, resolver=None, max_workers=DNS_MAX_WORKERS, ttl=DNS_CACHE_TTL):
+
+    """Resolve a batch of domains once each, using the on-disk cache.
+
+
+
+    `resolver` is any callable taking a domain and returning the dict shape of resolve_mail_domain,
+
+    so tests can pass a fixture. Returns {domain: result}.
+
+    """
+
+    resolver = resolver or resolve_mail_domain
+
+
+
+    def resolve(domain):
+
+        # One bad domain must not fail the whole batch
+
+        try:
+
+            return resolver(domain)
+
+        except Exception:
+
+            return {"status": "unknown", "mx_hosts": []}
+
+
+
+    unique_domains = {str(d).lower().strip('.') for d in domains if d and not pd.isna(d)}
+
+    results = {}
+
+
+
+    conn = get_db_connection()
+
+    cutoff = time.time() - ttl
+
+    cached_domains = list(unique_domains)
+
+    for start in range(0, len(cached_domains), 500):
+
+        chunk = cached_domains[start:start + 500]
+
+        placeholders = ",".join("?" * len(chunk))
+
+        for domain, status, mx_hosts, checked in conn.execute(
+
+            f"SELECT domain, status, mx_hosts, checked FROM domain_dns_cache WHERE domain IN ({placeholders})", chunk
+
+        ):
+
+            if checked >= cutoff:
+
+                results[domain] = {"status": status, "mx_hosts": json.loads(mx_hosts or "[]")}
+
+
+
+    missing = [domain for domain in unique_domains if domain not in results]
+
+    if missing:
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+
+            for domain, result in zip(missing, executor.map(resolve, missing)):
+
+                results[domain] = result
+
+        now = time.time()
+
+        # Failed lookups are not cached so they are retried next time
+
+        conn.executemany(
+
+            "INSERT OR REPLACE INTO domain_dns_cache (domain, status, mx_hosts, checked) VALUES (?, ?, ?, ?)",
+
+            [(domain, results[domain]["status"], json.dumps(results[domain].get("mx_hosts", [])), now)
+
+             for domain in missing if results[domain]["status"] != "unknown"]
+
+        )
+
+        conn.commit()
+
+
+
+    return results
+
+
+
+def normalize_email(email):
+
+    """Address with surrounding whitespace removed, or None for missing values"""
+
+    if email is None or (not isinstance(email, str) and pd.isna(email)):
+
+        return None
+
+    return str(email).strip()
+
+
+
+def is_valid_email(email):
+
+    """Enhanced email validation"""
+
+    email = normalize_email(email)
+
+    if not email:
+
+        return False
+
+    return EMAIL_REGEX.match(email) is not None
+
+
+
+def validate_email_deliverability(email, check_dns=False, resolver=None):
+
+    """Check email deliverability factors"""
+
+    score = 100
+
+    warnings = []
+
+    
+
+    domain = email_domain(email)
+
+
+
+    # Check for disposable email domains
+
+    if disposable_domain_list.contains(domain):
+
+        score -= 30
+
+        warnings.append(DISPOSABLE_WARNING)
+
+    
+
+    # Check for common personal domains vs business domains
+
+    if personal_domain_list.contains(domain):
+
+        score -= 10
+
+        warnings.append(PERSONAL_WARNING)
+
+
+
+    # Check that the domain can receive mail at all
+
+    if check_dns:
+
+        status = check_domains_deliverability([domain], resolver)[domain]["status"]
+
+        if status == "no_mail":
+
+            score -= 60
+
+            warnings.append(NO_MAIL_WARNING)
+
+        elif status == "a_only":
+
+            score -= 10
+
+            warnings.append(NO_MX_WARNING)
+
+    
+
+    return score, warnings
+
+
+
+def validate_emails_bulk(emails, check_dns=False, resolver=None):
+
+    """Validate a whole Series of addresses at once; addresses are normalized as in normalize_email.
+
+
+
+    Returns a DataFrame indexed like `emails` with valid, domain, score and warnings columns.
+
+    With check_dns, each unique domain is resolved once (see check_domains_deliverability).
+
+    """
+
+    emails = pd.Series(emails)
+
+    text = emails.astype(str).str.strip()
+
+    valid = text.str.match(EMAIL_PATTERN).fillna(False) & emails.notna() & (text != '')
+
+    domain = text.str.extract(r'@([^@]+)$', expand=False).str.lower()
+
+
+
+    # Suffix matching runs once per unique domain, then maps back onto the Series
+
+    unique_domains = domain.dropna().unique()
+
+    disposable_set, personal_set = disposable_domain_list.domains(), personal_domain_list.domains()
+
+    disposable_map = {d: disposable_domain_list.contains(d, disposable_set) for d in unique_domains}
+
+    personal_map = {d: personal_domain_list.contains(d, personal_set) for d in unique_domains}
+
+    disposable = domain.map(disposable_map).fillna(False).to_numpy(dtype=bool)
+
+    personal = domain.map(personal_map).fillna(False).to_numpy(dtype=bool)
+
+    score = 100 - 30 * disposable - 10 * personal
+
+    checks = [(disposable, DISPOSABLE_WARNING), (personal, PERSONAL_WARNING)]
+
+
+
+    if check_dns:
+
+        dns_results = check_domains_deliverability(unique_domains, resolver)
+
+        dns_status = domain.map({d: result["status"] for d, result in dns_results.items()}).to_numpy()
+
+        no_mail, a_only = dns_status == "no_mail", dns_status == "a_only"
+
+        score = score - 60 * no_mail - 10 * a_only
+
+        checks += [(no_mail, NO_MAIL_WARNING), (a_only, NO_MX_WARNING)]
+
+
+
+    warnings = np.full(len(domain), "", dtype=object)
+
+    for mask, text in checks:
+
+        warnings[mask] = np.where(warnings[mask] == "", text, warnings[mask] + "; " + text)
+
+
+
+    return pd.DataFrame({
+
+        "valid": valid.to_numpy(dtype=bool),
+
+        "domain": domain.to_numpy(),
+
+        "score": score,
+
+        "warnings": warnings,
+
+    }, index=emails.index)
+
+
+
+# Enhanced data processing functions
+
+def find_email_column(df):
+
+    """Automatically detect email column in the dataframe"""
+
+    possible_email_columns = ['email', 'gmail', 'mail', 'e-mail', 'email_address', 'contact_email', 'business_email']
+
+    
+
+    # Check for exact matches first
+
+    for col in df.columns:
+
+        if col.lower() in possible_email_columns:
+
+            return col
+
+    
+
+    # Check for partial matches
+
+    for col in df.columns:
+
+        if any(email_term in col.lower() for email_term in ['email', 'mail', 'gmail']):
+
+            return col
+
+    
+
+    # Check column content for email patterns
+
+    for col in df.columns:
+
+        if df[col].dtype == 'object':
+
+            sample_values = df[col].dropna().head(10).astype(str)
+
+            email_count = sample_values.str.match(EMAIL_PATTERN).sum()
+
+            if email_count > len(sample_values) * 0.5:  # If more than 50% look like emails
+
+                return col
+
+    
+
+    return None
+
+
+
+def find_company_name_column(df):
+
+    """Automatically detect company name column in the dataframe"""
+
+    possible_company_columns = ['company', 'company_name', 'business', 'organization', 'org', 'firm', 'business_name', 'name']
+
+    
+
+    # Check for exact matches first
+
+    for col in df.columns:
+
+        if col.lower() in possible_company_columns:
+
+            return col
+
+    
+
+    # Check for partial matches
+
+    for col in df.columns:
+
+        if any(company_term in col.lower() for company_term in ['company', 'business', 'organization', 'name']):
+
+            return col
+
+    
+
+    # Return first column if no obvious match
+
+    return df.columns[0] if len(df.columns) > 0 else None
+
+
+
+def process_excel_data(df):
+
+    """Process Excel data to ensure email column exists and extract company information"""
+
+    processed_df = df.copy()
+
+    
+
+    # Find existing email column
+
+    email_col = find_email_column(processed_df)
+
+    company_col = find_company_name_column(processed_df)
+
+    
+
+    # If no email column found, create one
+
+    if email_col is None:
+
+        processed_df['Gmail'] = ''
+
+        email_col = 'Gmail'
+
+        st.warning("No email column found. Created 'Gmail' column. You may need to fill it manually or use search functionality.")
+
+    else:
+
+        # Rename to standardize
+
+        if email_col != 'Gmail':
+
+            processed_df['Gmail'] = processed_df[email_col]
+
+    
+
+    # Ensure company name column exists
+
+    if company_col is None:
+
+        company_col = processed_df.columns[0]
+
+        st.info(f"Using '{company_col}' as company name column.")
+
+    
+
+    return processed_df, email_col, company_col
+
+
+
+NULL_LIKE_VALUES = ['nan', 'none', 'null', '']
+
+
+
+def _is_internal_column(col):
+
+    """Columns added by the app itself (validation flags, precomputed info) start with an underscore"""
+
+    return str(col).startswith('_')
+
+
+
+def create_comprehensive_company_info(row, company_col):
+
+    """Create comprehensive company information string from all available data"""
+
+    if row.get('_company_info'):
+
+        return row.get('_company_info')
+
+
+
+    company_name = str(row.get(company_col, 'Unknown Company'))
+
+    
+
+    # Exclude email and company name columns from additional info
+
+    excluded_cols = ['Gmail', 'gmail', 'email', 'Email', company_col]
+
+    
+
+    info_parts = [f"Company Name: {company_name}"]
+
+    
+
+    for col, value in row.items():
+
+        if col not in excluded_cols and not _is_internal_column(col) and pd.notna(value) and str(value).strip():
+
+            clean_value = str(value).strip()
+
+            if clean_value and clean_value.lower() not in NULL_LIKE_VALUES:
+
+                info_parts.append(f"{col}: {clean_value}")
+
+    
+
+    return "\n".join(info_parts)
+
+
+
+def build_company_info_series(df, company_col, max_fields=None, field_priority=None, max_value_length=None):
+
+    """Vectorized create_comprehensive_company_info for a whole DataFrame.
+
+
+
+    Included columns are worked out once and null-like values are masked column by column.
+
+    max_fields caps the extra fields per row (taken in field_priority order, then by how
+
+    often each column is filled) and max_value_length truncates long values, both to keep
+
+    prompts short.
+
+    """
+
+    excluded_cols = {'Gmail', 'gmail', 'email', 'Email', company_col}
+
+    columns = [col for col in df.columns if col not in excluded_cols and not _is_internal_column(col)]
+
+
+
+    values, present = {}, {}
+
+    for col in columns:
+
+        # str() per cell, exactly as the per-row path formats values (astype(str) differs for datetimes);
+
+        # for strings, integers and booleans astype(str) gives the same text without a Python call per cell
+
+        column = df[col]
+
+        if (pd.api.types.is_string_dtype(column.dtype) and column.dtype != object) or column.dtype.kind in "iub":
+
+            text = column.astype(str).str.strip()
+
+        else:
+
+            text = column.map(str).str.strip()
+
+        mask = df[col].notna() & ~text.str.lower().isin(NULL_LIKE_VALUES)
+
+        if max_value_length:
+
+            text = text.str.slice(0, max_value_length)
+
+        values[col], present[col] = text, mask
+
+
+
+    if max_fields is not None:
+
+        priority = [col for col in (field_priority or []) if col in values]
+
+        rest = sorted((col for col in columns if col not in priority), key=lambda col: -present[col].sum())
+
+        columns = priority + rest
+
+
+
+    if company_col in df.columns:
+
+        info = "Company Name: " + df[company_col].map(str)
+
+    else:
+
+        info = pd.Series("Company Name: Unknown Company", index=df.index)
+
+    field_count = np.zeros(len(df), dtype=int)
+
+    fields = []
+
+    for col in columns:
+
+        include = present[col].to_numpy()
+
+        if max_fields is not None:
+
+            include = include & (field_count < max_fields)
+
+            field_count += include
+
+        fields.append((f"\n{col}: " + values[col]).where(include, "").tolist())
+
+    # Join each row once; adding a column at a time re-copies every growing string per column
+
+    return pd.Series(["".join(parts) for parts in zip(info.tolist(), *fields)], index=df.index, dtype=object)
+
+
+
+# Streaming recipient ingestion
+
+def _iter_xlsx_chunks(source, chunksize):
+
+    """Read an .xlsx sheet through openpyxl's read-only row iterator, one DataFrame chunk at a time"""
+
+    from openpyxl import load_workbook
+
+
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+
+    try:
+
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+
+        header = next(rows, None)
+
+        if header is None:
+
+            return
+
+        columns = [str(col) if col is not None else f"Unnamed: {i}" for i, col in enumerate(header)]
+
+        while True:
+
+            block = list(itertools.islice(rows, chunksize))
+
+            if not block:
+
+                return
+
+            yield pd.DataFrame(block, columns=columns)
+
+    finally:
+
+        workbook.close()
+
+
+
+def iter_recipient_chunks(source, chunksize=RECIPIENT_CHUNK_SIZE, file_type=None):
+
+    """Yield DataFrame chunks from a CSV or XLSX path / uploaded file without loading it whole"""
+
+    if file_type is None:
+
+        name = str(getattr(source, "name", source)).lower()
+
+        file_type = "xlsx" if name.endswith((".xlsx", ".xlsm")) else "csv"
+
+    if file_type == "xlsx":
+
+        yield from _iter_xlsx_chunks(source, chunksize)
+
+    else:
+
+        yield from pd.read_csv(source, chunksize=chunksize)
+
+
+
+def stream_recipient_file(source, chunksize=RECIPIENT_CHUNK_SIZE, file_type=None, with_company_info=False,
+
+                          max_fields=None):
+
+    """Streaming counterpart of process_excel_data.
+
+
+
+    Detects the email and company columns once from the first chunk and returns
+
+    (records, email_col, company_col), where records lazily yields one dict per row
+
+    with the standardized 'Gmail' column filled in. with_company_info adds a
+
+    precomputed '_company_info' string per row, built a chunk at a time.
+
+    """
+
+    return stream_recipient_chunks(iter_recipient_chunks(source, chunksize, file_type), with_company_info, max_fields)
+
+
+
+def stream_recipient_chunks(chunks, with_company_info=False, max_fields=None):
+
+    """Turn an iterator of DataFrame chunks into (records, email_col, company_col); see stream_recipient_file"""
+
+    chunks = iter(chunks)
+
+    first = next(chunks, None)
+
+    if first is None:
+
+        return iter(()), None, None
+
+
+
+    email_col = find_email_column(first)
+
+    company_col = find_company_name_column(first)
+
+    if email_col is None:
+
+        st.warning("No email column found. Created 'Gmail' column. You may need to fill it manually or use search functionality.")
+
+    if company_col is None:
+
+        company_col = first.columns[0]
+
+        st.info(f"Using '{company_col}' as company name column.")
+
+
+
+    def records():
+
+        for chunk in itertools.chain([first], chunks):
+
+            if email_col is None:
+
+                chunk['Gmail'] = ''
+
+            elif email_col != 'Gmail':
+
+                chunk['Gmail'] = chunk[email_col]
+
+            if with_company_info:
+
+                chunk['_company_info'] = build_company_info_series(chunk, company_col, max_fields=max_fields)
+
+            yield from chunk.to_dict('records')
+
+
+
+    return records(), email_col or 'Gmail', company_col
+
+
+
+# Columnar recipient store
+
+def _recipient_list_path(name):
+
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+    return RECIPIENT_STORE_DIR / f"{safe_name}.arrow"
+
+
+
+def save_recipient_list(processed_df, name, email_col, company_col):
+
+    """Save a processed recipient DataFrame as an Arrow IPC file with precomputed validation columns"""
+
+    if pa is None:
+
+        raise ImportError("pyarrow is required to save recipient lists")
+
+
+
+    df = processed_df.copy()
+
+    validation = validate_emails_bulk(df['Gmail'])
+
+    df['_valid'] = validation['valid']
+
+    df['_domain'] = validation['domain']
+
+    df['_score'] = validation['score']
+
+    df['_warnings'] = validation['warnings']
+
+
+
+    # Mixed-type object columns (common in spreadsheets) are stored as strings
+
+    for col in df.columns:
+
+        if df[col].dtype == 'object':
+
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+
+    df.columns = [str(col) for col in df.columns]
+
+
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    table = table.replace_schema_metadata({
+
+        **(table.schema.metadata or {}),
+
+        b"email_col": str(email_col).encode("utf-8"),
+
+        b"company_col": str(company_col).encode("utf-8"),
+
+    })
+
+
+
+    RECIPIENT_STORE_DIR.mkdir(parents=True, exist_ok=True)
+
+    path = _recipient_list_path(name)
+
+    tmp_path = path.with_suffix(".arrow.tmp")
+
+    # Uncompressed IPC so later reads can memory-map the columns without decoding
+
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+
+        with pa.ipc.new_file(sink, table.schema) as writer:
+
+            writer.write_table(table)
+
+    os.replace(tmp_path, path)
+
+    return path
+
+
+
+def load_recipient_list(name, columns=None):
+
+    """Memory-map a saved recipient list, optionally reading only some columns (returned in file order).
+
+
+
+    Returns (df, email_col, company_col).
+
+    """
+
+    if pa is None:
+
+        raise ImportError("pyarrow is required to load recipient lists")
+
+
+
+    with pa.memory_map(str(_recipient_list_path(name)), "r") as source:
+
+        schema = pa.ipc.open_file(source).schema
+
+        options = None
+
+        if columns is not None:
+
+            # Only the requested columns are read from the file
+
+            options = pa.ipc.IpcReadOptions(included_fields=[schema.get_field_index(col) for col in columns
+
+                                                             if col in schema.names])
+
+        table = pa.ipc.open_file(source, options=options).read_all()
+
+        # Release each column's Arrow buffers as soon as pandas has converted it
+
+        df = table.to_pandas(self_destruct=True, split_blocks=True)
+
+        del table
+
+    metadata = schema.metadata or {}
+
+    email_col = metadata.get(b"email_col", b"Gmail").decode("utf-8")
+
+    company_col = metadata.get(b"company_col", b"").decode("utf-8") or None
+
+    return df, email_col, company_col
+
+
+
+def list_recipient_lists():
+
+    """Names of saved recipient lists"""
+
+    if not RECIPIENT_STORE_DIR.exists():
+
+        return []
+
+    return sorted(path.stem for path in RECIPIENT_STORE_DIR.glob("*.arrow"))
+
+
+
+# Enhanced Google Sheets functions
+
+_sheets_client = None
+
+_sheets_client_lock = threading.Lock()
+
+
+
+def authenticate_google_sheets():
+
+    """Return a process-wide gspread client; its credentials refresh the access token only when it expires"""
+
+    global _sheets_client
+
+    try:
+
+        with _sheets_client_lock:
+
+            if _sheets_client is None:
+
+                _sheets_client = gspread.service_account(filename=SERVICE_ACCOUNT_FILE)
+
+            return _sheets_client
+
+    except Exception as e:
+
+        st.error(f"Authentication Error: {str(e)}")
+
+        return None
+
+
+
+def _sheet_key_from_url(sheet_url):
+
+    return sheet_url.split('/d/')[1].split('/')[0]
+
+
+
+def _sheet_revision(spreadsheet):
+
+    """Drive modified time of a spreadsheet, or None if it cannot be read"""
+
+    try:
+
+        if hasattr(spreadsheet, "get_lastUpdateTime"):
+
+            return spreadsheet.get_lastUpdateTime()
+
+        return spreadsheet.lastUpdateTime
+
+    except Exception:
+
+        return None
+
+
+
+def _snapshot_paths(spreadsheet_id, worksheet_id):
+
+    base = SHEET_SNAPSHOT_DIR / f"{spreadsheet_id}_{worksheet_id}"
+
+    return base.with_suffix(".pkl"), base.with_suffix(".json")
+
+
+
+def _load_sheet_snapshot(spreadsheet_id, worksheet_id, revision):
+
+    """Return the locally saved DataFrame if it was taken at this revision"""
+
+    data_path, meta_path = _snapshot_paths(spreadsheet_id, worksheet_id)
+
+    if revision is None or not meta_path.exists() or not data_path.exists():
+
+        return None
+
+    with open(meta_path, encoding="utf-8") as f:
+
+        if json.load(f).get("revision") != revision:
+
+            return None
+
+    return pd.read_pickle(data_path)
+
+
+
+def _save_sheet_snapshot(spreadsheet_id, worksheet_id, revision, df):
+
+    if revision is None:
+
+        return
+
+    SHEET_SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+
+    data_path, meta_path = _snapshot_paths(spreadsheet_id, worksheet_id)
+
+    df.to_pickle(data_path)
+
+    with open(meta_path, "w", encoding="utf-8") as f:
+
+        json.dump({"revision": revision, "rows": len(df), "saved": datetime.now().isoformat()}, f)
+
+
+
+def iter_google_sheet_pages(worksheet, page_size=SHEET_PAGE_SIZE):
+
+    """Fetch a worksheet page by page as DataFrames instead of pulling every record at once.
+
+
+
+    Numbers are parsed the way get_all_records() parses them, so pages have the same dtypes as a full load.
+
+    """
+
+    header = worksheet.row_values(1)
+
+    if not header:
+
+        return
+
+    last_col = rowcol_to_a1(1, len(header)).rstrip('0123456789')
+
+    # The API omits trailing empty rows, so a short or empty page is not the end of the data: keep
+
+    # reading to row_count and carry blank gaps forward so rows stay aligned with the sheet
+
+    start, gap = 2, 0
+
+    while start <= worksheet.row_count:
+
+        end = min(start + page_size - 1, worksheet.row_count)
+
+        rows = worksheet.get(f"A{start}:{last_col}{end}")
+
+        if rows:
+
+            page = [[]] * gap + list(rows)
+
+            yield pd.DataFrame([numericise_all(row + [''] * (len(header) - len(row))) for row in page],
+
+                               columns=header)
+
+            gap = 0
+
+        gap += end - start + 1 - len(rows)
+
+        start = end + 1
+
+
+
+def stream_google_sheet(sheet_url, page_size=SHEET_PAGE_SIZE, with_company_info=False, max_fields=None):
+
+    """Stream a Google Sheet into the campaign pipeline; returns (records, email_col, company_col)"""
+
+    gc = authenticate_google_sheets()
+
+    if gc is None:
+
+        return iter(()), None, None
+
+    worksheet = gc.open_by_key(_sheet_key_from_url(sheet_url)).get_worksheet(0)
+
+    return stream_recipient_chunks(iter_google_sheet_pages(worksheet, page_size), with_company_info, max_fields)
+
+
+
+# Last-loaded contents per worksheet, used to diff write-backs
+
+_sheet_snapshots = {}
+
+_sheet_snapshots_lock = threading.Lock()
+
+
+
+def _worksheet_key(worksheet):
+
+    return (getattr(worksheet, "spreadsheet_id", None) or getattr(getattr(worksheet, "spreadsheet", None), "id", None), worksheet.id)
+
+
+
+def _sheet_grid(df):
+
+    """Header row plus data rows as JSON-friendly values, with missing values as empty strings"""
+
+    rows = df.astype(object).where(df.notna(), "").values.tolist()
+
+    return [[str(col) for col in df.columns]] + rows
+
+
+
+def _cell_text(value):
+
+    if isinstance(value, float) and value.is_integer():
+
+        value = int(value)
+
+    return "" if value is None else str(value)
+
+
+
+def _changed_ranges(old_grid, new_grid):
+
+    """Group changed cells into A1 ranges: contiguous runs per row, merged with identical runs below"""
+
+    runs = []
+
+    for r in range(max(len(old_grid), len(new_grid))):
+
+        new_row = new_grid[r] if r < len(new_grid) else []
+
+        old_row = old_grid[r] if r < len(old_grid) else []
+
+        width = max(len(new_row), len(old_row))
+
+        c = 0
+
+        while c < width:
+
+            new_value = new_row[c] if c < len(new_row) else ""
+
+            old_value = old_row[c] if c < len(old_row) else ""
+
+            if _cell_text(new_value) == _cell_text(old_value):
+
+                c += 1
+
+                continue
+
+            start = c
+
+            values = []
+
+            while c < width:
+
+                new_value = new_row[c] if c < len(new_row) else ""
+
+                old_value = old_row[c] if c < len(old_row) else ""
+
+                if _cell_text(new_value) == _cell_text(old_value):
+
+                    break
+
+                values.append(new_value)
+
+                c += 1
+
+            runs.append([r, start, [values]])
+
+
+
+    # Merge runs covering the same columns on consecutive rows into one rectangle
+
+    merged, open_blocks = [], {}
+
+    for row, col, values in runs:
+
+        block = open_blocks.get((col, len(values[0])))
+
+        if (block and block[0] + len(block[2]) == row
+
+                and (len(block[2]) + 1) * len(values[0]) <= SHEETS_MAX_CELLS_PER_REQUEST):
+
+            block[2].append(values[0])
+
+        else:
+
+            block = [row, col, values]
+
+            merged.append(block)
+
+            open_blocks[(col, len(values[0]))] = block
+
+
+
+    return [{
+
+        "range": f"{rowcol_to_a1(row + 1, col + 1)}:{rowcol_to_a1(row + len(values), col + len(values[0]))}",
+
+        "values": values,
+
+    } for row, col, values in merged]
+
+
+
+def load_google_sheet(sheet_url, use_snapshot=True):
+
+    try:
+
+        gc = authenticate_google_sheets()
+
+        if gc is None:
+
+            return None, None, None
+
+        sheet_key = _sheet_key_from_url(sheet_url)
+
+        sheet = gc.open_by_key(sheet_key)
+
+        worksheet = sheet.get_worksheet(0)
+
+
+
+        # Serve an unchanged sheet from the local snapshot instead of downloading it again
+
+        revision = _sheet_revision(sheet)
+
+        df = _load_sheet_snapshot(sheet_key, worksheet.id, revision) if use_snapshot else None
+
+        if df is None:
+
+            pages = list(iter_google_sheet_pages(worksheet))
+
+            df = pd.concat(pages, ignore_index=True) if pages else pd.DataFrame()
+
+            _save_sheet_snapshot(sheet_key, worksheet.id, revision, df)
+
+        grid = _sheet_grid(df)
+
+        with _sheet_snapshots_lock:
+
+            _sheet_snapshots[_worksheet_key(worksheet)] = grid
+
+        return df, gc, worksheet
+
+    except Exception as e:
+
+        st.error(f"Error loading sheet: {str(e)}")
+
+        return None, None, None
+
+
+
+def update_google_sheet(worksheet, results_df):
+
+    """Write results back, sending only the cells that changed since the sheet was loaded"""
+
+    try:
+
+        key = _worksheet_key(worksheet)
+
+        new_grid = _sheet_grid(results_df)
+
+        with _sheet_snapshots_lock:
+
+            old_grid = _sheet_snapshots.get(key)
+
+        if old_grid is None:
+
+            # Unknown contents: read what is there so the diff stays correct
+
+            old_grid = worksheet.get_all_values()
+
+
+
+        updates = _changed_ranges(old_grid, new_grid)
+
+        if not updates:
+
+            return True, "Google Sheet already up to date."
+
+
+
+        # Grow the sheet first if the results are larger than the grid
+
+        new_width = max(len(row) for row in new_grid) if new_grid else 0
+
+        if len(new_grid) > worksheet.row_count:
+
+            worksheet.add_rows(len(new_grid) - worksheet.row_count)
+
+        if new_width > worksheet.col_count:
+
+            worksheet.add_cols(new_width - worksheet.col_count)
+
+
+
+        # Send in chunks to stay under the API payload limits
+
+        batch, batch_cells, cells_sent = [], 0, 0
+
+        for update in updates:
+
+            cells = len(update["values"]) * len(update["values"][0])
+
+            if batch and (batch_cells + cells > SHEETS_MAX_CELLS_PER_REQUEST or len(batch) >= SHEETS_MAX_RANGES_PER_REQUEST):
+
+                worksheet.batch_update(batch)
+
+                batch, batch_cells = [], 0
+
+            batch.append(update)
+
+            batch_cells += cells
+
+            cells_sent += cells
+
+        worksheet.batch_update(batch)
+
+
+
+        with _sheet_snapshots_lock:
+
+            _sheet_snapshots[key] = new_grid
+
+        spreadsheet = getattr(worksheet, "spreadsheet", None)
+
+        if spreadsheet is not None:
+
+            _save_sheet_snapshot(spreadsheet.id, worksheet.id, _sheet_revision(spreadsheet), results_df)
+
+        return True, f"Google Sheet updated successfully! ({cells_sent} cells in {len(updates)} ranges)"
+
+    except Exception as e:
+
+        detailed_error = f"Error updating sheet: {str(e)}"
+
+        st.error(detailed_error)
+
+        return False, detailed_error
+
+
+
+# LLM response cache
+
+class LLMResponseCache:
+
+    """On-disk, content-addressed cache of API responses (chat completions, search results) with TTL and LRU eviction"""
+
+
+
+    def __init__(self, db_path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+
+        self.ttl = ttl
+
+        self.max_entries = max_entries
+
+        self.hits = 0
+
+        self.misses = 0
+
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+        self._conn.execute('''
+
+            CREATE TABLE IF NOT EXISTS llm_cache (
+
+                key TEXT PRIMARY KEY,
+
+                content TEXT NOT NULL,
+
+                created REAL NOT NULL,
+
+                accessed REAL NOT NULL
+
+            )
+
+        ''')
+
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed)")
+
+        self._conn.commit()
+
+
+
+    @staticmethod
+
+    def make_key(payload):
+
+        """Hash the request fields that determine a completion"""
+
+        material = {field: payload.get(field) for field in ("model", "messages", "temperature", "max_tokens")}
+
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+
+    def get(self, key):
+
+        now = time.time()
+
+        with self._lock:
+
+            row = self._conn.execute("SELECT content, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+
+            if row is None or now - row[1] > self.ttl:
+
+                self.misses += 1
+
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+
+            self._conn.commit()
+
+            self.hits += 1
+
+            return row[0]
+
+
+
+    def set(self, key, content):
+
+        now = time.time()
+
+        with self._lock:
+
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)", (key, content, now, now))
+
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+            if count > self.max_entries:
+
+                self._conn.execute(
+
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed LIMIT ?)",
+
+                    (count - self.max_entries,)
+
+                )
+
+            self._conn.commit()
+
+
+
+    def purge_expired(self):
+
+        with self._lock:
+
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl,))
+
+            self._conn.commit()
+
+
+
+    def stats(self):
+
+        with self._lock:
+
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+
+_llm_cache = None
+
+_llm_cache_lock = threading.Lock()
+
+
+
+def get_llm_cache():
+
+    """Return the process-wide LLM response cache"""
+
+    global _llm_cache
+
+    with _llm_cache_lock:
+
+        if _llm_cache is None:
+
+            _llm_cache = LLMResponseCache()
+
+        return _llm_cache
+
+
+
+_serp_cache = None
+
+
+
+def get_serp_cache():
+
+    """Return the process-wide search result cache"""
+
+    global _serp_cache
+
+    with _llm_cache_lock:
+
+        if _serp_cache is None:
+
+            _serp_cache = LLMResponseCache(SERP_CACHE_PATH, ttl=SERP_CACHE_TTL)
+
+        return _serp_cache
+
+
+
+def _cache_lookup(payload, use_cache, refresh_cache):
+
+    """Return (cache_key, cached_content) for a request, honouring the bypass and refresh flags"""
+
+    if not use_cache:
+
+        return None, None
+
+    key = LLMResponseCache.make_key(payload)
+
+    if refresh_cache:
+
+        return key, None
+
+    return key, get_llm_cache().get(key)
+
+
+
+def _cache_store(key, content):
+
+    if key is not None:
+
+        get_llm_cache().set(key, content)
+
+
+
+# Enhanced search functions for missing emails
+
+def fetch_search_results(params, use_cache=True, refresh_cache=False, throttle=contextlib.nullcontext):
+
+    """Run a SerpAPI search, caching the raw response on disk (the API key is not part of the key).
+
+
+
+    throttle() is entered around the API call only, so cache hits are never rate limited.
+
+    """
+
+    cache_key = hashlib.sha256(json.dumps(
+
+        {k: v for k, v in params.items() if k != "api_key"}, sort_keys=True
+
+    ).encode("utf-8")).hexdigest()
+
+    if use_cache and not refresh_cache:
+
+        cached = get_serp_cache().get(cache_key)
+
+        if cached is not None:
+
+            return json.loads(cached)
+
+    with throttle():
+
+        results = GoogleSearch(params).get_dict()
+
+    if use_cache and "error" not in results:
+
+        get_serp_cache().set(cache_key, json.dumps(results))
+
+    return results
+
+
+
+KNOWLEDGE_GRAPH_FIELDS = ["title", "type", "website", "founded", "headquarters", "revenue",
+
+                          "social", "mobile", "phone", "ceo", "email", "contact email",
+
+                          "address", "contact", "call", "chat", "connect", "write",
+
+                          "twitter", "instagram", "facebook"]
+
+EMAIL_IN_TEXT_REGEX = re.compile(r'[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}')
+
+CONTACT_WORDS = ('contact', 'email', 'e-mail', 'reach', 'support', 'sales', 'info')
+
+
+
+def _search_params(query, prompt, api_key):
+
+    try:
+
+        search_query = prompt.format(column_name=query)
+
+    except KeyError:
+
+        search_query = prompt.replace("{col_name}", query).replace("{column_name}", query)
+
+
+
+    return {
+
+        "engine": "google",
+
+        "q": search_query,
+
+        "num": 100,
+
+        "api_key": api_key
+
+    }
+
+
+
+def _estimate_text_tokens(text):
+
+    return len(text) // 4
+
+
+
+def _full_search_text(results):
+
+    """The untrimmed context: every knowledge graph field and every organic result"""
+
+    text_content = ""
+
+    if "knowledge_graph" in results:
+
+        knowledge = results["knowledge_graph"]
+
+        for key in KNOWLEDGE_GRAPH_FIELDS:
+
+            text_content += f"{knowledge.get(key, '')}\n"
+
+
+
+    for result in results.get("organic_results", []):
+
+        text_content += f"{result.get('title', 'N/A')} - {result.get('snippet', 'N/A')}\n"
+
+
+
+    return text_content
+
+
+
+def build_search_context(results, query, token_budget=SEARCH_CONTEXT_TOKEN_BUDGET, top_k=SEARCH_CONTEXT_TOP_K):
+
+    """Keep non-empty knowledge graph fields and the most relevant snippets within a token budget"""
+
+    lines = []
+
+    knowledge = results.get("knowledge_graph", {})
+
+    for key in KNOWLEDGE_GRAPH_FIELDS:
+
+        value = knowledge.get(key)
+
+        if value:
+
+            lines.append(f"{key}: {value}")
+
+
+
+    query_terms = set(re.findall(r'[a-z0-9]{3,}', str(query).lower()))
+
+
+
+    def relevance(result):
+
+        text = f"{result.get('title', '')} {result.get('snippet', '')}".lower()
+
+        score = len(query_terms & set(re.findall(r'[a-z0-9]{3,}', text)))
+
+        if '@' in text:
+
+            score += 3
+
+        if any(word in text for word in CONTACT_WORDS):
+
+            score += 1
+
+        return score
+
+
+
+    organic = sorted(results.get("organic_results", []), key=relevance, reverse=True)[:top_k]
+
+    used = sum(_estimate_text_tokens(line) for line in lines)
+
+    for result in organic:
+
+        line = f"{result.get('title', 'N/A')} - {result.get('snippet', 'N/A')}"
+
+        cost = _estimate_text_tokens(line)
+
+        if token_budget is not None and used + cost > token_budget:
+
+            break
+
+        lines.append(line)
+
+        used += cost
+
+    return "\n".join(lines)
+
+
+
+SECOND_LEVEL_LABELS = {'co', 'com', 'org', 'net', 'ac', 'gov', 'edu'}
+
+
+
+def _domain_matches_company(domain, company_words):
+
+    """True if the domain's name labels contain a company word as a whole token, or spell the whole name.
+
+
+
+    Tokens are labels split on hyphens, so "acme" matches acme.com and acme-labs.io but "co" or
+
+    "ai" never match unrelated domains by substring.
+
+    """
+
+    labels = domain.split('.')
+
+    # Drop the public suffix: the TLD, plus a second level such as co.uk
+
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS:
+
+        labels = labels[:-2]
+
+    else:
+
+        labels = labels[:-1]
+
+    tokens = {token for label in labels for token in label.split('-')}
+
+    terms = [word for word in company_words if len(word) >= 3 and word not in COMPANY_SUFFIXES]
+
+    joined = ''.join(word for word in company_words if word != '&')
+
+    return any(term in tokens for term in terms) or (len(joined) >= 3 and joined in labels)
+
+
+
+def extract_contact_candidates(results, company):
+
+    """Find email addresses in search results and score how likely each belongs to the company"""
+
+    knowledge = results.get("knowledge_graph", {})
+
+    texts = [str(value) for value in knowledge.values() if value]
+
+    links = []
+
+    for result in results.get("organic_results", []):
+
+        texts.append(f"{result.get('title', '')} {result.get('snippet', '')}")
+
+        links.append(str(result.get('link', '')))
+
+
+
+    website = normalize_company_query(knowledge.get("website", "")) if knowledge.get("website") else ""
+
+    company_words = normalize_company_query(company).replace('.', ' ').split()
+
+    link_domains = {normalize_company_query(link) for link in links if link}
+
+
+
+    counts = {}
+
+    for text in texts:
+
+        for email in EMAIL_IN_TEXT_REGEX.findall(text):
+
+            email = email.lower().rstrip('.')
+
+            counts[email] = counts.get(email, 0) + 1
+
+
+
+    candidates = []
+
+    for email, count in counts.items():
+
+        domain = email_domain(email)
+
+        confidence = 0.3
+
+        if website and (domain == website or domain.endswith('.' + website)):
+
+            confidence += 0.5
+
+        elif domain in link_domains:
+
+            confidence += 0.2
+
+        if _domain_matches_company(domain, company_words):
+
+            confidence += 0.3
+
+        confidence += 0.1 * min(count - 1, 2)
+
+        candidates.append({"email": email, "confidence": round(min(confidence, 1.0), 2), "mentions": count})
+
+    return sorted(candidates, key=lambda c: (-c["confidence"], -c["mentions"]))
+
+
+
+EMAIL_QUESTION_REGEX = re.compile(r'\be-?mails?\b', re.IGNORECASE)
+
+
+
+def resolve_contact(question, company, results, extract_fn, token_budget=SEARCH_CONTEXT_TOKEN_BUDGET,
+
+                    expects_email=None):
+
+    """Answer a contact question from search results, skipping the LLM when a confident email is found.
+
+
+
+    `results` is a SerpAPI response dict (or pre-built text context). expects_email says whether the
+
+    answer is an email address; by default it is inferred from the question. Returns (answer, report)
+
+    where report holds tokens_full, tokens_sent, tokens_saved and llm_skipped.
+
+    """
+
+    if isinstance(results, str):
+
+        tokens = _estimate_text_tokens(results)
+
+        return extract_fn(question, company, results), {"tokens_full": tokens, "tokens_sent": tokens,
+
+                                                        "tokens_saved": 0, "llm_skipped": False}
+
+
+
+    tokens_full = _estimate_text_tokens(_full_search_text(results))
+
+    if expects_email is None:
+
+        expects_email = EMAIL_QUESTION_REGEX.search(str(question)) is not None
+
+    if expects_email:
+
+        candidates = extract_contact_candidates(results, company)
+
+        if candidates and candidates[0]["confidence"] >= CONTACT_CONFIDENCE_THRESHOLD:
+
+            return candidates[0]["email"], {"tokens_full": tokens_full, "tokens_sent": 0,
+
+                                            "tokens_saved": tokens_full, "llm_skipped": True}
+
+
+
+    context = build_search_context(results, company, token_budget)
+
+    tokens_sent = _estimate_text_tokens(context)
+
+    return extract_fn(question, company, context), {"tokens_full": tokens_full, "tokens_sent": tokens_sent,
+
+                                                    "tokens_saved": max(tokens_full - tokens_sent, 0),
+
+                                                    "llm_skipped": False}
+
+
+
+def get_search_results(query, prompt, api_key, column_name, use_cache=True, token_budget=SEARCH_CONTEXT_TOKEN_BUDGET):
+
+    """Search for a company and return a relevance-trimmed text context (token_budget=None keeps everything)"""
+
+    results = fetch_search_results(_search_params(query, prompt, api_key), use_cache)
+
+    if token_budget is None:
+
+        return _full_search_text(results)
+
+    return build_search_context(results, query, token_budget)
+
+
+
+def ask_groq_api(question, company, context, api_key, use_cache=True, refresh_cache=False,
+
+                 throttle=contextlib.nullcontext):
+
+    """Extract one answer from the context; throttle() wraps each API request, never a cache hit"""
+
+    headers = {
+
+        "Authorization": f"Bearer {api_key}",
+
+        "Content-Type": "application/json"
+
+    }
+
+    prompt = f"""
+
+    You are an AI assistant specialized in extracting specific information from any data.
+
+    From the context and question provided, extract only the feature which is asked in the question.
+
+    Respond only with the asked feature, without any verbosity. Clean and exact answers only.
+
+
+
+    Question: {question}
+
+    Company: {company}
+
+    Context: {context}
+
+    """
+
+    payload = {
+
+        "model": "llama3-8b-8192",
+
+        "messages": [
+
+            {"role": "system", "content": "You are an assistant that extracts specific information from context."},
+
+            {"role": "user", "content": prompt}
+
+        ]
+
+    }
+
+    cache_key, cached = _cache_lookup(payload, use_cache, refresh_cache)
+
+    if cached is not None:
+
+        return cached
+
+    wait_time = 30
+
+    max_retries = 5
+
+
+
+    for attempt in range(max_retries):
+
+        try:
+
+            with throttle():
+
+                response = requests.post(GROQ_API_URL, headers=headers, json=payload)
+
+            if response.status_code == 200:
+
+                response_json = response.json()
+
+                content = response_json['choices'][0]['message']['content'].strip()
+
+                _cache_store(cache_key, content)
+
+                return content
+
+            elif response.status_code == 429:
+
+                print(f"Rate limit reached. Waiting for {wait_time} seconds before retrying...")
+
+                time.sleep(wait_time)
+
+                wait_time *= 2
+
+            else:
+
+                return f"Error: {response.status_code}, {response.text}"
+
+        except Exception as e:
+
+            return f"Error: {str(e)}"
+
+    return "Error: Max retries exceeded. Please try again later."
+
+
+
+# Bulk email finder
+
+COMPANY_SUFFIXES = {'inc', 'incorporated', 'llc', 'ltd', 'limited', 'corp', 'corporation', 'co', 'company',
+
+                    'gmbh', 'plc', 'pvt', 'private', 'sa', 'ag', 'bv', 'pty'}
+
+
+
+def normalize_company_query(name):
+
+    """Normalize a company name or URL so equivalent lookups share one search"""
+
+    text = str(name or '').strip().lower()
+
+    domain_match = re.match(r'^(?:https?://)?(?:www\.)?([a-z0-9-]+(?:\.[a-z0-9-]+)+)(?:[/:?#].*)?$', text)
+
+    if domain_match and ' ' not in text:
+
+        return domain_match.group(1)
+
+    words = re.sub(r'[^a-z0-9&]+', ' ', text).split()
+
+    while len(words) > 1 and words[-1] in COMPANY_SUFFIXES:
+
+        words.pop()
+
+    return ' '.join(words)
+
+
+
+def find_emails_bulk(companies, prompt, question, serp_api_key=None, groq_api_key=None, domains=None,
+
+                     search_fn=None, extract_fn=None, progress_callback=None):
+
+    """Look up contact details for many companies, one search + extraction per unique company or domain.
+
+
+
+    SerpAPI and Groq calls run concurrently under their own PROVIDER_LIMITS rate and connection caps,
+
+    and Groq is skipped when the results already contain a confident match (see resolve_contact).
+
+    search_fn(query, throttle) -> SerpAPI-style dict and extract_fn(question, company, context, throttle)
+
+    can replace the real APIs, e.g. with local stubs for offline throughput runs; they must enter
+
+    throttle() around each real API call and skip it for cached answers, as the defaults do.
+
+    progress_callback receives (done, total, company, answer, report). Returns a list of answers
+
+    aligned with `companies`.
+
+    """
+
+    serp_api_key = serp_api_key or SERP_API_KEY
+
+    groq_api_key = groq_api_key or GROQ_API_KEY
+
+    search_fn = search_fn or (lambda query, throttle: fetch_search_results(_search_params(query, prompt, serp_api_key),
+
+                                                                           throttle=throttle))
+
+    extract_fn = extract_fn or (lambda q, company, context, throttle: ask_groq_api(q, company, context, groq_api_key,
+
+                                                                                   throttle=throttle))
+
+
+
+    companies = list(companies)
+
+    domains = list(domains) if domains is not None else [None] * len(companies)
+
+    keys = [normalize_company_query(domain) if domain and not pd.isna(domain) else normalize_company_query(company)
+
+            for company, domain in zip(companies, domains)]
+
+    lookups = {}
+
+    for key, company in zip(keys, companies):
+
+        lookups.setdefault(key, company)
+
+
+
+    serp_limiter, groq_limiter = get_rate_limiter("serpapi"), get_rate_limiter("groq")
+
+    serp_slots = threading.BoundedSemaphore(PROVIDER_LIMITS["serpapi"]["max_connections"])
+
+    groq_slots = threading.BoundedSemaphore(PROVIDER_LIMITS["groq"]["max_connections"])
+
+    done = [0]
+
+    done_lock = threading.Lock()
+
+
+
+    # Connection slots and rate tokens are taken only when a request actually goes out
+
+    @contextlib.contextmanager
+
+    def serp_throttle():
+
+        with serp_slots:
+
+            serp_limiter.acquire()
+
+            yield
+
+
+
+    @contextlib.contextmanager
+
+    def groq_throttle():
+
+        with groq_slots:
+
+            groq_limiter.acquire()
+
+            yield
+
+
+
+    def limited_extract(q, company, context):
+
+        return extract_fn(q, company, context, groq_throttle)
+
+
+
+    def lookup(item):
+
+        key, company = item
+
+        report = None
+
+        try:
+
+            results = search_fn(str(company), serp_throttle)
+
+            answer, report = resolve_contact(question, str(company), results, limited_extract)
+
+        except Exception as e:
+
+            answer = f"Error: {str(e)}"
+
+        with done_lock:
+
+            done[0] += 1
+
+            if progress_callback:
+
+                progress_callback(done[0], len(lookups), company, answer, report)
+
+        return key, answer
+
+
+
+    workers = PROVIDER_LIMITS["serpapi"]["max_connections"] + PROVIDER_LIMITS["groq"]["max_connections"]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        answers = dict(executor.map(lookup, lookups.items()))
+
+
+
+    return [answers[key] for key in keys]
+
+
+
+class EmailGenerationError(Exception):
+
+    """The model returned no usable email content; callers must not send anything in its place"""
+
+
+
+def _email_content_payload(template, company_info):
+
+    """Build the chat completion request for the email body"""
+
+    prompt = f"""
+
+    You are an expert email writer specializing in business communications that avoid spam filters.
+
+    Generate a professional, personalized email that follows these deliverability best practices:
+
+
+
+    Template/Instructions: {template}
+
+    
+
+    Company Information (use this to personalize the email):
+
+    {company_info}
+
+    
+
+    IMPORTANT DELIVERABILITY RULES:
+
+    1. Use professional, conversational tone (not overly salesy)
+
+    2. Avoid spam trigger words like "FREE", "URGENT", "GUARANTEED", excessive exclamation marks
+
+    3. Include specific, relevant details about the company from the provided information
+
+    4. Make it sound like genuine business correspondence
+
+    5. Keep subject line under 50 characters
+
+    6. Use proper sentence structure and grammar
+
+    7. Include a clear but subtle call-to-action
+
+    8. Personalize with specific company details from the provided information
+
+    9. Reference specific company attributes like industry, location, size, etc. when available
+
+    
+
+    Generate only the email content without any additional text or explanations.
+
+    Make sure to use the company information provided to create a highly personalized message.
+
+    """
+
+    
+
+    payload = {
+
+        "model": "llama3-8b-8192",
+
+        "messages": [
+
+            {"role": "system", "content": "You are a professional email writer who creates highly personalized, spam-filter-friendly business emails using comprehensive company data."},
+
+            {"role": "user", "content": prompt}
+
+        ],
+
+        "temperature": 0.7,
+
+        "max_tokens": 1000
+
+    }
+
+
+
+    return payload
+
+
+
+def _completion_content(response):
+
+    """Message text of a chat completion response, raising EmailGenerationError for anything but a 200"""
+
+    if response is None:
+
+        raise EmailGenerationError("Error generating content: rate limit retries exhausted")
+
+    if response.status_code != 200:
+
+        raise EmailGenerationError(f"Error generating content: {response.status_code}, {response.text}")
+
+    try:
+
+        return response.json()['choices'][0]['message']['content'].strip()
+
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+
+        raise EmailGenerationError(f"Error generating content: malformed response ({e})") from e
+
+
+
+def generate_email_content(template, company_name, company_info, api_key, use_cache=True, refresh_cache=False):
+
+    """Generate personalized email content using comprehensive company data.
+
+
+
+    Raises EmailGenerationError when the API fails, so an error message is never mailed as a body.
+
+    """
+
+    headers = {
+
+        "Authorization": f"Bearer {api_key}",
+
+        "Content-Type": "application/json"
+
+    }
+
+    payload = _email_content_payload(template, company_info)
+
+
+
+    cache_key, cached = _cache_lookup(payload, use_cache, refresh_cache)
+
+    if cached is not None:
+
+        return cached
+
+
+
+    wait_time = 30
+
+    max_retries = 3
+
+
+
+    for attempt in range(max_retries):
+
+        try:
+
+            response = requests.post(GROQ_API_URL, headers=headers, json=payload)
+
+        except requests.RequestException as e:
+
+            raise EmailGenerationError(f"Error generating content: {str(e)}") from e
+
+        if response.status_code == 429:
+
+            print(f"Rate limit reached. Waiting for {wait_time} seconds before retrying...")
+
+            time.sleep(wait_time)
+
+            wait_time *= 2
+
+            continue
+
+        generated_content = _completion_content(response)
+
+        _cache_store(cache_key, generated_content)
+
+        return generated_content
+
+
+
+    raise EmailGenerationError("Error: Could not generate email content. Please try again later.")
+
+
+
+def _email_subject_payload(template, company_info):
+
+    """Build the chat completion request for the subject line"""
+
+    prompt = f"""
+
+    Generate a professional email subject line that will pass spam filters.
+
+
+
+    Template/Instructions: {template}
+
+    
+
+    Company Information (use this to personalize):
+
+    {company_info}
+
+
+
+    DELIVERABILITY RULES:
+
+    1. Keep under 50 characters
+
+    2. Avoid ALL CAPS, excessive punctuation (!!!), and spam words
+
+    3. Make it specific and personalized using the company information
+
+    4. Sound like genuine business correspondence
+
+    5. Include company name or specific detail naturally
+
+    6. Avoid words like: FREE, URGENT, GUARANTEED, AMAZING, INCREDIBLE
+
+    7. Use title case or sentence case
+
+    8. Do not include any newline characters
+
+
+
+    Generate only the subject line without any additional text.
+
+    """
+
+
+
+    payload = {
+
+        "model": "llama3-8b-8192",
+
+        "messages": [
+
+            {"role": "system", "content": "You are an expert at creating professional, spam-filter-friendly email subject lines using company data."},
+
+            {"role": "user", "content": prompt}
+
+        ],
+
+        "temperature": 0.7,
+
+        "max_tokens": 100
+
+    }
+
+
+
+    return payload
+
+
+
+def generate_email_subject(template, company_name, company_info, api_key, use_cache=True, refresh_cache=False):
+
+    """Generate personalized email subject using comprehensive company data"""
+
+    headers = {
+
+        "Authorization": f"Bearer {api_key}",
+
+        "Content-Type": "application/json"
+
+    }
+
+    payload = _email_subject_payload(template, company_info)
+
+
+
+    cache_key, cached = _cache_lookup(payload, use_cache, refresh_cache)
+
+    if cached is not None:
+
+        return cached
+
+
+
+    try:
+
+        response = requests.post(GROQ_API_URL, headers=headers, json=payload)
+
+        if response.status_code == 200:
+
+            response_json = response.json()
+
+            subject = response_json['choices'][0]['message']['content'].strip().replace('\n', '')
+
+            _cache_store(cache_key, subject)
+
+            return subject
+
+        else:
+
+            return template.replace("{company_name}", company_name)
+
+    except Exception as e:
+
+        return template.replace("{company_name}", company_name)
+
+
+
+def _parse_combined_email(content):
+
+    """Validate a JSON subject/body response, returning (subject, body) or None"""
+
+    try:
+
+        data = json.loads(content)
+
+    except (TypeError, ValueError):
+
+        match = re.search(r'\{.*\}', content or '', re.DOTALL)
+
+        if not match:
+
+            return None
+
+        try:
+
+            data = json.loads(match.group(0))
+
+        except ValueError:
+
+            return None
+
+    if not isinstance(data, dict):
+
+        return None
+
+    subject, body = data.get("subject"), data.get("body")
+
+    if not isinstance(subject, str) or not isinstance(body, str) or not subject.strip() or not body.strip():
+
+        return None
+
+    return subject.strip().replace('\n', ''), body.strip()
+
+
+
+def _combined_email_payload(template, company_info):
+
+    """Build the chat completion request for combined subject and body generation"""
+
+    prompt = f"""
+
+    You are an expert email writer specializing in business communications that avoid spam filters.
+
+    Write a professional, personalized email and its subject line.
+
+
+
+    Template/Instructions: {template}
+
+    
+
+    Company Information (use this to personalize the email):
+
+    {company_info}
+
+    
+
+    IMPORTANT DELIVERABILITY RULES:
+
+    1. Use professional, conversational tone (not overly salesy)
+
+    2. Avoid spam trigger words like "FREE", "URGENT", "GUARANTEED", excessive exclamation marks
+
+    3. Include specific, relevant details about the company from the provided information
+
+    4. Make it sound like genuine business correspondence
+
+    5. Keep the subject line under 50 characters, in title or sentence case, with no newlines
+
+    6. Use proper sentence structure and grammar
+
+    7. Include a clear but subtle call-to-action
+
+    8. Reference specific company attributes like industry, location, size, etc. when available
+
+
+
+    Respond only with a JSON object of the form {{"subject": "...", "body": "..."}}.
+
+    """
+
+
+
+    payload = {
+
+        "model": "llama3-8b-8192",
+
+        "messages": [
+
+            {"role": "system", "content": "You are a professional email writer who creates highly personalized, spam-filter-friendly business emails and replies in JSON."},
+
+            {"role": "user", "content": prompt}
+
+        ],
+
+        "temperature": 0.7,
+
+        "max_tokens": 1100,
+
+        "response_format": {"type": "json_object"}
+
+    }
+
+
+
+    return payload
+
+
+
+def generate_email_with_subject(subject_template, body_template, company_name, company_info, api_key,
+
+                                use_cache=True, refresh_cache=False):
+
+    """Generate subject and body in one request, falling back to separate calls if the JSON is unusable.
+
+
+
+    Raises EmailGenerationError when the API itself fails; the fallback only covers malformed output.
+
+    """
+
+    headers = {
+
+        "Authorization": f"Bearer {api_key}",
+
+        "Content-Type": "application/json"
+
+    }
+
+    payload = _combined_email_payload(_combined_template(subject_template, body_template), company_info)
+
+
+
+    cache_key, cached = _cache_lookup(payload, use_cache, refresh_cache)
+
+    parsed = _parse_combined_email(cached) if cached is not None else None
+
+    if parsed is not None:
+
+        return parsed
+
+
+
+    wait_time = 30
+
+    max_retries = 3
+
+
+
+    for attempt in range(max_retries):
+
+        try:
+
+            response = requests.post(GROQ_API_URL, headers=headers, json=payload)
+
+        except requests.RequestException as e:
+
+            raise EmailGenerationError(f"Error generating content: {str(e)}") from e
+
+        if response.status_code != 429:
+
+            break
+
+        print(f"Rate limit reached. Waiting for {wait_time} seconds before retrying...")
+
+        time.sleep(wait_time)
+
+        wait_time *= 2
+
+    else:
+
+        response = None
+
+
+
+    content = _completion_content(response)
+
+    parsed = _parse_combined_email(content)
+
+    if parsed is not None:
+
+        _cache_store(cache_key, content)
+
+        return parsed
+
+
+
+    # Unusable JSON: fall back to the two-call path
+
+    subject = generate_email_subject(subject_template, company_name, company_info, api_key, use_cache, refresh_cache)
+
+    body = generate_email_content(body_template, company_name, company_info, api_key, use_cache, refresh_cache)
+
+    return subject, body
+
+
+
+# HTML email layouts. $body, $title and $tracking_pixel are filled in per message.
+
+EMAIL_LAYOUTS = {
+
+    "default": """
+
+    <!DOCTYPE html>
+
+    <html>
+
+    <head>
+
+        <meta charset="UTF-8">
+
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+
+        <title>$title</title>
+
+    </head>
+
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333; max-width: 600px; margin: 0 auto; padding: 20px;">
+
+        <div style="background-color: #f8f9fa; padding: 20px; border-radius: 10px; margin-bottom: 20px;">
+
+            <div style="background-color: white; padding: 30px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1);">
+
+                <div style="white-space: pre-line; margin-bottom: 20px;">$body</div>
+
+                
+
+                <hr style="border: none; height: 1px; background-color: #e9ecef; margin: 20px 0;">
+
+                
+
+                <div style="font-size: 12px; color: #6c757d; text-align: center;">
+
+                    <p>This email was sent by AutoMail Email System</p>
+
+                    <p>If you'd like to unsubscribe, please reply with "UNSUBSCRIBE" in the subject line.</p>
+
+                </div>
+
+            </div>
+
+        </div>
+
+        $tracking_pixel
+
+    </body>
+
+    </html>
+
+    """,
+
+    "plain": """
+
+    <!DOCTYPE html>
+
+    <html>
+
+    <head>
+
+        <meta charset="UTF-8">
+
+        <title>$title</title>
+
+    </head>
+
+    <body style="font-family: Arial, sans-serif; line-height: 1.5; color: #222;">
+
+        <div style="white-space: pre-line;">$body</div>
+
+        <p style="font-size: 12px; color: #6c757d;">To unsubscribe, reply with "UNSUBSCRIBE" in the subject line.</p>
+
+        $tracking_pixel
+
+    </body>
+
+    </html>
+
+    """,
+
+}
+
+
+
+_compiled_layouts = {}
+
+_compiled_layouts_lock = threading.Lock()
+
+
+
+def minify_html(markup):
+
+    """Strip indentation and whitespace between tags"""
+
+    markup = re.sub(r'>\s+<', '><', markup.strip())
+
+    return re.sub(r'\s*\n\s*', ' ', markup)
+
+
+
+class CompiledLayout:
+
+    """A layout pre-split around its $placeholders, so rendering is a single join instead of a Template scan"""
+
+
+
+    def __init__(self, markup):
+
+        self.pieces, self.fields = [], []
+
+        literal, last = [], 0
+
+        for match in Template.pattern.finditer(markup):
+
+            literal.append(markup[last:match.start()])
+
+            name = match.group("named") or match.group("braced")
+
+            if name is not None:
+
+                self.pieces.append("".join(literal))
+
+                self.fields.append((len(self.pieces), name))
+
+                self.pieces.append("")
+
+                literal = []
+
+            elif match.group("escaped") is not None:
+
+                literal.append("$")
+
+            else:
+
+                raise ValueError(f"Invalid placeholder in layout at position {match.start()}")
+
+            last = match.end()
+
+        literal.append(markup[last:])
+
+        self.pieces.append("".join(literal))
+
+
+
+    def substitute(self, **values):
+
+        pieces = self.pieces.copy()
+
+        for index, name in self.fields:
+
+            pieces[index] = str(values[name])
+
+        return "".join(pieces)
+
+
+
+def register_email_layout(name, markup):
+
+    """Add or replace a named layout; it is compiled on first use"""
+
+    with _compiled_layouts_lock:
+
+        EMAIL_LAYOUTS[name] = markup
+
+        _compiled_layouts.pop(name, None)
+
+
+
+def get_email_layout(name="default"):
+
+    """Return the minified, compiled layout, compiling it only once"""
+
+    layout = _compiled_layouts.get(name)
+
+    if layout is None:
+
+        with _compiled_layouts_lock:
+
+            layout = _compiled_layouts.get(name)
+
+            if layout is None:
+
+                layout = CompiledLayout(minify_html(EMAIL_LAYOUTS[name]))
+
+                _compiled_layouts[name] = layout
+
+    return layout
+
+
+
+def _click_signature(tracking_id, url):
+
+    message = f"{tracking_id}:{url}".encode("utf-8")
+
+    return hmac.new(TRACKING_SECRET.encode("utf-8"), message, hashlib.sha256).hexdigest()[:16]
+
+
+
+def _pixel_signature(tracking_id):
+
+    # "open" is never a valid click target, so a pixel signature cannot be replayed as a click
+
+    return _click_signature(tracking_id, "open")
+
+
+
+def tracking_pixel_path(tracking_id):
+
+    """Pixel path for a message, signed like click links when TRACKING_SECRET is set"""
+
+    path = f"/pixel/{quote(str(tracking_id))}"
+
+    return f"{path}?sig={_pixel_signature(tracking_id)}" if TRACKING_SECRET else path
+
+
+
+def tracking_pixel_html(tracking_id):
+
+    if not tracking_id:
+
+        return ""
+
+    return f'<img src="{TRACKING_BASE_URL}{tracking_pixel_path(tracking_id)}" width="1" height="1" style="display:none;" alt="">'
+
+
+
+def tracking_click_url(tracking_id, url):
+
+    """Signed link through the tracking service that records a click and redirects to `url`"""
+
+    if not tracking_id or not TRACKING_SECRET:
+
+        return url
+
+    return (f"{TRACKING_BASE_URL}/click/{quote(str(tracking_id))}"
+
+            f"?url={quote(url, safe='')}&sig={_click_signature(tracking_id, url)}")
+
+
+
+URL_IN_TEXT_REGEX = re.compile(r'https?://[^\s<>"\']*[^\s<>"\'.,;:!?)\]]')
+
+
+
+def html_body_with_links(plain_text, tracking_id=None):
+
+    """Escape a plain-text body for HTML, turning its URLs into links (tracked when tracking_id is set)"""
+
+    text = (plain_text or "").strip()
+
+    if "://" not in text:
+
+        return html.escape(text)
+
+    parts, last = [], 0
+
+    for match in URL_IN_TEXT_REGEX.finditer(text):
+
+        url = match.group(0)
+
+        parts.append(html.escape(text[last:match.start()]))
+
+        parts.append(f'<a href="{html.escape(tracking_click_url(tracking_id, url))}">{html.escape(url)}</a>')
+
+        last = match.end()
+
+    parts.append(html.escape(text[last:]))
+
+    return "".join(parts)
+
+
+
+def create_html_email_body(plain_text, company_name, tracking_id=None, layout="default"):
+
+    """Create HTML email body with better formatting and optional tracking"""
+
+    return get_email_layout(layout).substitute(
+
+        title="Email from AutoMail",
+
+        body=html_body_with_links(plain_text, tracking_id),
+
+        tracking_pixel=tracking_pixel_html(tracking_id),
+
+    )
+
+
+
+def render_html_email_batch(plain_texts, company_names, tracking_ids=None, layout="default"):
+
+    """Render many HTML bodies with one compiled layout"""
+
+    template = get_email_layout(layout)
+
+    tracking_ids = tracking_ids if tracking_ids is not None else [None] * len(plain_texts)
+
+    return [
+
+        template.substitute(title="Email from AutoMail", body=html_body_with_links(text, tracking_id),
+
+                            tracking_pixel=tracking_pixel_html(tracking_id))
+
+        for text, tracking_id in zip(plain_texts, tracking_ids)
+
+    ]
+
+
+
+# Pooled SMTP transport
+
+class SMTPConnectionPool:
+
+    """Keeps a bounded set of authenticated SMTP sessions open and reuses them across messages"""
+
+
+
+    def __init__(self, host, port, username=None, password=None, size=SMTP_POOL_SIZE,
+
+                 max_messages_per_connection=SMTP_MAX_MESSAGES_PER_CONNECTION,
+
+                 keepalive_interval=SMTP_KEEPALIVE_INTERVAL, use_tls=True, timeout=30):
+
+        self.host = host
+
+        self.port = port
+
+        self.username = username
+
+        self.password = password
+
+        self.size = size
+
+        self.max_messages_per_connection = max_messages_per_connection
+
+        self.keepalive_interval = keepalive_interval
+
+        self.use_tls = use_tls
+
+        self.timeout = timeout
+
+        self._idle = queue.LifoQueue()
+
+        self._slots = threading.BoundedSemaphore(size)
+
+        self._closed = False
+
+
+
+    def _connect(self):
+
+        """Open, secure and authenticate a new SMTP session"""
+
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+
+        if self.use_tls:
+
+            server.starttls()
+
+        if self.username:
+
+            server.login(self.username, self.password)
+
+        return {"server": server, "sent": 0, "last_used": time.monotonic()}
+
+
+
+    def _discard(self, conn):
+
+        """Close a session without raising if the server already dropped it"""
+
+        try:
+
+            conn["server"].quit()
+
+        except Exception:
+
+            try:
+
+                conn["server"].close()
+
+            except Exception:
+
+                pass
+
+
+
+    def _is_alive(self, conn):
+
+        """Reset an idle session and probe it with NOOP if it has been idle too long"""
+
+        try:
+
+            server = conn["server"]
+
+            if time.monotonic() - conn["last_used"] > self.keepalive_interval:
+
+                if server.noop()[0] != 250:
+
+                    return False
+
+            return server.rset()[0] == 250
+
+        except (smtplib.SMTPException, OSError):
+
+            return False
+
+
+
+    def _acquire(self):
+
+        self._slots.acquire()
+
+        try:
+
+            while True:
+
+                try:
+
+                    conn = self._idle.get_nowait()
+
+                except queue.Empty:
+
+                    return self._connect()
+
+                if self._is_alive(conn):
+
+                    return conn
+
+                self._discard(conn)
+
+        except Exception:
+
+            self._slots.release()
+
+            raise
+
+
+
+    def _release(self, conn, healthy=True):
+
+        if conn is not None:
+
+            if healthy and not self._closed and conn["sent"] < self.max_messages_per_connection:
+
+                conn["last_used"] = time.monotonic()
+
+                self._idle.put(conn)
+
+            else:
+
+                self._discard(conn)
+
+        self._slots.release()
+
+
+
+    def sendmail(self, from_addr, to_addrs, msg, retries=1):
+
+        """Send one message over a pooled session, reconnecting on 421 or dropped connections.
+
+
+
+        Only failures that mean the message was not accepted are retried: errors while connecting,
+
+        a session the server already dropped, or a 421. Timeouts and other socket errors mid-send
+
+        are raised, since the server may have taken the message.
+
+        """
+
+        for attempt in range(retries + 1):
+
+            try:
+
+                conn = self._acquire()
+
+            except (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected, ConnectionError, socket.gaierror):
+
+                if attempt >= retries:
+
+                    raise
+
+                continue
+
+            try:
+
+                result = conn["server"].sendmail(from_addr, to_addrs, msg)
+
+                conn["sent"] += 1
+
+                self._release(conn)
+
+                return result
+
+            except smtplib.SMTPServerDisconnected:
+
+                self._release(conn, healthy=False)
+
+                if attempt >= retries:
+
+                    raise
+
+            except smtplib.SMTPResponseException as e:
+
+                # 421 means the server is closing the session; anything else is a real rejection
+
+                self._release(conn, healthy=False)
+
+                if e.smtp_code != 421 or attempt >= retries:
+
+                    raise
+
+            except (smtplib.SMTPException, OSError):
+
+                self._release(conn, healthy=False)
+
+                raise
+
+
+
+    def close(self):
+
+        """Close every idle session in the pool"""
+
+        self._closed = True
+
+        while True:
+
+            try:
+
+                self._discard(self._idle.get_nowait())
+
+            except queue.Empty:
+
+                break
+
+
+
+_smtp_pool = None
+
+_smtp_pool_lock = threading.Lock()
+
+
+
+def get_smtp_pool():
+
+    """Return the process-wide SMTP pool for the configured Mailjet account"""
+
+    global _smtp_pool
+
+    with _smtp_pool_lock:
+
+        if _smtp_pool is None:
+
+            _smtp_pool = SMTPConnectionPool(SMTP_HOST, SMTP_PORT, MAILJET_API_KEY, MAILJET_SECRET_KEY)
+
+        return _smtp_pool
+
+
+
+def deliverability_to_status(deliverability_score):
+
+    """Map a deliverability score to the delivery status recorded for a sent email"""
+
+    return "primary" if deliverability_score >= 80 else "spam_risk"
+
+
+
+def build_email_message(receiver_email, subject, body, company_name, email_id, layout="default", sender_email=None,
+
+                        sender_name="BreakoutAI Team"):
+
+    """Build the plain text + HTML message for one recipient, returning (msg, clean_subject)"""
+
+    sender_email = sender_email or EMAIL
+
+
+
+    # Create multipart message with both plain text and HTML
+
+    msg = MIMEMultipart('alternative')
+
+    msg['From'] = f"{sender_name} <{sender_email}>"
+
+    msg['To'] = receiver_email
+
+
+
+    # Ensure subject line doesn't contain newlines
+
+    clean_subject = subject.replace('\n', '') if subject else f"Partnership Opportunity for {company_name}"
+
+    msg['Subject'] = clean_subject
+
+
+
+    # Add custom headers to improve deliverability
+
+    msg['Reply-To'] = sender_email
+
+    msg['Return-Path'] = sender_email
+
+    msg['X-Mailer'] = 'BreakoutAI Email System v2.0'
+
+    msg['X-Priority'] = '3'
+
+    msg['Message-ID'] = f"<{email_id}@breakoutai.com>"
+
+
+
+    # Ensure body is not None
+
+    email_body = body if body else "Thank you for your time."
+
+
+
+    # Create plain text and HTML versions
+
+    text_part = MIMEText(email_body, 'plain', 'utf-8')
+
+    html_part = MIMEText(create_html_email_body(email_body, company_name, email_id, layout), 'html', 'utf-8')
+
+
+
+    # Attach parts
+
+    msg.attach(text_part)
+
+    msg.attach(html_part)
+
+
+
+    return msg, clean_subject
+
+
+
+def _wire_policy(receiver_email):
+
+    """Serialization policy for a recipient; internationalized addresses can only be sent as SMTPUTF8"""
+
+    return email.policy.SMTP if str(receiver_email).isascii() else email.policy.SMTPUTF8
+
+
+
+class CampaignMessageFactory:
+
+    """Serializes a campaign message once and fills in only the per-recipient fields.
+
+
+
+    To, Message-ID and the tracking pixel are left as placeholder tokens in a message built with
+
+    email.policy.SMTP; the HTML part is quoted-printable so the tokens survive encoding intact.
+
+    render() then returns wire-ready bytes for sendmail with a few byte replacements. When the
+
+    body has links to track, they carry the recipient's id, so the whole HTML part is a token.
+
+    """
+
+
+
+    def __init__(self, subject, body, layout="default", sender_email=None, sender_name="BreakoutAI Team"):
+
+        self.subject = subject
+
+        self.body = body
+
+        self.layout = layout
+
+        self.sender_email = sender_email or EMAIL
+
+        self.sender_name = sender_name
+
+        token = uuid.uuid4().hex
+
+        self._to_token = f"AMTO{token}".encode("ascii")
+
+        self._id_token = f"AMID{token}".encode("ascii")
+
+        self._pixel_token = f"AMPX{token}".encode("ascii")
+
+        self._html_token = f"AMHT{token}".encode("ascii")
+
+        self.tracks_clicks = bool(TRACKING_SECRET) and URL_IN_TEXT_REGEX.search(body) is not None
+
+
+
+        msg = EmailMessage(policy=email.policy.SMTP)
+
+        msg['From'] = f"{sender_name} <{self.sender_email}>"
+
+        msg['To'] = self._to_token.decode("ascii")
+
+        msg['Subject'] = subject
+
+        msg['Reply-To'] = self.sender_email
+
+        msg['Return-Path'] = self.sender_email
+
+        msg['X-Mailer'] = 'BreakoutAI Email System v2.0'
+
+        msg['X-Priority'] = '3'
+
+        msg['Message-ID'] = f"<{self._id_token.decode('ascii')}@breakoutai.com>"
+
+        msg.set_content(body, cte='quoted-printable')
+
+        if self.tracks_clicks:
+
+            msg.add_alternative(f"\n{self._html_token.decode('ascii')}\n", subtype='html', charset='utf-8',
+
+                                cte='quoted-printable')
+
+        else:
+
+            html_body = get_email_layout(layout).substitute(
+
+                title="Email from AutoMail",
+
+                body=html_body_with_links(body),
+
+                tracking_pixel=f"\n{self._pixel_token.decode('ascii')}\n",
+
+            )
+
+            msg.add_alternative(html_body, subtype='html', cte='quoted-printable')
+
+        self._template = msg.as_bytes()
+
+        per_recipient = self._html_token if self.tracks_clicks else self._pixel_token
+
+        self.fast = all(self._template.count(t) == 1 for t in (self._to_token, self._id_token, per_recipient))
+
+
+
+    def render(self, receiver_email, email_id):
+
+        """Wire-format bytes for one recipient"""
+
+        if not self.fast or not str(receiver_email).isascii():
+
+            msg, _ = build_email_message(receiver_email, self.subject, self.body, "", email_id, self.layout,
+
+                                         self.sender_email, self.sender_name)
+
+            return msg.as_bytes(policy=_wire_policy(receiver_email))
+
+        if self.tracks_clicks:
+
+            token, html_part = self._html_token, create_html_email_body(self.body, "", email_id, self.layout)
+
+        else:
+
+            token, html_part = self._pixel_token, tracking_pixel_html(email_id)
+
+        # Quoted-printable works on the UTF-8 bytes, read as latin-1 the way the email package does
+
+        encoded = email.quoprimime.body_encode(html_part.encode("utf-8").decode("latin-1"), eol="\r\n")
+
+        return (self._template
+
+                .replace(self._to_token, str(receiver_email).encode("ascii"))
+
+                .replace(self._id_token, str(email_id).encode("ascii"))
+
+                .replace(token, encoded.encode("ascii")))
+
+
+
+@functools.lru_cache(maxsize=256)
+
+def get_message_factory(subject, body, layout="default", sender_email=None):
+
+    """Shared factory per distinct (subject, body, layout), so a static campaign body is encoded once.
+
+
+
+    Only for content shared by many recipients; a personalized body would just fill the cache.
+
+    """
+
+    return CampaignMessageFactory(subject, body, layout, sender_email)
+
+
+
+def build_email_bytes(receiver_email, subject, body, company_name, email_id, layout="default", shared=False):
+
+    """Serialize one recipient's message, returning (message_bytes, clean_subject).
+
+
+
+    shared=True means the same subject and body go to many recipients, so they are encoded once
+
+    through a cached CampaignMessageFactory; personalized messages are built directly.
+
+    """
+
+    if not shared:
+
+        msg, clean_subject = build_email_message(receiver_email, subject, body, company_name, email_id, layout)
+
+        return msg.as_bytes(policy=_wire_policy(receiver_email)), clean_subject
+
+    # Ensure subject line doesn't contain newlines and body is not None
+
+    clean_subject = subject.replace('\n', '') if subject else f"Partnership Opportunity for {company_name}"
+
+    email_body = body if body else "Thank you for your time."
+
+    factory = get_message_factory(clean_subject, email_body, layout, EMAIL)
+
+    return factory.render(receiver_email, email_id), clean_subject
+
+
+
+def send_email_enhanced(receiver_email, subject, body, company_name="Unknown Company", email_id=None, layout="default"):
+
+    """Enhanced email sending with better deliverability practices"""
+
+
+
+    email_id = email_id or str(uuid.uuid4())
+
+    receiver_email = normalize_email(receiver_email)
+
+
+
+    # Validate email
+
+    if not is_valid_email(receiver_email):
+
+        log_email_status(email_id, receiver_email, company_name, subject, "failed", "invalid_email", "Invalid email address")
+
+        return False, f"Invalid email address: {receiver_email}", email_id
+
+
+
+    # Check deliverability score
+
+    deliverability_score, warnings = validate_email_deliverability(receiver_email)
+
+
+
+    # Check if required environment variables are set
+
+    if not EMAIL or not MAILJET_API_KEY or not MAILJET_SECRET_KEY:
+
+        error_msg = "Missing email configuration. Check environment variables."
+
+        log_email_status(email_id, receiver_email, company_name, subject, "failed", "config_error", error_msg)
+
+        return False, error_msg, email_id
+
+
+
+    sender_email = EMAIL
+
+    message_bytes, clean_subject = build_email_bytes(receiver_email, subject, body, company_name, email_id, layout)
+
+
+
+    try:
+
+        # Send over a pooled, already authenticated SMTP session
+
+        get_smtp_pool().sendmail(sender_email, receiver_email, message_bytes)
+
+
+
+        # Log successful send
+
+        delivery_status = deliverability_to_status(deliverability_score)
+
+        log_email_status(email_id, receiver_email, company_name, clean_subject, "sent", delivery_status)
+
+        message = f"Email sent successfully to {receiver_email}"
+
+        if warnings:
+
+            message += f" (Warnings: {', '.join(warnings)})"
+
+        return True, message, email_id
+
+
+
+    except Exception as e:
+
+        error_msg = f"Failed to send email: {str(e)}"
+
+        log_email_status(email_id, receiver_email, company_name, clean_subject, "failed", "send_error", error_msg)
+
+        return False, error_msg, email_id
+
+
+
+# Async AI personalization
+
+def _parse_rate_limit_delay(value):
+
+    """Convert a Retry-After or x-ratelimit-reset header (e.g. "12", "7.5s", "1m30s", "250ms") to seconds"""
+
+    if not value:
+
+        return None
+
+    try:
+
+        return float(value)
+
+    except ValueError:
+
+        pass
+
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+    parts = re.findall(r'([\d.]+)(ms|h|m|s)', value)
+
+    return sum(float(amount) * units[unit] for amount, unit in parts) if parts else None
+
+
+
+def _estimate_request_tokens(payload):
+
+    """Rough token estimate for a request: prompt characters / 4 plus the completion budget"""
+
+    prompt_chars = sum(len(message.get("content", "")) for message in payload.get("messages", []))
+
+    return prompt_chars // 4 + payload.get("max_tokens", 0)
+
+
+
+class GroqRateGovernor:
+
+    """Shares a concurrency limit, a tokens-per-minute budget and server back-off across in-flight requests"""
+
+
+
+    def __init__(self, max_concurrency=GROQ_MAX_CONCURRENCY, tokens_per_minute=GROQ_TOKENS_PER_MINUTE):
+
+        self.tokens_per_minute = tokens_per_minute
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        self._lock = asyncio.Lock()
+
+        self._tokens = float(tokens_per_minute)
+
+        self._updated = time.monotonic()
+
+        self._paused_until = 0.0
+
+
+
+    async def reserve(self, tokens):
+
+        """Wait until the token budget allows a request and no server back-off is active"""
+
+        tokens = min(tokens, self.tokens_per_minute)
+
+        while True:
+
+            async with self._lock:
+
+                now = time.monotonic()
+
+                self._tokens = min(self.tokens_per_minute,
+
+                                   self._tokens + (now - self._updated) * self.tokens_per_minute / 60)
+
+                self._updated = now
+
+                wait = self._paused_until - now
+
+                if wait <= 0 and self._tokens >= tokens:
+
+                    self._tokens -= tokens
+
+                    return
+
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tokens_per_minute)
+
+            await asyncio.sleep(wait)
+
+
+
+    def observe(self, response):
+
+        """Adjust pacing from the response status and rate-limit headers"""
+
+        headers = response.headers
+
+        now = time.monotonic()
+
+        remaining = headers.get("x-ratelimit-remaining-tokens")
+
+        if remaining is not None:
+
+            try:
+
+                self._tokens = min(self._tokens, float(remaining))
+
+            except ValueError:
+
+                pass
+
+        if response.status_code == 429:
+
+            delay = (_parse_rate_limit_delay(headers.get("retry-after"))
+
+                     or _parse_rate_limit_delay(headers.get("x-ratelimit-reset-tokens"))
+
+                     or _parse_rate_limit_delay(headers.get("x-ratelimit-reset-requests"))
+
+                     or 2.0)
+
+            self._paused_until = max(self._paused_until, now + delay)
+
+        elif headers.get("x-ratelimit-remaining-requests") == "0":
+
+            delay = _parse_rate_limit_delay(headers.get("x-ratelimit-reset-requests"))
+
+            if delay:
+
+                self._paused_until = max(self._paused_until, now + delay)
+
+
+
+    async def post(self, payload, api_key, max_retries=5):
+
+        """POST a chat completion, retrying 429s on the shared schedule; returns None if retries run out"""
+
+        headers = {
+
+            "Authorization": f"Bearer {api_key}",
+
+            "Content-Type": "application/json"
+
+        }
+
+        estimated = _estimate_request_tokens(payload)
+
+        for attempt in range(max_retries):
+
+            await self.reserve(estimated)
+
+            async with self._semaphore:
+
+                response = await asyncio.to_thread(requests.post, GROQ_API_URL, headers=headers, json=payload, timeout=60)
+
+            self.observe(response)
+
+            if response.status_code != 429:
+
+                return response
+
+        return None
+
+
+
+async def agenerate_email_with_subject(governor, subject_template, body_template, company_name, company_info, api_key,
+
+                                      use_cache=True, refresh_cache=False):
+
+    """Async variant of generate_email_with_subject paced by a shared GroqRateGovernor.
+
+
+
+    Raises EmailGenerationError when the API fails; only a malformed JSON reply falls back to two calls.
+
+    """
+
+    payload = _combined_email_payload(_combined_template(subject_template, body_template), company_info)
+
+    cache_key, cached = _cache_lookup(payload, use_cache, refresh_cache)
+
+    parsed = _parse_combined_email(cached) if cached is not None else None
+
+    if parsed is not None:
+
+        return parsed
+
+
+
+    content = _completion_content(await governor.post(payload, api_key))
+
+    parsed = _parse_combined_email(content)
+
+    if parsed is not None:
+
+        _cache_store(cache_key, content)
+
+        return parsed
+
+
+
+    # Unusable JSON: fall back to the two-call path, still paced by the governor
+
+    try:
+
+        subject = await _agenerate_text(governor, _email_subject_payload(subject_template, company_info), api_key,
+
+                                        use_cache, refresh_cache, single_line=True)
+
+    except EmailGenerationError:
+
+        subject = subject_template.replace("{company_name}", company_name)
+
+    body = await _agenerate_text(governor, _email_content_payload(body_template, company_info), api_key,
+
+                                 use_cache, refresh_cache)
+
+    return subject, body
+
+
+
+async def _agenerate_text(governor, payload, api_key, use_cache=True, refresh_cache=False, single_line=False):
+
+    """One governed, cached chat completion; raises EmailGenerationError on failure"""
+
+    cache_key, cached = _cache_lookup(payload, use_cache, refresh_cache)
+
+    if cached is not None:
+
+        return cached
+
+    content = _completion_content(await governor.post(payload, api_key))
+
+    if single_line:
+
+        content = content.replace('\n', '')
+
+    _cache_store(cache_key, content)
+
+    return content
+
+
+
+class GroqGovernorThread:
+
+    """Runs a GroqRateGovernor on a background event loop so worker threads share its pacing"""
+
+
+
+    def __init__(self, max_concurrency=GROQ_MAX_CONCURRENCY, tokens_per_minute=GROQ_TOKENS_PER_MINUTE):
+
+        self.loop = asyncio.new_event_loop()
+
+        self.governor = GroqRateGovernor(max_concurrency, tokens_per_minute)
+
+        self._thread = threading.Thread(target=self.loop.run_forever, name="groq-governor", daemon=True)
+
+        self._thread.start()
+
+
+
+    def generate_email_with_subject(self, subject_template, body_template, company_name, company_info, api_key):
+
+        """Blocking call for worker threads; waits on the shared governor instead of sleeping per thread"""
+
+        coro = agenerate_email_with_subject(self.governor, subject_template, body_template,
+
+                                            company_name, company_info, api_key)
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+
+    def close(self):
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+        self._thread.join()
+
+        self.loop.close()
+
+
+
+def personalize_stream(rows, company_col, subject_template, body_template, api_key=None, max_concurrency=GROQ_MAX_CONCURRENCY,
+
+                       tokens_per_minute=GROQ_TOKENS_PER_MINUTE, buffer_size=None):
+
+    """Generate content for rows concurrently, yielding (row, company_name, subject, body) as each is ready.
+
+
+
+    subject is None when generation failed; body then holds the error message.
+
+    """
+
+    api_key = api_key or GROQ_API_KEY
+
+    ready = queue.Queue(maxsize=buffer_size or max_concurrency * 2)
+
+    finished = object()
+
+    errors = []
+
+
+
+    async def generate_all():
+
+        governor = GroqRateGovernor(max_concurrency, tokens_per_minute)
+
+        row_iter = iter(rows)
+
+
+
+        async def worker():
+
+            for row in row_iter:
+
+                company_name = str(row.get(company_col, 'Unknown Company'))
+
+                try:
+
+                    company_info = create_comprehensive_company_info(row, company_col)
+
+                    subject, body = await agenerate_email_with_subject(governor, subject_template, body_template,
+
+                                                                       company_name, company_info, api_key)
+
+                except Exception as e:
+
+                    subject, body = None, f"Error generating content: {str(e)}"
+
+                # Blocks when the send stage falls behind
+
+                await asyncio.to_thread(ready.put, (row, company_name, subject, body))
+
+
+
+        await asyncio.gather(*(worker() for _ in range(max_concurrency)))
+
+
+
+    def run_loop():
+
+        try:
+
+            asyncio.run(generate_all())
+
+        except Exception as e:
+
+            errors.append(e)
+
+        finally:
+
+            ready.put(finished)
+
+
+
+    threading.Thread(target=run_loop, name="ai-personalization", daemon=True).start()
+
+    while True:
+
+        item = ready.get()
+
+        if item is finished:
+
+            break
+
+        yield item
+
+    if errors:
+
+        raise errors[0]
+
+
+
+# Concurrent campaign sending
+
+class TokenBucket:
+
+    """Thread-safe token bucket used to cap the send rate for a provider"""
+
+
+
+    def __init__(self, rate, capacity=None):
+
+        self.rate = float(rate)
+
+        self.capacity = float(capacity or rate)
+
+        self._tokens = self.capacity
+
+        self._updated = time.monotonic()
+
+        self._lock = threading.Lock()
+
+
+
+    def acquire(self, tokens=1):
+
+        """Block until the requested number of tokens is available"""
+
+        while True:
+
+            with self._lock:
+
+                now = time.monotonic()
+
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+
+                self._updated = now
+
+                if self._tokens >= tokens:
+
+                    self._tokens -= tokens
+
+                    return
+
+                wait = (tokens - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+
+_rate_limiters = {}
+
+_rate_limiters_lock = threading.Lock()
+
+
+
+def get_rate_limiter(provider):
+
+    """Return the shared token bucket for a provider"""
+
+    with _rate_limiters_lock:
+
+        if provider not in _rate_limiters:
+
+            limits = PROVIDER_LIMITS[provider]
+
+            _rate_limiters[provider] = TokenBucket(limits["rate"], limits.get("burst"))
+
+        return _rate_limiters[provider]
+
+
+
+_campaign_progress = {}
+
+_campaign_progress_lock = threading.Lock()
+
+
+
+def get_campaign_progress(campaign_id):
+
+    """Return a snapshot of a running campaign's progress for the UI to poll"""
+
+    with _campaign_progress_lock:
+
+        progress = _campaign_progress.get(campaign_id)
+
+        return dict(progress) if progress else None
+
+
+
+def _update_campaign_progress(campaign_id, **changes):
+
+    with _campaign_progress_lock:
+
+        progress = _campaign_progress.setdefault(campaign_id, {})
+
+        for key, value in changes.items():
+
+            if key in ("sent", "failed", "completed", "skipped"):
+
+                progress[key] = progress.get(key, 0) + value
+
+            else:
+
+                progress[key] = value
+
+        return dict(progress)
+
+
+
+def _combined_template(subject_template, body_template):
+
+    """Merge subject and body instructions for single-call generation"""
+
+    return f"{body_template}\nSubject line guidance: {subject_template}" if subject_template else body_template
+
+
+
+def run_campaign(df, company_col, subject_template, body_template, email_col='Gmail', provider="mailjet",
+
+                 max_workers=None, use_ai=False, api_key=None, progress_callback=None, campaign_id=None,
+
+                 run_id=None, retry_failed=False, layout="default", send_at_col=None):
+
+    """Send a campaign for a processed DataFrame through the campaign pipeline, returning per-recipient results"""
+
+    limits = PROVIDER_LIMITS[provider]
+
+    results = []
+
+
+
+    def collect(progress, result):
+
+        results.append(result)
+
+        if progress_callback:
+
+            progress_callback(progress, result)
+
+
+
+    campaign_id = run_campaign_pipeline(
+
+        df.to_dict('records'), company_col, subject_template, body_template, email_col=email_col, provider=provider,
+
+        use_ai=use_ai, api_key=api_key, progress_callback=collect, campaign_id=campaign_id, run_id=run_id,
+
+        retry_failed=retry_failed, layout=layout, send_at_col=send_at_col,
+
+        stage_workers={"send": min(max_workers or limits["max_connections"], limits["max_connections"])},
+
+    )
+
+    return pd.DataFrame(results, columns=["email", "company", "success", "message", "email_id"]), campaign_id
+
+
+
+# Streaming campaign pipeline
+
+_PIPELINE_STOP = object()
+
+
+
+class CampaignPipeline:
+
+    """Runs jobs through stages connected by bounded queues, each stage with its own worker threads"""
+
+
+
+    def __init__(self, stages, queue_size=100, on_complete=None):
+
+        # stages: list of dicts with name, func, workers and optional run_on_error;
+
+        # on_complete(job) is called for every job leaving the last stage, skipped ones included
+
+        self.stages = stages
+
+        self.on_complete = on_complete
+
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+
+        self.processed = {stage["name"]: 0 for stage in stages}
+
+        self._lock = threading.Lock()
+
+
+
+    def queue_depths(self):
+
+        """Jobs waiting in front of each stage; a persistently full queue marks the slow stage"""
+
+        return {stage["name"]: q.qsize() for stage, q in zip(self.stages, self.queues)}
+
+
+
+    def _work(self, index):
+
+        stage = self.stages[index]
+
+        inbox = self.queues[index]
+
+        outbox = self.queues[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+
+            job = inbox.get()
+
+            if job is _PIPELINE_STOP:
+
+                return
+
+            if job.get("skip"):
+
+                pass
+
+            elif not job.get("error") or stage.get("run_on_error"):
+
+                try:
+
+                    stage["func"](job)
+
+                except Exception as e:
+
+                    job["error"] = f"{stage['name']} failed: {str(e)}"
+
+            with self._lock:
+
+                self.processed[stage["name"]] += 1
+
+            if outbox is not None:
+
+                outbox.put(job)
+
+            elif self.on_complete is not None:
+
+                try:
+
+                    self.on_complete(job)
+
+                except Exception as e:
+
+                    print(f"Pipeline completion callback failed: {e}")
+
+
+
+    def run(self, jobs):
+
+        """Feed jobs through every stage and return once the last stage has drained"""
+
+        threads = []
+
+        for index, stage in enumerate(self.stages):
+
+            workers = [threading.Thread(target=self._work, args=(index,), name=f"pipeline-{stage['name']}-{n}", daemon=True)
+
+                       for n in range(stage.get("workers", 1))]
+
+            for worker in workers:
+
+                worker.start()
+
+            threads.append(workers)
+
+
+
+        try:
+
+            for job in jobs:
+
+                self.queues[0].put(job)
+
+        finally:
+
+            # Shut stages down in order so every job fed so far reaches the end, even if the feed failed
+
+            for index, workers in enumerate(threads):
+
+                for _ in workers:
+
+                    self.queues[index].put(_PIPELINE_STOP)
+
+                for worker in workers:
+
+                    worker.join()
+
+
+
+def run_campaign_pipeline(rows, company_col, subject_template, body_template, email_col='Gmail', provider="mailjet",
+
+                          use_ai=False, api_key=None, stage_workers=None, queue_size=100,
+
+                          progress_callback=None, campaign_id=None, run_id=None, retry_failed=False,
+
+                          checkpoint_every=100, layout="default", send_at_col=None):
+
+    """Stream recipient rows through check -> info -> generate -> render -> send -> log stages.
+
+
+
+    Passing the run_id of an interrupted run resumes it: rows before its checkpoint are skipped,
+
+    and recipients already sent are never sent again. A recipient is claimed only at the send
+
+    stage; claims left behind by a crashed run are taken over after CAMPAIGN_CLAIM_TIMEOUT. The
+
+    checkpoint only moves past rows that were sent, failed or skipped. retry_failed re-checks
+
+    every row instead of starting at the checkpoint. With send_at_col, each row is held back from
+
+    the pipeline until the epoch time in that column (rows should be sorted by it).
+
+    """
+
+    if not EMAIL or not MAILJET_API_KEY or not MAILJET_SECRET_KEY:
+
+        raise ValueError("Missing email configuration. Check environment variables.")
+
+
+
+    run_id = start_campaign_run(campaign_id, run_id)
+
+    campaign_id = campaign_id or run_id
+
+    run = get_campaign_run(run_id)
+
+    resume_from = 0 if retry_failed else run["checkpoint"]
+
+    api_key = api_key or GROQ_API_KEY
+
+    limiter = get_rate_limiter(provider)
+
+    workers = {"info": 1, "generate": GROQ_MAX_CONCURRENCY if use_ai else 1, "render": 2,
+
+               "send": PROVIDER_LIMITS[provider]["max_connections"], "log": 1}
+
+    workers.update(stage_workers or {})
+
+    # Generation threads share one rate governor rather than each sleeping through 429s
+
+    groq = GroqGovernorThread(max_concurrency=workers["generate"]) if use_ai else None
+
+    # Without AI or a {company_name} placeholder every recipient gets the same content, encoded once
+
+    shared_content = not use_ai and "{company_name}" not in f"{subject_template}{body_template}"
+
+
+
+    reconcile_campaign_run(run_id)
+
+    finished_rows, checkpoint = set(), [resume_from]
+
+    checkpoint_lock = threading.Lock()
+
+
+
+    def complete(job):
+
+        # Advance the checkpoint over the contiguous prefix of rows in a final state
+
+        with checkpoint_lock:
+
+            finished_rows.add(job["index"])
+
+            advanced = False
+
+            while checkpoint[0] in finished_rows:
+
+                finished_rows.discard(checkpoint[0])
+
+                checkpoint[0] += 1
+
+                advanced = advanced or checkpoint[0] % checkpoint_every == 0
+
+            if advanced:
+
+                save_campaign_checkpoint(run_id, checkpoint[0])
+
+
+
+    def skip(job):
+
+        job["skip"] = True
+
+        _update_campaign_progress(campaign_id, skipped=1)
+
+
+
+    def check_stage(job):
+
+        # Blank addresses all share one message key, so they never get a claim of their own
+
+        if (not job["email"] or job["index"] < resume_from
+
+                or not campaign_recipient_pending(run_id, job["email_id"])):
+
+            skip(job)
+
+
+
+    def company_info_stage(job):
+
+        job["company_name"] = str(job["row"].get(company_col, 'Unknown Company'))
+
+        if use_ai:
+
+            job["company_info"] = create_comprehensive_company_info(job["row"], company_col)
+
+
+
+    def generate_stage(job):
+
+        try:
+
+            if use_ai:
+
+                job["subject"], job["body"] = groq.generate_email_with_subject(subject_template, body_template,
+
+                                                                               job["company_name"], job["company_info"],
+
+                                                                               api_key)
+
+            else:
+
+                job["subject"] = subject_template.replace("{company_name}", job["company_name"])
+
+                job["body"] = body_template.replace("{company_name}", job["company_name"])
+
+        except Exception as e:
+
+            job["error"] = f"Failed to generate email: {str(e)}"
+
+        else:
+
+            if not str(job["subject"] or "").strip() or not str(job["body"] or "").strip():
+
+                job["error"] = "Failed to generate email: empty subject or body"
+
+        if job.get("error"):
+
+            # Nothing is rendered or sent; log_stage records the row as failed
+
+            job["delivery_status"] = "generation_error"
+
+
+
+    def render_stage(job):
+
+        if not is_valid_email(job["email"]):
+
+            job["delivery_status"] = "invalid_email"
+
+            job["error"] = "Invalid email address"
+
+            return
+
+        score, job["warnings"] = validate_email_deliverability(job["email"])
+
+        job["delivery_status"] = deliverability_to_status(score)
+
+        job["message"], job["subject"] = build_email_bytes(job["email"], job["subject"], job["body"], job["company_name"],
+
+                                                           job["email_id"], layout, shared_content)
+
+
+
+    def send_stage(job):
+
+        if not claim_campaign_recipient(run_id, job["email_id"], job["email"]):
+
+            skip(job)
+
+            return
+
+        limiter.acquire()
+
+        try:
+
+            get_smtp_pool().sendmail(EMAIL, job["email"], job.pop("message"))
+
+        except Exception as e:
+
+            job["delivery_status"] = "send_error"
+
+            job["error"] = f"Failed to send email: {str(e)}"
+
+            return
+
+        # Delivered: a failed bookkeeping write must never turn this row into a failure that gets re-sent
+
+        for attempt in range(CAMPAIGN_MARK_RETRIES):
+
+            try:
+
+                mark_campaign_recipient(run_id, job["email_id"], "sent")
+
+                return
+
+            except sqlite3.Error as e:
+
+                print(f"Could not mark {job['email']} as sent (attempt {attempt + 1}): {e}")
+
+                time.sleep(0.5 * (attempt + 1))
+
+        # Still in_flight; reconcile_campaign_run marks it sent from the email log on the next pass
+
+
+
+    def log_stage(job):
+
+        failed = bool(job.get("error"))
+
+        if failed:
+
+            mark_campaign_recipient(run_id, job["email_id"], "failed", job["error"], job["email"])
+
+        log_email_status(job["email_id"], job["email"], job.get("company_name"), job.get("subject"),
+
+                         "failed" if failed else "sent", job.get("delivery_status") or "pipeline_error", job.get("error"))
+
+        progress = _update_campaign_progress(campaign_id, completed=1, sent=int(not failed), failed=int(failed),
+
+                                             queue_depths=pipeline.queue_depths())
+
+        if progress_callback:
+
+            progress_callback(progress, {"email": job["email"], "company": job.get("company_name"),
+
+                                         "success": not failed, "message": job.get("error") or "sent",
+
+                                         "email_id": job["email_id"]})
+
+
+
+    pipeline = CampaignPipeline([
+
+        {"name": "check", "func": check_stage, "workers": 1},
+
+        {"name": "info", "func": company_info_stage, "workers": workers["info"]},
+
+        {"name": "generate", "func": generate_stage, "workers": workers["generate"]},
+
+        {"name": "render", "func": render_stage, "workers": workers["render"]},
+
+        {"name": "send", "func": send_stage, "workers": workers["send"]},
+
+        {"name": "log", "func": log_stage, "workers": workers["log"], "run_on_error": True},
+
+    ], queue_size=queue_size, on_complete=complete)
+
+
+
+    def jobs():
+
+        for index, row in enumerate(rows):
+
+            if send_at_col and index >= resume_from:
+
+                # Hold rows back before they enter the pipeline so no stage worker waits on a send time
+
+                delay = (row.get(send_at_col) or 0) - time.time()
+
+                if delay > 0:
+
+                    time.sleep(delay)
+
+            yield {"index": index, "row": row, "email": normalize_email(row.get(email_col)),
+
+                   "email_id": campaign_message_key(run_id, row.get(email_col))}
+
+
+
+    _update_campaign_progress(campaign_id, status="running", started=datetime.now(), run_id=run_id)
+
+    try:
+
+        pipeline.run(jobs())
+
+    except Exception as e:
+
+        save_campaign_checkpoint(run_id, checkpoint[0])
+
+        finish_campaign_run(run_id, "failed")
+
+        _update_campaign_progress(campaign_id, status="failed", finished=datetime.now(), error=str(e),
+
+                                  queue_depths=pipeline.queue_depths())
+
+        raise
+
+    finally:
+
+        if groq is not None:
+
+            groq.close()
+
+    save_campaign_checkpoint(run_id, checkpoint[0])
+
+    finish_campaign_run(run_id)
+
+    _update_campaign_progress(campaign_id, status="finished", finished=datetime.now(),
+
+                              queue_depths=pipeline.queue_depths())
+
+    return campaign_id
+
+
+
+# Time-zone-aware send windows
+
+def _parse_clock(value):
+
+    """Minutes after midnight for an "HH:MM" string"""
+
+    hours, minutes = str(value).strip().split(":")[:2]
+
+    return int(hours) * 60 + int(minutes)
+
+
+
+def _window_zone(name, default="UTC"):
+
+    for candidate in (name, default):
+
+        try:
+
+            return ZoneInfo(str(candidate))
+
+        except (ZoneInfoNotFoundError, ValueError):
+
+            continue
+
+    return ZoneInfo("UTC")
+
+
+
+def send_window_state(zone, window, now=None):
+
+    """Whether the send window is open in `zone`, and the epoch time it next opens (now if open).
+
+
+
+    `window` has "start" and "end" ("HH:MM", local time; end before start spans midnight)
+
+    and optional "days" (weekday numbers, Monday = 0).
+
+    """
+
+    now = time.time() if now is None else now
+
+    start, end = _parse_clock(window.get("start", "00:00")), _parse_clock(window.get("end", "24:00"))
+
+    days = set(window.get("days") or range(7))
+
+    local = datetime.fromtimestamp(now, zone)
+
+    minute = local.hour * 60 + local.minute
+
+    weekday = local.weekday()
+
+
+
+    if start <= end:
+
+        is_open = weekday in days and start <= minute < end
+
+    else:
+
+        is_open = (weekday in days and minute >= start) or ((weekday - 1) % 7 in days and minute < end)
+
+    if is_open:
+
+        return True, now
+
+
+
+    for offset in range(8):
+
+        day = local.date() + timedelta(days=offset)
+
+        if day.weekday() not in days:
+
+            continue
+
+        opening = datetime(day.year, day.month, day.day, start // 60, start % 60, tzinfo=zone).timestamp()
+
+        if opening > now:
+
+            return False, opening
+
+    return False, None
+
+
+
+def recipient_send_windows(timezones, window, now=None):
+
+    """Send-window state for every recipient: (open_now mask, epoch each window next opens).
+
+
+
+    Only distinct time zones are evaluated; blank or unknown zones use window["default_timezone"].
+
+    """
+
+    now = time.time() if now is None else now
+
+    default = window.get("default_timezone", "UTC")
+
+    zones = pd.Series(timezones, dtype=object).fillna(default).astype(str).str.strip().replace('', default)
+
+    codes, names = pd.factorize(zones)
+
+    states = [send_window_state(_window_zone(name, default), window, now) for name in names]
+
+    open_now = np.array([state[0] for state in states], dtype=bool)
+
+    opens_at = np.array([np.nan if state[1] is None else state[1] for state in states], dtype=float)
+
+    return open_now[codes], opens_at[codes]
+
+
+
+# Send-time optimization
+
+HOURS_PER_WEEK = 7 * 24
+
+
+
+class SendTimeOptimizer:
+
+    """Engagement histograms by recipient domain and hour of week (Monday 00:00 = 0, sender local time).
+
+
+
+    Built from the email_stats_daily rollup, which triggers keep in step with email_logs. Days older
+
+    than open_window_days are folded into a fixed base once; each refresh only re-reads the recent
+
+    days, where opens and clicks are still arriving.
+
+    """
+
+
+
+    def __init__(self, prior_strength=SEND_TIME_PRIOR_STRENGTH, click_weight=SEND_TIME_CLICK_WEIGHT,
+
+                 open_window_days=SEND_TIME_OPEN_WINDOW_DAYS):
+
+        self.prior_strength = prior_strength
+
+        self.click_weight = click_weight
+
+        self.open_window_days = open_window_days
+
+        self.domain_index = {}
+
+        # sent, opened, clicked counts, shape (3, domains, HOURS_PER_WEEK)
+
+        self.settled = np.zeros((3, 0, HOURS_PER_WEEK))
+
+        self.recent = np.zeros((3, 0, HOURS_PER_WEEK))
+
+        self.settled_until = ""
+
+        self.lock = threading.Lock()
+
+
+
+    def _read_rollup(self, conn, start, end):
+
+        return pd.read_sql_query('''
+
+            SELECT date, hour, domain, SUM(count) AS sent, SUM(opened) AS opened, SUM(clicked) AS clicked
+
+            FROM email_stats_daily
+
+            WHERE status = 'sent' AND date >= ? AND date < ?
+
+            GROUP BY date, hour, domain
+
+        ''', conn, params=[start, end])
+
+
+
+    def _histogram(self, rows):
+
+        for domain in rows['domain'].unique():
+
+            self.domain_index.setdefault(domain, len(self.domain_index))
+
+        size = len(self.domain_index) * HOURS_PER_WEEK
+
+        if rows.empty:
+
+            return np.zeros((3, len(self.domain_index), HOURS_PER_WEEK))
+
+        hour_of_week = pd.to_datetime(rows['date']).dt.weekday.to_numpy() * 24 + rows['hour'].to_numpy()
+
+        cells = rows['domain'].map(self.domain_index).to_numpy() * HOURS_PER_WEEK + hour_of_week
+
+        return np.stack([
+
+            np.bincount(cells, weights=rows[col].to_numpy(dtype=float), minlength=size)
+
+            for col in ('sent', 'opened', 'clicked')
+
+        ]).reshape(3, len(self.domain_index), HOURS_PER_WEEK)
+
+
+
+    def _grow(self, counts):
+
+        missing = len(self.domain_index) - counts.shape[1]
+
+        return np.pad(counts, ((0, 0), (0, missing), (0, 0))) if missing else counts
+
+
+
+    def refresh(self, conn=None):
+
+        """Fold in rollup changes since the last refresh"""
+
+        flush_email_logs()
+
+        conn = conn or get_db_connection()
+
+        cutoff = (datetime.now().date() - timedelta(days=self.open_window_days)).isoformat()
+
+        with self.lock:
+
+            if cutoff > self.settled_until:
+
+                newly_settled = self._histogram(self._read_rollup(conn, self.settled_until, cutoff))
+
+                self.settled = self._grow(self.settled) + newly_settled
+
+                self.settled_until = cutoff
+
+            self.recent = self._histogram(self._read_rollup(conn, cutoff, "9999-12-31"))
+
+            self.settled = self._grow(self.settled)
+
+        return self
+
+
+
+    def snapshot(self):
+
+        """(sent, opened, clicked) arrays of shape (domains, HOURS_PER_WEEK) and the domain index they use.
+
+
+
+        Taken together under the lock, since refresh() extends domain_index and the arrays on another thread.
+
+        """
+
+        with self.lock:
+
+            return tuple(self.settled + self.recent), dict(self.domain_index)
+
+
+
+    def counts(self):
+
+        """(sent, opened, clicked) arrays of shape (domains, HOURS_PER_WEEK)"""
+
+        return self.snapshot()[0]
+
+
+
+    def engagement_curves(self, domains, snapshot=None):
+
+        """Smoothed engagement rate by hour of week for each domain, shape (len(domains), HOURS_PER_WEEK).
+
+
+
+        Each domain's curve is shrunk toward the all-domain curve, which is shrunk toward the
+
+        overall rate, so sparse domains and hours fall back to what is known. Unseen domains get
+
+        the all-domain curve. Pass a snapshot() to score against the same counts as the caller.
+
+        """
+
+        (sent, opened, clicked), domain_index = snapshot or self.snapshot()
+
+        engaged = opened + self.click_weight * clicked
+
+        total_sent, total_engaged = sent.sum(axis=0), engaged.sum(axis=0)
+
+        overall = total_engaged.sum() / total_sent.sum() if total_sent.sum() else 0.0
+
+        k = self.prior_strength
+
+        global_curve = (total_engaged + k * overall) / (total_sent + k)
+
+        domain_curves = np.vstack([(engaged + k * global_curve) / (sent + k), global_curve])
+
+
+
+        unseen = len(domain_index)
+
+        rows = np.array([domain_index.get(domain, unseen) for domain in domains], dtype=int)
+
+        return domain_curves[rows]
+
+
+
+_send_time_optimizer = None
+
+_send_time_optimizer_lock = threading.Lock()
+
+
+
+def get_send_time_optimizer(refresh=True):
+
+    """Shared SendTimeOptimizer, refreshed from the rollup on each call unless refresh=False"""
+
+    global _send_time_optimizer
+
+    with _send_time_optimizer_lock:
+
+        if _send_time_optimizer is None:
+
+            _send_time_optimizer = SendTimeOptimizer()
+
+    return _send_time_optimizer.refresh() if refresh else _send_time_optimizer
+
+
+
+def get_best_send_times(domain=None, top=5):
+
+    """Best hours of the week to send, overall or for one recipient domain"""
+
+    optimizer = get_send_time_optimizer()
+
+    snapshot = optimizer.snapshot()
+
+    (sent, opened, clicked), domain_index = snapshot
+
+    curve = optimizer.engagement_curves([domain.lower() if domain else None], snapshot)[0]
+
+    row = domain_index.get(domain.lower()) if domain else None
+
+    sent = sent[row] if row is not None else (sent.sum(axis=0) if domain is None else np.zeros(HOURS_PER_WEEK))
+
+    best = np.argsort(-curve, kind='stable')[:top]
+
+    return pd.DataFrame({
+
+        'weekday': [calendar.day_name[hour // 24] for hour in best],
+
+        'hour': best % 24,
+
+        'sent': sent[best].astype(int),
+
+        'engagement_score': curve[best].round(4),
+
+    })
+
+
+
+def assign_send_slots(emails, start=None, horizon_hours=SEND_TIME_HORIZON_HOURS, timezones=None, send_window=None,
+
+                      slot_capacity=None, optimizer=None):
+
+    """Pick a send time (epoch seconds) for each recipient within the next horizon_hours.
+
+
+
+    The horizon is cut into hourly slots. Each recipient goes to the open slot with the best
+
+    engagement for their domain, but a slot takes at most slot_capacity recipients (by default
+
+    SEND_TIME_SLOT_HEADROOM times an even share), so load is spread over the horizon. Sends are
+
+    spaced evenly within their slot. With send_window, only slots inside the recipient's window
+
+    (in their own time zone) are used; recipients with no open slot get their next window opening.
+
+    """
+
+    start = time.time() if start is None else start
+
+    optimizer = optimizer or get_send_time_optimizer()
+
+    emails = pd.Series(emails, dtype=object).reset_index(drop=True)
+
+    count = len(emails)
+
+    send_at = np.full(count, float(start))
+
+    if count == 0:
+
+        return send_at
+
+
+
+    end = start + horizon_hours * 3600
+
+    bounds = np.unique(np.concatenate([[start], np.arange((start // 3600 + 1) * 3600, end, 3600), [end]]))
+
+    slot_start, slot_end = bounds[:-1], bounds[1:]
+
+    slot_hours = np.array([datetime.fromtimestamp(t).weekday() * 24 + datetime.fromtimestamp(t).hour
+
+                           for t in slot_start])
+
+
+
+    # Recipients sharing a domain and time zone share a score row
+
+    domain_codes, domains = pd.factorize(emails.map(email_domain))
+
+    domain_scores = optimizer.engagement_curves(domains)[:, slot_hours]
+
+    if send_window:
+
+        default = send_window.get("default_timezone", "UTC")
+
+        zones = pd.Series(timezones if timezones is not None else [None] * count, dtype=object).reset_index(drop=True)
+
+        zone_codes, zone_names = pd.factorize(zones.fillna(default).astype(str).str.strip().replace('', default))
+
+        zone_open = np.array([[send_window_state(_window_zone(name, default), send_window, t)[0] for t in slot_start]
+
+                              for name in zone_names], dtype=bool)
+
+    else:
+
+        zone_codes, zone_open = np.zeros(count, dtype=int), np.ones((1, len(slot_start)), dtype=bool)
+
+    groups, group_keys = pd.factorize(pd.Series(domain_codes * len(zone_open) + zone_codes))
+
+    scores = np.where(zone_open[group_keys % len(zone_open)], domain_scores[group_keys // len(zone_open)], -np.inf)
+
+    preferences = np.argsort(-scores, axis=1, kind='stable')
+
+
+
+    open_slots = np.isfinite(scores).any(axis=0).sum()
+
+    capacity = slot_capacity or int(np.ceil(count / max(open_slots, 1) * SEND_TIME_SLOT_HEADROOM))
+
+    remaining = np.full(len(slot_start), capacity)
+
+    slot = np.full(count, -1)
+
+    pending = np.arange(count)
+
+
+
+    # Greedy by preference rank: everyone asks for their best slot, then their next best, ...
+
+    for rank in range(len(slot_start)):
+
+        choice = preferences[groups[pending], rank]
+
+        allowed = np.isfinite(scores[groups[pending], choice])
+
+        candidates, choice = pending[allowed], choice[allowed]
+
+        position = pd.Series(choice).groupby(choice).cumcount().to_numpy()
+
+        accepted = position < remaining[choice]
+
+        slot[candidates[accepted]] = choice[accepted]
+
+        remaining -= np.bincount(choice[accepted], minlength=len(slot_start))
+
+        pending = pending[slot[pending] < 0]
+
+        if len(pending) == 0:
+
+            break
+
+
+
+    # Over capacity everywhere: take the best open slot anyway
+
+    best = preferences[groups[pending], 0]
+
+    overflow = np.isfinite(scores[groups[pending], best])
+
+    slot[pending[overflow]] = best[overflow]
+
+
+
+    assigned = slot >= 0
+
+    chosen = slot[assigned]
+
+    order = pd.Series(chosen).groupby(chosen).cumcount().to_numpy()
+
+    per_slot = np.bincount(chosen, minlength=len(slot_start))
+
+    send_at[assigned] = slot_start[chosen] + (order + 0.5) / per_slot[chosen] * (slot_end[chosen] - slot_start[chosen])
+
+
+
+    if not assigned.all():
+
+        _, opens_at = recipient_send_windows(zones[~assigned], send_window, end)
+
+        send_at[~assigned] = np.where(np.isnan(opens_at), end, opens_at)
+
+    return send_at
+
+
+
+def campaign_send_slots(run_id, emails, **kwargs):
+
+    """Send times for a campaign run's recipients; assigned once and stored so every pass agrees"""
+
+    emails = pd.Series(emails, dtype=object).reset_index(drop=True)
+
+    keys = [campaign_message_key(run_id, email) for email in emails]
+
+    conn = get_db_connection()
+
+    stored = dict(conn.execute("SELECT message_key, send_at FROM campaign_send_slots WHERE run_id = ?", (run_id,)))
+
+
+
+    missing = [index for index, key in enumerate(keys) if key not in stored]
+
+    if missing:
+
+        timezones = kwargs.pop("timezones", None)
+
+        if timezones is not None:
+
+            timezones = pd.Series(timezones, dtype=object).reset_index(drop=True).iloc[missing]
+
+        send_at = assign_send_slots(emails.iloc[missing], timezones=timezones, **kwargs)
+
+        new_slots = {keys[index]: float(value) for index, value in zip(missing, send_at)}
+
+        conn.executemany("INSERT OR IGNORE INTO campaign_send_slots (run_id, message_key, send_at) VALUES (?, ?, ?)",
+
+                         [(run_id, key, value) for key, value in new_slots.items()])
+
+        conn.commit()
+
+        stored.update(new_slots)
+
+    return np.array([stored[key] for key in keys])
+
+
+
+# Persistent job scheduler
+
+SCHEDULED_JOB_HANDLERS = {}
+
+MISFIRE_POLICIES = ("run_once", "skip", "catch_up")
+
+
+
+def register_job_handler(kind, func):
+
+    """Register the function a scheduler worker calls for jobs of `kind`.
+
+
+
+    It receives the claimed job dict and may return {"next_run": epoch} to continue the
+
+    same occurrence later (e.g. recipients whose send window has not opened yet).
+
+    """
+
+    SCHEDULED_JOB_HANDLERS[kind] = func
+
+
+
+def _to_epoch(value):
+
+    if value is None:
+
+        return time.time()
+
+    if isinstance(value, datetime):
+
+        return value.timestamp()
+
+    return float(value)
+
+
+
+def _to_seconds(value):
+
+    if value is None:
+
+        return None
+
+    if isinstance(value, timedelta):
+
+        return value.total_seconds()
+
+    return float(value)
+
+
+
+def schedule_job(kind, payload, run_at=None, interval=None, name=None, misfire_policy="run_once",
+
+                 misfire_grace=SCHEDULER_MISFIRE_GRACE, job_id=None):
+
+    """Persist a job for the scheduler worker; returns its job_id.
+
+
+
+    run_at is a datetime (naive means local time) or epoch seconds, default now. interval
+
+    (seconds or timedelta) makes the job recurring. A run more than misfire_grace seconds
+
+    late either runs once ("run_once", missed occurrences are coalesced), is skipped ("skip"),
+
+    or runs along with every occurrence missed after it, one after another ("catch_up").
+
+    """
+
+    if kind not in SCHEDULED_JOB_HANDLERS:
+
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    if misfire_policy not in MISFIRE_POLICIES:
+
+        raise ValueError(f"Unknown misfire policy: {misfire_policy}")
+
+
+
+    job_id = job_id or str(uuid.uuid4())
+
+    now = datetime.now()
+
+    conn = get_db_connection()
+
+    conn.execute('''
+
+        INSERT INTO scheduled_jobs (job_id, name, kind, payload, status, next_run, interval_seconds,
+
+                                    misfire_policy, misfire_grace, created, updated)
+
+        VALUES (?, ?, ?, ?, 'scheduled', ?, ?, ?, ?, ?, ?)
+
+    ''', (job_id, name, kind, json.dumps(payload), _to_epoch(run_at), _to_seconds(interval),
+
+          misfire_policy, _to_seconds(misfire_grace), now, now))
+
+    conn.commit()
+
+    return job_id
+
+
+
+def schedule_campaign(recipient_list, subject_template, body_template, run_at=None, company_col=None, email_col=None,
+
+                      provider="mailjet", use_ai=False, layout="default", send_window=None, interval=None,
+
+                      name=None, misfire_policy="run_once", misfire_grace=SCHEDULER_MISFIRE_GRACE,
+
+                      optimize_send_time=False, send_horizon_hours=SEND_TIME_HORIZON_HOURS):
+
+    """Schedule a campaign over a saved recipient list.
+
+
+
+    send_window ({"start": "09:00", "end": "17:00", "days": [0, 1, 2, 3, 4], "timezone_column":
+
+    "Timezone", "default_timezone": "UTC"}) holds each recipient until it is open in their time zone.
+
+    optimize_send_time spreads each occurrence over send_horizon_hours, sending every recipient
+
+    in the hour their domain engages with most (see assign_send_slots).
+
+    API keys are never stored; the worker reads them from its own environment.
+
+    """
+
+    if not _recipient_list_path(recipient_list).exists():
+
+        raise ValueError(f"No saved recipient list named {recipient_list!r}")
+
+    if provider not in PROVIDER_LIMITS:
+
+        raise ValueError(f"Unknown provider: {provider}")
+
+    if send_window and _parse_clock(send_window.get("start", "00:00")) == _parse_clock(send_window.get("end", "24:00")):
+
+        raise ValueError("Send window start and end must differ")
+
+
+
+    payload = {"recipient_list": recipient_list, "subject_template": subject_template,
+
+               "body_template": body_template, "company_col": company_col, "email_col": email_col,
+
+               "provider": provider, "use_ai": use_ai, "layout": layout, "send_window": send_window,
+
+               "optimize_send_time": optimize_send_time, "send_horizon_hours": send_horizon_hours}
+
+    return schedule_job("campaign", payload, run_at=run_at, interval=interval, name=name or recipient_list,
+
+                        misfire_policy=misfire_policy, misfire_grace=misfire_grace)
+
+
+
+def cancel_scheduled_job(job_id):
+
+    """Cancel a job; a pass already running finishes, but the job is not run again"""
+
+    conn = get_db_connection()
+
+    cursor = conn.execute(
+
+        "UPDATE scheduled_jobs SET status = 'cancelled', lease_owner = NULL, updated = ? "
+
+        "WHERE job_id = ? AND status IN ('scheduled', 'running')",
+
+        (datetime.now(), job_id)
+
+    )
+
+    conn.commit()
+
+    return cursor.rowcount > 0
+
+
+
+def get_scheduled_jobs(status=None):
+
+    """Scheduled jobs, soonest first"""
+
+    query = '''
+
+        SELECT job_id, name, kind, status, datetime(next_run, 'unixepoch', 'localtime') AS next_run,
+
+               interval_seconds, misfire_policy, run_id, lease_owner, attempts,
+
+               datetime(last_run, 'unixepoch', 'localtime') AS last_run, last_error
+
+        FROM scheduled_jobs
+
+    '''
+
+    params = []
+
+    if status:
+
+        query += " WHERE status = ?"
+
+        params.append(status)
+
+    query += " ORDER BY next_run IS NULL, next_run"
+
+    return pd.read_sql_query(query, get_db_connection(), params=params)
+
+
+
+def _recipient_timezones(df, window):
+
+    tz_col = (window or {}).get("timezone_column", "Timezone")
+
+    return df[tz_col] if tz_col in df.columns else pd.Series([None] * len(df), index=df.index)
+
+
+
+def _run_scheduled_campaign(job):
+
+    """Send one pass of a scheduled campaign to recipients whose send window is open"""
+
+    payload = job["payload"]
+
+    df, email_col, company_col = load_recipient_list(payload["recipient_list"])
+
+    email_col = payload.get("email_col") or email_col
+
+    company_col = payload.get("company_col") or company_col
+
+    result = {}
+
+
+
+    window = payload.get("send_window")
+
+    send_at_col = None
+
+    if payload.get("optimize_send_time"):
+
+        send_at = campaign_send_slots(job["run_id"], df[email_col], timezones=_recipient_timezones(df, window),
+
+                                      send_window=window,
+
+                                      horizon_hours=payload.get("send_horizon_hours") or SEND_TIME_HORIZON_HOURS)
+
+        # Send this hour's slots now, paced by send time; come back for the rest
+
+        later = send_at >= time.time() + SEND_TIME_PASS_SECONDS
+
+        if later.any():
+
+            result["next_run"] = float(send_at[later].min())
+
+        df = df.loc[~later].assign(_send_at=send_at[~later]).sort_values('_send_at')
+
+        send_at_col = '_send_at'
+
+    elif window:
+
+        open_now, opens_at = recipient_send_windows(_recipient_timezones(df, window), window)
+
+        deferred = df.loc[~open_now, email_col]
+
+        if len(deferred):
+
+            # Recipients already sent in an earlier pass no longer hold the occurrence open
+
+            sent = {row[0] for row in get_db_connection().execute(
+
+                "SELECT message_key FROM campaign_recipients WHERE run_id = ? AND status = 'sent'", (job["run_id"],)
+
+            )}
+
+            waiting = np.array([bool(normalize_email(email)) and campaign_message_key(job["run_id"], email) not in sent
+
+                                for email in deferred], dtype=bool)
+
+            next_open = opens_at[~open_now][waiting]
+
+            next_open = next_open[~np.isnan(next_open)]
+
+            if len(next_open):
+
+                result["next_run"] = float(next_open.min())
+
+        df = df.loc[open_now]
+
+
+
+    if len(df):
+
+        run_campaign_pipeline(df.to_dict('records'), company_col, payload["subject_template"],
+
+                              payload["body_template"], email_col=email_col, provider=payload.get("provider", "mailjet"),
+
+                              use_ai=payload.get("use_ai", False), run_id=job["run_id"], retry_failed=True,
+
+                              layout=payload.get("layout", "default"), send_at_col=send_at_col)
+
+    return result
+
+
+
+register_job_handler("campaign", _run_scheduled_campaign)
+
+
+
+class SchedulerWorker:
+
+    """Runs due jobs from the scheduled_jobs table.
+
+
+
+    Due times are kept in a heap and the worker sleeps until the earliest one, re-reading the
+
+    table every refresh_interval to pick up jobs added by other processes. Jobs are claimed with
+
+    an expiring lease, so several workers can share the table and a crashed worker's jobs are
+
+    taken over once its leases lapse.
+
+    """
+
+
+
+    def __init__(self, max_concurrent=SCHEDULER_MAX_CONCURRENT_JOBS, worker_id=None,
+
+                 lease_seconds=SCHEDULER_LEASE_SECONDS, refresh_interval=SCHEDULER_REFRESH_INTERVAL):
+
+        self.max_concurrent = max_concurrent
+
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self.lease_seconds = lease_seconds
+
+        self.refresh_interval = refresh_interval
+
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="scheduler")
+
+        self.heap = []
+
+        self.running = {}  # job_id -> claim time
+
+        self.lock = threading.Lock()
+
+        self.wakeup = threading.Event()
+
+        self.stopping = threading.Event()
+
+
+
+    def refresh(self):
+
+        """Rebuild the heap from the soonest scheduled jobs and any lapsed leases"""
+
+        conn = get_db_connection()
+
+        entries = conn.execute(
+
+            "SELECT next_run, job_id FROM scheduled_jobs WHERE status = 'scheduled' ORDER BY next_run LIMIT ?",
+
+            (SCHEDULER_PREFETCH,)
+
+        ).fetchall()
+
+        entries += conn.execute(
+
+            "SELECT lease_expires, job_id FROM scheduled_jobs WHERE status = 'running' AND lease_owner != ?",
+
+            (self.worker_id,)
+
+        ).fetchall()
+
+        with self.lock:
+
+            self.heap = [(due or 0, job_id) for due, job_id in entries]
+
+            heapq.heapify(self.heap)
+
+
+
+    def renew_leases(self):
+
+        with self.lock:
+
+            job_ids = list(self.running)
+
+        if not job_ids:
+
+            return
+
+        conn = get_db_connection()
+
+        conn.executemany(
+
+            "UPDATE scheduled_jobs SET lease_expires = ? WHERE job_id = ? AND lease_owner = ? AND status = 'running'",
+
+            [(time.time() + self.lease_seconds, job_id, self.worker_id) for job_id in job_ids]
+
+        )
+
+        conn.commit()
+
+
+
+    def claim(self, job_id, now):
+
+        """Take the lease on a due job; returns the job dict, or None if another worker has it"""
+
+        conn = get_db_connection()
+
+        cursor = conn.execute('''
+
+            UPDATE scheduled_jobs SET status = 'running', lease_owner = ?, lease_expires = ?, updated = ?
+
+            WHERE job_id = ? AND ((status = 'scheduled' AND next_run <= ?)
+
+                                  OR (status = 'running' AND lease_expires < ?))
+
+        ''', (self.worker_id, now + self.lease_seconds, datetime.now(), job_id, now, now))
+
+        conn.commit()
+
+        if cursor.rowcount == 0:
+
+            return None
+
+
+
+        row = conn.execute('''
+
+            SELECT kind, payload, next_run, interval_seconds, misfire_policy, misfire_grace,
+
+                   run_id, occurrence, attempts, name
+
+            FROM scheduled_jobs WHERE job_id = ?
+
+        ''', (job_id,)).fetchone()
+
+        job = dict(zip(["kind", "payload", "next_run", "interval_seconds", "misfire_policy", "misfire_grace",
+
+                        "run_id", "occurrence", "attempts", "name"], row))
+
+        job["job_id"] = job_id
+
+        job["payload"] = json.loads(job["payload"])
+
+
+
+        if job["run_id"] is None:
+
+            # A new occurrence: apply the misfire policy, then give it its own campaign run
+
+            late = now - job["next_run"]
+
+            if job["misfire_grace"] is not None and late > job["misfire_grace"] and job["misfire_policy"] == "skip":
+
+                self.release(job, next_run=self._next_occurrence(job, now), status="missed", error="Misfired")
+
+                return None
+
+            job["occurrence"] = job["next_run"]
 
-        if email_col != 'Gmail':
+            job["run_id"] = f"{job_id}-{int(job['occurrence'])}"
 
-            processed_df['Gmail'] = processed_df[email_col]
+            conn.execute("UPDATE scheduled_jobs SET run_id = ?, occurrence = ? WHERE job_id = ?",
 
-    
+                         (job["run_id"], job["occurrence"], job_id))
 
-    # Ensure company name column exists
+            conn.commit()
 
-    if company_col is None:
+        return job
 
-        company_col = processed_df.columns[0]
 
-        st.info(f"Using '{company_col}' as company name column.")
 
-    
+    def _next_occurrence(self, job, now):
 
-    return processed_df, email_col, company_col
+        """Next occurrence of a recurring job after now, skipping any that were missed unless catching up"""
 
+        interval = job["interval_seconds"]
 
+        if not interval:
 
-def create_comprehensive_company_info(row, company_col):
+            return None
 
-    """Create comprehensive company information string from all available data"""
+        anchor = job["occurrence"] or job["next_run"]
 
-    company_name = str(row.get(company_col, 'Unknown Company'))
+        if job["misfire_policy"] == "catch_up":
 
-    
+            return anchor + interval
 
-    # Exclude email and company name columns from additional info
+        return anchor + (int((now - anchor) // interval) + 1) * interval
 
-    excluded_cols = ['Gmail', 'gmail', 'email', 'Email', company_col]
 
-    
 
-    info_parts = [f"Company Name: {company_name}"]
+    def release(self, job, next_run=None, status="done", error=None, continue_run=False, attempts=0):
 
-    
+        """Give up the lease and record what happens to the job next"""
 
-    for col, value in row.items():
+        if next_run is not None:
 
-        if col not in excluded_cols and pd.notna(value) and str(value).strip():
+            status = "scheduled"
 
-            clean_value = str(value).strip()
+        conn = get_db_connection()
 
-            if clean_value and clean_value.lower() not in ['nan', 'none', 'null', '']:
+        conn.execute('''
 
-                info_parts.append(f"{col}: {clean_value}")
+            UPDATE scheduled_jobs SET status = ?, next_run = COALESCE(?, next_run), lease_owner = NULL,
 
-    
+                   lease_expires = NULL, run_id = ?, occurrence = ?, attempts = ?, last_run = ?,
 
-    return "\n".join(info_parts)
+                   last_error = ?, updated = ?
 
+            WHERE job_id = ? AND lease_owner = ? AND status = 'running'
 
+        ''', (status, next_run, job["run_id"] if continue_run else None,
 
-# Enhanced Google Sheets functions
+              job["occurrence"] if continue_run else None, attempts, time.time(), error,
 
-def authenticate_google_sheets():
+              datetime.now(), job["job_id"], self.worker_id))
 
-    try:
+        conn.commit()
 
-        client = gspread.service_account(filename=SERVICE_ACCOUNT_FILE)
+        if next_run is not None:
 
-        return client
+            with self.lock:
 
-    except Exception as e:
+                heapq.heappush(self.heap, (next_run, job["job_id"]))
 
-        st.error(f"Authentication Error: {str(e)}")
 
-        return None
 
+    def execute(self, job):
 
+        try:
 
-def load_google_sheet(sheet_url):
+            result = SCHEDULED_JOB_HANDLERS[job["kind"]](job) or {}
 
-    try:
+        except Exception as e:
 
-        gc = authenticate_google_sheets()
+            attempts = job["attempts"] + 1
 
-        if gc is None:
+            if attempts < SCHEDULER_MAX_ATTEMPTS:
 
-            return None, None, None
+                # Retry the same occurrence so its campaign run resumes where it stopped
 
-        sheet_key = sheet_url.split('/d/')[1].split('/')[0]
+                self.release(job, next_run=time.time() + SCHEDULER_RETRY_DELAY * attempts, error=str(e),
 
-        sheet = gc.open_by_key(sheet_key)
+                             continue_run=True, attempts=attempts)
 
-        worksheet = sheet.get_worksheet(0)
+            else:
 
-        data = worksheet.get_all_records()
+                next_run = self._next_occurrence(job, time.time())
 
-        return pd.DataFrame(data), gc, worksheet
+                self.release(job, next_run=next_run, status="failed", error=str(e))
 
-    except Exception as e:
+            print(f"Scheduled job {job['job_id']} failed: {e}")
 
-        st.error(f"Error loading sheet: {str(e)}")
+        else:
 
-        return None, None, None
+            if result.get("next_run") is not None:
 
+                self.release(job, next_run=result["next_run"], continue_run=True)
 
+            else:
 
-def update_google_sheet(worksheet, results_df):
+                self.release(job, next_run=self._next_occurrence(job, time.time()))
 
-    try:
+        finally:
 
-        data = [results_df.columns.values.tolist()]
+            flush_email_logs()
 
-        data.extend(results_df.values.tolist())
+            with self.lock:
 
-        worksheet.clear()
+                self.running.pop(job["job_id"], None)
 
-        worksheet.update('A1', data)
+            self.wakeup.set()
 
-        return True, "Google Sheet updated successfully!"
 
-    except Exception as e:
 
-        detailed_error = f"Error updating sheet: {str(e)}"
+    def run(self):
 
-        st.error(detailed_error)
+        """Run jobs until stop() is called"""
 
-        return False, detailed_error
+        init_database()
 
+        self.refresh()
 
+        next_refresh = time.time() + self.refresh_interval
 
-# Enhanced search functions for missing emails
+        next_renewal = time.time() + self.lease_seconds / 3
 
-def get_search_results(query, prompt, api_key, column_name):
 
-    try:
 
-        search_query = prompt.format(column_name=query)
+        while not self.stopping.is_set():
 
-    except KeyError:
+            now = time.time()
 
-        search_query = prompt.replace("{col_name}", query).replace("{column_name}", query)
+            if now >= next_refresh:
 
+                self.refresh()
 
+                next_refresh = now + self.refresh_interval
 
-    params = {
+            if now >= next_renewal:
 
-        "engine": "google",
+                self.renew_leases()
 
-        "q": search_query,
+                next_renewal = now + self.lease_seconds / 3
 
-        "num": 100,
 
-        "api_key": api_key
 
-    }
+            with self.lock:
 
+                due = []
 
+                while self.heap and self.heap[0][0] <= now and len(self.running) + len(due) < self.max_concurrent:
 
-    search = GoogleSearch(params)
+                    job_id = heapq.heappop(self.heap)[1]
 
-    results = search.get_dict()
+                    if job_id not in self.running and job_id not in due:
 
+                        due.append(job_id)
 
+                has_capacity = len(self.running) + len(due) < self.max_concurrent
 
-    text_content = ""
+                next_due = self.heap[0][0] if self.heap and has_capacity else float("inf")
 
-    if "knowledge_graph" in results:
 
-        knowledge = results["knowledge_graph"]
 
-        for key in ["title", "type", "website", "founded", "headquarters", "revenue",
+            for job_id in due:
 
-                    "social", "mobile", "phone", "ceo", "email", "contact email",
+                job = self.claim(job_id, now)
 
-                    "address", "contact", "call", "chat", "connect", "write",
+                if job is not None:
 
-                    "twitter", "instagram", "facebook"]:
+                    with self.lock:
 
-            text_content += f"{knowledge.get(key, '')}\n"
+                        self.running[job_id] = now
 
+                    self.executor.submit(self.execute, job)
 
 
-    for result in results.get("organic_results", []):
 
-        text_content += f"{result.get('title', 'N/A')} - {result.get('snippet', 'N/A')}\n"
+            self.wakeup.wait(max(0, min(next_due, next_refresh, next_renewal) - time.time()))
 
+            self.wakeup.clear()
 
 
-    return text_content
 
+        self.executor.shutdown(wait=True)
 
 
-def ask_groq_api(question, company, context, api_key):
 
-    headers = {
+    def stop(self):
 
-        "Authorization": f"Bearer {api_key}",
+        self.stopping.set()
 
-        "Content-Type": "application/json"
+        self.wakeup.set()
 
-    }
 
-    prompt = f"""
 
-    You are an AI assistant specialized in extracting specific information from any data.
+def run_scheduler_worker(max_concurrent=SCHEDULER_MAX_CONCURRENT_JOBS):
 
-    From the context and question provided, extract only the feature which is asked in the question.
+    """Entry point for a standalone scheduler process (see README)"""
 
-    Respond only with the asked feature, without any verbosity. Clean and exact answers only.
+    worker = SchedulerWorker(max_concurrent=max_concurrent)
 
+    if threading.current_thread() is threading.main_thread():
 
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
 
-    Question: {question}
+    print(f"Scheduler worker {worker.worker_id} started")
 
-    Company: {company}
+    try:
 
-    Context: {context}
+        worker.run()
 
-    """
+    except KeyboardInterrupt:
 
-    payload = {
+        worker.stop()
 
-        "model": "llama3-8b-8192",
+        worker.executor.shutdown(wait=True)
 
-        "messages": [
+    finally:
 
-            {"role": "system", "content": "You are an assistant that extracts specific information from context."},
+        flush_email_logs()
 
-            {"role": "user", "content": prompt}
 
-        ]
 
-    }
+# Open/click tracking service (run with run_tracking_server)
 
-    wait_time = 30
+TRANSPARENT_GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
 
-    max_retries = 5
+NO_CACHE_HEADERS = "Cache-Control: no-store, no-cache, must-revalidate, max-age=0\r\nPragma: no-cache\r\nExpires: 0\r\n"
 
 
 
-    for attempt in range(max_retries):
+class TrackingEventWriter(EmailLogWriter):
 
-        try:
+    """Writes batches of tracking hits to email_events and sets opened/clicked on email_logs"""
 
-            response = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
 
-            if response.status_code == 200:
 
-                response_json = response.json()
+    THREAD_NAME = "tracking-event-writer"
 
-                return response_json['choices'][0]['message']['content'].strip()
+    INSERT_SQL = '''
 
-            elif response.status_code == 429:
+        INSERT OR IGNORE INTO email_events (email_id, event, url, occurred, ip, user_agent)
 
-                print(f"Rate limit reached. Waiting for {wait_time} seconds before retrying...")
+        VALUES (?, ?, ?, ?, ?, ?)
 
-                time.sleep(wait_time)
+    '''
 
-                wait_time *= 2
 
-            else:
 
-                return f"Error: {response.status_code}, {response.text}"
+    def __init__(self, db_path=DB_PATH, batch_size=TRACKING_BATCH_SIZE, flush_interval=TRACKING_FLUSH_INTERVAL):
 
-        except Exception as e:
+        super().__init__(db_path, batch_size, flush_interval)
 
-            return f"Error: {str(e)}"
 
-    return "Error: Max retries exceeded. Please try again later."
 
+    def _write_batch(self, conn, batch):
 
+        if batch:
 
-def generate_email_content(template, company_name, company_info, api_key):
+            conn.executemany(self.INSERT_SQL, batch)
 
-    """Generate personalized email content using comprehensive company data"""
+            # A click means the message was opened too, even if images were blocked
 
-    headers = {
+            opened = {(row[0],) for row in batch}
 
-        "Authorization": f"Bearer {api_key}",
+            clicked = {(row[0],) for row in batch if row[1] == "click"}
 
-        "Content-Type": "application/json"
+            conn.executemany("UPDATE email_logs SET opened = 1 WHERE id = ? AND COALESCE(opened, 0) = 0", opened)
 
-    }
+            conn.executemany("UPDATE email_logs SET clicked = 1 WHERE id = ? AND COALESCE(clicked, 0) = 0", clicked)
 
-    
+            conn.commit()
 
-    prompt = f"""
+            batch.clear()
 
-    You are an expert email writer specializing in business communications that avoid spam filters.
 
-    Generate a professional, personalized email that follows these deliverability best practices:
 
+class TrackingServer:
 
+    """Minimal asyncio HTTP server for GET /pixel/<id>?sig=... and GET /click/<id>?url=...&sig=...
 
-    Template/Instructions: {template}
 
-    
 
-    Company Information (use this to personalize the email):
+    Responses are prebuilt bytes served from memory. Hits are queued to a TrackingEventWriter
 
-    {company_info}
+    and written in batches. Repeat opens of a message are dropped in memory (a bounded LRU of
 
-    
+    ids), and a unique index drops any that get past it, e.g. after a restart.
 
-    IMPORTANT DELIVERABILITY RULES:
+    """
 
-    1. Use professional, conversational tone (not overly salesy)
 
-    2. Avoid spam trigger words like "FREE", "URGENT", "GUARANTEED", excessive exclamation marks
 
-    3. Include specific, relevant details about the company from the provided information
+    def __init__(self, host=TRACKING_HOST, port=TRACKING_PORT, writer=None, dedupe_size=TRACKING_DEDUPE_SIZE):
 
-    4. Make it sound like genuine business correspondence
+        self.host = host
 
-    5. Keep subject line under 50 characters
+        self.port = port
 
-    6. Use proper sentence structure and grammar
+        self.writer = writer or TrackingEventWriter()
 
-    7. Include a clear but subtle call-to-action
+        self.dedupe_size = dedupe_size
 
-    8. Personalize with specific company details from the provided information
+        self.seen_opens = OrderedDict()
 
-    9. Reference specific company attributes like industry, location, size, etc. when available
+        self.stats = {"requests": 0, "opens": 0, "duplicate_opens": 0, "clicks": 0, "rejected": 0}
 
-    
+        self.server = None
 
-    Generate only the email content without any additional text or explanations.
+        self._responses = {
 
-    Make sure to use the company information provided to create a highly personalized message.
+            keep_alive: {
 
-    """
+                "pixel": self._response("200 OK", "Content-Type: image/gif\r\n" + NO_CACHE_HEADERS,
 
-    
+                                        TRANSPARENT_GIF, keep_alive),
 
-    payload = {
+                "not_found": self._response("404 Not Found", "Content-Type: text/plain\r\n", b"Not found", keep_alive),
 
-        "model": "llama3-8b-8192",
+                "bad_request": self._response("400 Bad Request", "Content-Type: text/plain\r\n", b"Bad request",
 
-        "messages": [
+                                              keep_alive),
 
-            {"role": "system", "content": "You are a professional email writer who creates highly personalized, spam-filter-friendly business emails using comprehensive company data."},
+                "too_large": self._response("413 Content Too Large", "Content-Type: text/plain\r\n",
 
-            {"role": "user", "content": prompt}
+                                            b"Request body too large", keep_alive),
 
-        ],
+            }
 
-        "temperature": 0.7,
+            for keep_alive in (True, False)
 
-        "max_tokens": 1000
+        }
 
-    }
 
-    
 
-    wait_time = 30
+    @staticmethod
 
-    max_retries = 3
+    def _response(status, headers, body, keep_alive):
 
-    
+        connection = "keep-alive" if keep_alive else "close"
 
-    for attempt in range(max_retries):
+        head = f"HTTP/1.1 {status}\r\n{headers}Content-Length: {len(body)}\r\nConnection: {connection}\r\n\r\n"
 
-        try:
+        return head.encode("latin-1") + body
 
-            response = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
 
-            if response.status_code == 200:
 
-                response_json = response.json()
+    def record_open(self, email_id, ip, user_agent):
 
-                generated_content = response_json['choices'][0]['message']['content'].strip()
+        if email_id in self.seen_opens:
 
-                return generated_content
+            self.seen_opens.move_to_end(email_id)
 
-            elif response.status_code == 429:
+            self.stats["duplicate_opens"] += 1
 
-                print(f"Rate limit reached. Waiting for {wait_time} seconds before retrying...")
+            return
 
-                time.sleep(wait_time)
+        self.seen_opens[email_id] = None
 
-                wait_time *= 2
+        if len(self.seen_opens) > self.dedupe_size:
 
-            else:
+            self.seen_opens.popitem(last=False)
 
-                return f"Error generating content: {response.status_code}, {response.text}"
+        self.stats["opens"] += 1
 
-        except Exception as e:
+        self.writer.write((email_id, "open", None, time.time(), ip, user_agent))
 
-            return f"Error generating content: {str(e)}"
 
-    
 
-    return "Error: Could not generate email content. Please try again later."
+    def handle(self, method, target, headers, ip, keep_alive):
 
+        """Response bytes for one request; never touches the database"""
 
+        self.stats["requests"] += 1
 
-def generate_email_subject(template, company_name, company_info, api_key):
+        responses = self._responses[keep_alive]
 
-    """Generate personalized email subject using comprehensive company data"""
+        if method not in ("GET", "HEAD"):
 
-    headers = {
+            return responses["bad_request"]
 
-        "Authorization": f"Bearer {api_key}",
 
-        "Content-Type": "application/json"
 
-    }
+        path, _, query = target.partition("?")
 
+        parts = path.strip("/").split("/")
 
+        if len(parts) != 2 or not parts[1]:
 
-    prompt = f"""
+            if path == "/health":
 
-    Generate a professional email subject line that will pass spam filters.
+                body = json.dumps(self.stats).encode("utf-8")
 
+                return self._response("200 OK", "Content-Type: application/json\r\n", body, keep_alive)
 
+            return responses["not_found"]
 
-    Template/Instructions: {template}
 
-    
 
-    Company Information (use this to personalize):
+        kind, email_id = parts[0], unquote(parts[1])
 
-    {company_info}
+        if kind == "pixel":
 
+            email_id = email_id.removesuffix(".gif")
 
+            signature = parse_qs(query).get("sig", [""])[0]
 
-    DELIVERABILITY RULES:
+            if TRACKING_SECRET and not hmac.compare_digest(signature, _pixel_signature(email_id)):
 
-    1. Keep under 50 characters
+                # Still serve the image, but a forged or unknown id is never recorded as an open
 
-    2. Avoid ALL CAPS, excessive punctuation (!!!), and spam words
+                self.stats["rejected"] += 1
 
-    3. Make it specific and personalized using the company information
+            elif method == "GET":
 
-    4. Sound like genuine business correspondence
+                self.record_open(email_id, ip, headers.get("user-agent"))
 
-    5. Include company name or specific detail naturally
+            return responses["pixel"]
 
-    6. Avoid words like: FREE, URGENT, GUARANTEED, AMAZING, INCREDIBLE
 
-    7. Use title case or sentence case
 
-    8. Do not include any newline characters
+        if kind == "click":
 
+            if not TRACKING_SECRET:
 
+                # Unsigned click links would make the service an open redirect
 
-    Generate only the subject line without any additional text.
+                self.stats["rejected"] += 1
 
-    """
+                return responses["not_found"]
 
+            params = parse_qs(query)
 
+            url = params.get("url", [""])[0]
 
-    payload = {
+            signature = params.get("sig", [""])[0]
 
-        "model": "llama3-8b-8192",
+            if (not url.lower().startswith(("http://", "https://"))
 
-        "messages": [
+                    or not hmac.compare_digest(signature, _click_signature(email_id, url))):
 
-            {"role": "system", "content": "You are an expert at creating professional, spam-filter-friendly email subject lines using company data."},
+                self.stats["rejected"] += 1
 
-            {"role": "user", "content": prompt}
+                return responses["bad_request"]
 
-        ],
+            if method == "GET":
 
-        "temperature": 0.7,
+                self.stats["clicks"] += 1
 
-        "max_tokens": 100
+                self.writer.write((email_id, "click", url, time.time(), ip, headers.get("user-agent")))
 
-    }
+            location = url.replace("\r", "").replace("\n", "")
 
+            return self._response("302 Found", f"Location: {location}\r\n{NO_CACHE_HEADERS}", b"", keep_alive)
 
 
-    try:
 
-        response = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
+        return responses["not_found"]
 
-        if response.status_code == 200:
 
-            response_json = response.json()
 
-            return response_json['choices'][0]['message']['content'].strip().replace('\n', '')
+    async def _serve_client(self, reader, writer):
 
-        else:
+        peer = writer.get_extra_info("peername")
 
-            return template.replace("{company_name}", company_name)
+        ip = peer[0] if peer else None
 
-    except Exception as e:
+        try:
 
-        return template.replace("{company_name}", company_name)
+            while True:
 
+                try:
 
+                    head = await reader.readuntil(b"\r\n\r\n")
 
-def create_html_email_body(plain_text, company_name, tracking_id=None):
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
 
-    """Create HTML email body with better formatting and optional tracking"""
+                    break
 
-    
+                lines = head.decode("latin-1").split("\r\n")
 
-    tracking_pixel = f'<img src="https://your-tracking-domain.com/pixel/{tracking_id}" width="1" height="1" style="display:none;">' if tracking_id else ""
+                try:
 
-    
+                    method, target, version = lines[0].split(" ", 2)
 
-    html_body = f"""
+                except ValueError:
 
-    <!DOCTYPE html>
+                    writer.write(self._responses[False]["bad_request"])
 
-    <html>
+                    break
 
-    <head>
+                headers = {}
 
-        <meta charset="UTF-8">
+                for line in lines[1:]:
 
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                    name, sep, value = line.partition(":")
 
-        <title>Email from AutoMail</title>
+                    if sep:
 
-    </head>
+                        headers[name.strip().lower()] = value.strip()
 
-    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333; max-width: 600px; margin: 0 auto; padding: 20px;">
+                try:
 
-        <div style="background-color: #f8f9fa; padding: 20px; border-radius: 10px; margin-bottom: 20px;">
+                    length = int(headers.get("content-length") or 0)
 
-            <div style="background-color: white; padding: 30px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1);">
+                except ValueError:
 
-                <div style="white-space: pre-line; margin-bottom: 20px;">
+                    length = -1
 
-                    {plain_text}
+                if length < 0:
 
-                </div>
+                    writer.write(self._responses[False]["bad_request"])
 
-                
+                    break
 
-                <hr style="border: none; height: 1px; background-color: #e9ecef; margin: 20px 0;">
+                if length > TRACKING_MAX_BODY_BYTES:
 
-                
+                    self.stats["rejected"] += 1
 
-                <div style="font-size: 12px; color: #6c757d; text-align: center;">
+                    writer.write(self._responses[False]["too_large"])
 
-                    <p>This email was sent by AutoMail Email System</p>
+                    break
 
-                    <p>If you'd like to unsubscribe, please reply with "UNSUBSCRIBE" in the subject line.</p>
+                if length:
 
-                </div>
+                    await reader.readexactly(length)
 
-            </div>
 
-        </div>
 
-        {tracking_pixel}
+                connection = headers.get("connection", "").lower()
 
-    </body>
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
 
-    </html>
+                response = self.handle(method, target, headers, ip, keep_alive)
 
-    """
+                writer.write(response if method != "HEAD" else response.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n")
 
-    return html_body
+                await writer.drain()
 
+                if not keep_alive:
 
+                    break
 
-def send_email_enhanced(receiver_email, subject, body, company_name="Unknown Company"):
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
 
-    """Enhanced email sending with better deliverability practices"""
+            pass
 
+        finally:
 
+            writer.close()
 
-    email_id = str(uuid.uuid4())
 
 
+    async def serve(self):
 
-    # Validate email
+        self.server = await asyncio.start_server(self._serve_client, self.host, self.port, backlog=1024)
 
-    if not is_valid_email(receiver_email):
+        async with self.server:
 
-        log_email_status(email_id, receiver_email, company_name, subject, "failed", "invalid_email", "Invalid email address")
+            await self.server.serve_forever()
 
-        return False, f"Invalid email address: {receiver_email}", email_id
 
 
+    def close(self):
 
-    # Check deliverability score
+        """Write out queued events"""
 
-    deliverability_score, warnings = validate_email_deliverability(receiver_email)
+        self.writer.close()
 
 
 
-    # Check if required environment variables are set
+def run_tracking_server(host=TRACKING_HOST, port=TRACKING_PORT):
 
-    if not EMAIL or not MAILJET_API_KEY or not MAILJET_SECRET_KEY:
+    """Entry point for a standalone tracking process (see README)"""
 
-        error_msg = "Missing email configuration. Check environment variables."
+    init_database()
 
-        log_email_status(email_id, receiver_email, company_name, subject, "failed", "config_error", error_msg)
+    server = TrackingServer(host, port)
 
-        return False, error_msg, email_id
+    print(f"Tracking server listening on {host}:{port}")
 
+    if not TRACKING_SECRET:
 
+        print("TRACKING_SECRET is not set: click tracking is disabled and /click returns 404")
 
-    sender_email = EMAIL
+    try:
 
-    sender_name = "BreakoutAI Team"
+        asyncio.run(server.serve())
 
+    except KeyboardInterrupt:
 
+        pass
 
-    # Create multipart message with both plain text and HTML
+    finally:
 
-    msg = MIMEMultipart('alternative')
+        server.close()
 
-    msg['From'] = f"{sender_name} <{sender_email}>"
 
-    msg['To'] = receiver_email
 
+async def _load_test_client(host, port, paths, latencies):
 
+    reader, writer = await asyncio.open_connection(host, port)
 
-    # Ensure subject line doesn't contain newlines
+    try:
 
-    clean_subject = subject.replace('\n', '') if subject else f"Partnership Opportunity for {company_name}"
+        for path in paths:
 
-    msg['Subject'] = clean_subject
+            started = time.perf_counter()
 
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode("latin-1"))
 
+            head = await reader.readuntil(b"\r\n\r\n")
 
-    # Add custom headers to improve deliverability
+            length = re.search(rb"Content-Length: (\d+)", head)
 
-    msg['Reply-To'] = sender_email
+            if length:
 
-    msg['Return-Path'] = sender_email
+                await reader.readexactly(int(length.group(1)))
 
-    msg['X-Mailer'] = 'BreakoutAI Email System v2.0'
+            latencies.append(time.perf_counter() - started)
 
-    msg['X-Priority'] = '3'
+    finally:
 
-    msg['Message-ID'] = f"<{email_id}@breakoutai.com>"
+        writer.close()
 
 
 
-    # Ensure body is not None
+def load_test_tracking_server(host="127.0.0.1", port=TRACKING_PORT, total=20000, concurrency=50, unique_ids=5000,
 
-    email_body = body if body else "Thank you for your time."
+                              click_ratio=0.1):
 
+    """Hit a running tracking server with keep-alive pixel/click requests and report throughput"""
 
+    def path(n):
 
-    # Create plain text and HTML versions
+        email_id = f"loadtest-{n % unique_ids}"
 
-    text_part = MIMEText(email_body, 'plain', 'utf-8')
+        if click_ratio and n % max(1, round(1 / click_ratio)) == 0:
 
-    html_part = MIMEText(create_html_email_body(email_body, company_name, email_id), 'html', 'utf-8')
+            url = "https://example.com/"
 
+            return f"/click/{email_id}?url={quote(url, safe='')}&sig={_click_signature(email_id, url)}"
 
+        return tracking_pixel_path(email_id)
 
-    # Attach parts
 
-    msg.attach(text_part)
 
-    msg.attach(html_part)
+    async def run():
 
+        latencies = []
 
+        started = time.perf_counter()
 
-    try:
+        await asyncio.gather(*[
 
-        # Create SMTP connection with enhanced settings
+            _load_test_client(host, port, [path(n) for n in range(worker, total, concurrency)], latencies)
 
-        server = smtplib.SMTP('in-v3.mailjet.com', 587)
+            for worker in range(concurrency)
 
-        server.starttls()
+        ])
 
-        
+        return time.perf_counter() - started, np.array(latencies)
 
-        # Login with Mailjet credentials
 
-        server.login(MAILJET_API_KEY, MAILJET_SECRET_KEY)
 
-        
+    elapsed, latencies = asyncio.run(run())
 
-        # Send email
+    return {
 
-        text = msg.as_string()
+        "requests": len(latencies),
 
-        server.sendmail(sender_email, receiver_email, text)
+        "seconds": round(elapsed, 3),
 
-        server.quit()
+        "requests_per_second": round(len(latencies) / elapsed, 1),
 
-        
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
 
-        # Log successful send
+        "p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 3),
 
-        delive
+    }
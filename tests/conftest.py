@@ -0,0 +1,196 @@
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import AutoMailer  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def isolated_cwd(tmp_path, monkeypatch):
+    """Run every test in a scratch directory so caches and databases never touch the checkout"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+class GroqStub:
+    """Local stand-in for the Groq chat completions endpoint"""
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []  # queued completion contents, served before the numbered defaults
+        self.status = 200
+        self.delay = 0.0  # seconds per request, standing in for the model's response time
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append(payload)
+                time.sleep(stub.delay)
+                if stub.status == 200:
+                    content = stub.responses.pop(0) if stub.responses else f"completion {len(stub.requests)}"
+                    body = json.dumps({"choices": [{"message": {"content": content}}]}).encode("utf-8")
+                else:
+                    body = b'{"error": "boom"}'
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/openai/v1/chat/completions"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def groq_stub(monkeypatch):
+    stub = GroqStub()
+    monkeypatch.setattr(AutoMailer, "GROQ_API_URL", stub.url)
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def llm_cache(tmp_path, monkeypatch):
+    cache = AutoMailer.LLMResponseCache(str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(AutoMailer, "_llm_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def tracking_db(monkeypatch):
+    """Fresh tracking database in the test directory, with its own connections and log writer"""
+    monkeypatch.setattr(AutoMailer, "_db_local", threading.local())
+    monkeypatch.setattr(AutoMailer, "_log_writer", None)
+    AutoMailer.init_database()
+    yield AutoMailer.get_db_connection()
+    if AutoMailer._log_writer is not None:
+        AutoMailer._log_writer.close()
+
+
+class FakeSMTPPool:
+    """Records messages instead of talking to an SMTP server"""
+
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        with self.lock:
+            self.sent.append(to_addrs)
+        return {}
+
+
+@pytest.fixture
+def smtp_pool(monkeypatch):
+    pool = FakeSMTPPool()
+    monkeypatch.setattr(AutoMailer, "_smtp_pool", pool)
+    monkeypatch.setattr(AutoMailer, "EMAIL", "sender@example.com")
+    monkeypatch.setattr(AutoMailer, "MAILJET_API_KEY", "key")
+    monkeypatch.setattr(AutoMailer, "MAILJET_SECRET_KEY", "secret")
+    monkeypatch.setitem(AutoMailer.PROVIDER_LIMITS, "test", {"rate": 10000, "burst": 10000, "max_connections": 2})
+    return pool
+
+
+class SMTPStub:
+    """Local plain-text SMTP server that accepts every message.
+
+    greeting_delay stands in for the TLS and AUTH handshake of a real provider, data_delay for
+    the time the server takes to accept a message, and drop_on_mail closes that many sessions
+    when they next send MAIL FROM, as a server dropping idle clients would.
+    """
+
+    def __init__(self, greeting_delay=0.0, data_delay=0.0):
+        self.greeting_delay = greeting_delay
+        self.data_delay = data_delay
+        self.drop_on_mail = 0
+        self.messages = []
+        self.commands = []  # (session number, verb)
+        self.sessions = 0
+        self.active = 0  # sessions inside a DATA transfer right now
+        self.peak_active = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode("ascii") + b"\r\n")
+
+            def handle(self):
+                with stub.lock:
+                    stub.sessions += 1
+                    session = stub.sessions
+                time.sleep(stub.greeting_delay)
+                self.reply("220 stub ready")
+                for raw in self.rfile:
+                    verb = raw.decode("ascii", "replace").strip().split(" ")[0].upper()
+                    with stub.lock:
+                        stub.commands.append((session, verb))
+                        drop = verb == "MAIL" and stub.drop_on_mail > 0
+                        if drop:
+                            stub.drop_on_mail -= 1
+                    if drop:
+                        return
+                    if verb == "DATA":
+                        self.receive(session)
+                    elif verb == "QUIT":
+                        self.reply("221 bye")
+                        return
+                    elif verb in ("EHLO", "HELO", "MAIL", "RCPT", "RSET", "NOOP"):
+                        self.reply("250 ok")
+                    else:
+                        self.reply("502 not implemented")
+
+            def receive(self, session):
+                self.reply("354 go ahead")
+                with stub.lock:
+                    stub.active += 1
+                    stub.peak_active = max(stub.peak_active, stub.active)
+                lines = []
+                for raw in self.rfile:
+                    if raw in (b".\r\n", b".\n"):
+                        break
+                    lines.append(raw)
+                time.sleep(stub.data_delay)
+                with stub.lock:
+                    stub.active -= 1
+                    stub.messages.append((session, b"".join(lines)))
+                self.reply("250 queued")
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+
+    def verbs(self, verb):
+        return [session for session, seen in self.commands if seen == verb]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def smtp_stub():
+    stub = SMTPStub()
+    yield stub
+    stub.close()
@@ -0,0 +1,193 @@
+"""Throughput of the optimized paths against the code they replaced.
+
+Run `python -m pytest tests/test_benchmarks.py -s` to print the figures. The assertions only
+require the new path to win, so they hold on slow or loaded machines.
+"""
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import AutoMailer
+from conftest import SMTPStub
+
+
+def rate(count, func):
+    started = time.perf_counter()
+    func()
+    return count / (time.perf_counter() - started)
+
+
+def report(name, before, after, unit):
+    print(f"\n{name}: {before:,.0f} -> {after:,.0f} {unit} ({after / before:.1f}x)")
+
+
+@pytest.fixture
+def slow_handshake_smtp():
+    # Handshake delay in place of the TCP + TLS + AUTH round trips to a real provider
+    stub = SMTPStub(greeting_delay=0.005)
+    yield stub
+    stub.close()
+
+
+def test_pooled_smtp_throughput(slow_handshake_smtp):
+    count = 100
+    message = b"Subject: hi\r\n\r\nhello\r\n"
+
+    def connection_per_message():
+        for n in range(count):
+            server = smtplib.SMTP("127.0.0.1", slow_handshake_smtp.port, timeout=5)
+            server.sendmail("sender@example.com", f"user{n}@example.com", message)
+            server.quit()
+
+    pool = AutoMailer.SMTPConnectionPool("127.0.0.1", slow_handshake_smtp.port, use_tls=False, size=4, timeout=5)
+
+    def pooled():
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda n: pool.sendmail("sender@example.com", f"user{n}@example.com", message),
+                              range(count)))
+
+    before, after = rate(count, connection_per_message), rate(count, pooled)
+    pool.close()
+
+    report("SMTP sending", before, after, "messages/s")
+    assert len(slow_handshake_smtp.messages) == 2 * count
+    assert after > 2 * before
+
+
+def test_batched_log_writes(tracking_db):
+    def row(n):
+        return (f"id{n}", f"user{n}@example.com", "Acme", "Hi", "2024-01-01 10:00:00", "sent", "primary", None)
+
+    def connection_per_row(count):
+        # The original log_email_status: connect, insert, commit and close for every email
+        for n in range(count):
+            conn = AutoMailer.sqlite3.connect(AutoMailer.DB_PATH)
+            conn.execute(AutoMailer.EmailLogWriter.INSERT_SQL, row(n))
+            conn.commit()
+            conn.close()
+
+    def batched(count):
+        writer = AutoMailer.EmailLogWriter()
+        for n in range(count):
+            writer.write(row(n))
+        writer.close()
+
+    before = rate(2000, lambda: connection_per_row(2000))
+    after = rate(100_000, lambda: batched(100_000))
+
+    report("Email log writes", before, after, "rows/s")
+    assert tracking_db.execute("SELECT COUNT(*) FROM email_logs").fetchone()[0] == 100_000
+    assert after > 5 * before
+
+
+def test_combined_generation_round_trips(groq_stub):
+    groq_stub.delay = 0.02
+    companies = [f"Company {n}" for n in range(10)]
+    info = "Company Name: {}\nIndustry: Software\nLocation: Berlin"
+
+    def two_calls():
+        for company in companies:
+            AutoMailer.generate_email_subject("Hi {company_name}", company, info.format(company), "key", use_cache=False)
+            AutoMailer.generate_email_content("Write a short intro", company, info.format(company), "key",
+                                              use_cache=False)
+
+    def combined():
+        groq_stub.responses.extend('{"subject": "Hi", "body": "Hello"}' for _ in companies)
+        for company in companies:
+            AutoMailer.generate_email_with_subject("Hi {company_name}", "Write a short intro", company,
+                                                   info.format(company), "key", use_cache=False)
+
+    def measure(func):
+        groq_stub.requests.clear()
+        started = AutoMailer.time.perf_counter()
+        func()
+        seconds = (AutoMailer.time.perf_counter() - started) / len(companies)
+        prompt_tokens = sum(AutoMailer._estimate_request_tokens({"messages": request["messages"]})
+                            for request in groq_stub.requests) / len(companies)
+        return seconds, len(groq_stub.requests) / len(companies), prompt_tokens
+
+    (before_s, before_calls, before_tokens), (after_s, after_calls, after_tokens) = measure(two_calls), measure(combined)
+
+    print(f"\nPer recipient: {before_calls:.0f} -> {after_calls:.0f} requests, "
+          f"{before_s * 1000:.0f} -> {after_s * 1000:.0f} ms, ~{before_tokens:.0f} -> ~{after_tokens:.0f} prompt tokens")
+    assert (before_calls, after_calls) == (2, 1)
+    assert after_s < before_s and after_tokens < before_tokens
+
+
+def synthetic_addresses(count):
+    domains = ["acme.com", "gmail.com", "mailinator.com", "globex.io", "example.org"]
+    emails = [f"user{n}@{domains[n % len(domains)]}" for n in range(count)]
+    for n in range(0, count, 97):
+        emails[n] = f"broken{n}.example.com"
+    return AutoMailer.pd.Series(emails)
+
+
+def test_bulk_email_validation():
+    per_row, bulk = synthetic_addresses(100_000), synthetic_addresses(1_000_000)
+
+    def row_by_row():
+        return [(AutoMailer.is_valid_email(email), AutoMailer.validate_email_deliverability(email)) for email in per_row]
+
+    before = rate(len(per_row), row_by_row)
+    after = rate(len(bulk), lambda: AutoMailer.validate_emails_bulk(bulk))
+
+    report("Email validation", before, after, "addresses/s")
+    sample = per_row.iloc[:1000]
+    result = AutoMailer.validate_emails_bulk(sample)
+    assert result["valid"].tolist() == [AutoMailer.is_valid_email(email) for email in sample]
+    assert result["score"].tolist() == [AutoMailer.validate_email_deliverability(email)[0] for email in sample]
+    assert after > 2 * before
+
+
+def legacy_html_body(plain_text, company_name, tracking_id=None):
+    """create_html_email_body before layouts were compiled, kept here as the baseline"""
+    tracking_pixel = f'<img src="https://your-tracking-domain.com/pixel/{tracking_id}" width="1" height="1" style="display:none;">' if tracking_id else ""
+    return f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>Email from AutoMail</title>
+    </head>
+    <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333; max-width: 600px; margin: 0 auto; padding: 20px;">
+        <div style="background-color: #f8f9fa; padding: 20px; border-radius: 10px; margin-bottom: 20px;">
+            <div style="background-color: white; padding: 30px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1);">
+                <div style="white-space: pre-line; margin-bottom: 20px;">
+                    {plain_text}
+                </div>
+                
+                <hr style="border: none; height: 1px; background-color: #e9ecef; margin: 20px 0;">
+                
+                <div style="font-size: 12px; color: #6c757d; text-align: center;">
+                    <p>This email was sent by AutoMail Email System</p>
+                    <p>If you'd like to unsubscribe, please reply with "UNSUBSCRIBE" in the subject line.</p>
+                </div>
+            </div>
+        </div>
+        {tracking_pixel}
+    </body>
+    </html>
+    """
+
+
+def test_html_layout_rendering():
+    count = 20_000
+    bodies = [f"Hi Company {n},\n\nWe help teams like yours ship faster.\n\nBest,\nSam" for n in range(count)]
+    names = [f"Company {n}" for n in range(count)]
+    ids = [f"id{n}" for n in range(count)]
+    legacy, rendered = [], []
+
+    before = rate(count, lambda: legacy.extend(map(legacy_html_body, bodies, names, ids)))
+    after = rate(count, lambda: rendered.extend(AutoMailer.render_html_email_batch(bodies, names, ids)))
+    before_size = sum(len(markup.encode("utf-8")) for markup in legacy) / count
+    after_size = sum(len(markup.encode("utf-8")) for markup in rendered) / count
+
+    report("HTML rendering", before, after, "renders/s")
+    print(f"Average HTML size: {before_size:,.0f} -> {after_size:,.0f} bytes")
+    assert after_size < 0.8 * before_size
+    # The baseline interpolates unescaped text; escaping and link rewriting now run per render,
+    # so only require the same order of throughput
+    assert after > before / 5
@@ -0,0 +1,166 @@
+import pandas as pd
+import pytest
+
+import AutoMailer
+
+
+def recipients(count):
+    return [{"Company": f"Company {n}", "Gmail": f"user{n}@example.com"} for n in range(count)]
+
+
+def run(rows, **kwargs):
+    return AutoMailer.run_campaign_pipeline(rows, "Company", "Hi {company_name}", "Hello {company_name}",
+                                            provider="test", **kwargs)
+
+
+def test_pipeline_sends_every_row_once(tracking_db, smtp_pool):
+    run(recipients(20), run_id="run-1")
+    run(recipients(20), run_id="run-1", retry_failed=True)
+
+    assert sorted(smtp_pool.sent) == sorted(row["Gmail"] for row in recipients(20))
+    assert AutoMailer.get_campaign_run("run-1")["recipients"] == {"sent": 20}
+
+
+def test_failing_feed_shuts_the_pipeline_down(tracking_db, smtp_pool):
+    def rows():
+        yield from recipients(3)
+        raise ValueError("bad chunk")
+
+    with pytest.raises(ValueError, match="bad chunk"):
+        run(rows(), run_id="run-2", campaign_id="campaign-2")
+
+    assert len(smtp_pool.sent) == 3
+    assert AutoMailer.get_campaign_progress("campaign-2")["status"] == "failed"
+    assert AutoMailer.get_campaign_run("run-2")["status"] == "failed"
+
+
+def test_ai_generation_goes_through_the_groq_stub(tracking_db, smtp_pool, groq_stub, llm_cache, monkeypatch):
+    monkeypatch.setattr(AutoMailer, "GROQ_API_KEY", "test-key")
+    groq_stub.responses.extend(f'{{"subject": "Subject {n}", "body": "Body {n}"}}' for n in range(5))
+
+    run(recipients(5), run_id="run-3", use_ai=True)
+
+    assert len(groq_stub.requests) == 5
+    assert len(smtp_pool.sent) == 5
+
+
+def claim_row(conn, run_id, email, claimed_at):
+    key = AutoMailer.campaign_message_key(run_id, email)
+    conn.execute("INSERT INTO campaign_recipients (run_id, message_key, recipient_email, status, claimed_at) "
+                 "VALUES (?, ?, ?, 'in_flight', ?)", (run_id, key, email, claimed_at))
+    conn.commit()
+    return key
+
+
+def test_abandoned_claims_are_sent_on_resume(tracking_db, smtp_pool):
+    AutoMailer.start_campaign_run(run_id="run-4")
+    claim_row(tracking_db, "run-4", "user0@example.com", AutoMailer.time.time() - AutoMailer.CAMPAIGN_CLAIM_TIMEOUT - 1)
+    claim_row(tracking_db, "run-4", "user1@example.com", AutoMailer.time.time())
+
+    run(recipients(3), run_id="run-4")
+
+    # The stale claim is taken over; the live one belongs to another sender and is left alone
+    assert sorted(smtp_pool.sent) == ["user0@example.com", "user2@example.com"]
+
+
+def test_claims_logged_as_sent_are_not_resent(tracking_db, smtp_pool):
+    AutoMailer.start_campaign_run(run_id="run-5")
+    key = claim_row(tracking_db, "run-5", "user0@example.com", 0)
+    AutoMailer.log_email_status(key, "user0@example.com", "Company 0", "Hi", "sent", "inbox")
+
+    run(recipients(2), run_id="run-5")
+
+    assert smtp_pool.sent == ["user1@example.com"]
+    assert AutoMailer.get_campaign_run("run-5")["recipients"] == {"sent": 2}
+
+
+def test_checkpoint_stops_at_rows_not_yet_final(tracking_db, smtp_pool):
+    def rows():
+        yield from recipients(5)
+        raise ValueError("bad chunk")
+
+    with pytest.raises(ValueError):
+        run(rows(), run_id="run-6", checkpoint_every=1)
+    assert AutoMailer.get_campaign_run("run-6")["checkpoint"] == 5
+
+    run(recipients(8), run_id="run-6")
+    assert len(smtp_pool.sent) == 8
+    assert AutoMailer.get_campaign_run("run-6")["checkpoint"] == 8
+
+
+def test_send_times_hold_rows_in_the_feeder(tracking_db, smtp_pool, monkeypatch):
+    real_sleep = AutoMailer.time.sleep
+    holds = []
+
+    def sleep(delay):
+        if delay > 60:
+            holds.append(AutoMailer.threading.current_thread().name)
+        else:
+            real_sleep(delay)
+
+    monkeypatch.setattr(AutoMailer.time, "sleep", sleep)
+    rows = recipients(3)
+    for n, row in enumerate(rows):
+        row["_send_at"] = AutoMailer.time.time() + 3600 * n
+
+    run(rows, run_id="run-7", send_at_col="_send_at")
+
+    assert holds == [AutoMailer.threading.current_thread().name] * 2
+    assert len(smtp_pool.sent) == 3
+
+
+def test_failed_generation_is_logged_and_not_sent(tracking_db, smtp_pool, groq_stub, llm_cache, monkeypatch):
+    monkeypatch.setattr(AutoMailer, "GROQ_API_KEY", "test-key")
+    groq_stub.status = 500
+
+    run(recipients(3), run_id="run-8", use_ai=True)
+    AutoMailer.flush_email_logs()
+
+    assert smtp_pool.sent == []
+    assert AutoMailer.get_campaign_run("run-8")["recipients"] == {"failed": 3}
+    logged = tracking_db.execute("SELECT status, delivery_status FROM email_logs").fetchall()
+    assert [tuple(row) for row in logged] == [("failed", "generation_error")] * 3
+
+
+def test_failed_sent_mark_never_downgrades_a_delivered_row(tracking_db, smtp_pool, monkeypatch):
+    mark = AutoMailer.mark_campaign_recipient
+
+    def flaky_mark(run_id, key, status, *args, **kwargs):
+        if status == "sent":
+            raise AutoMailer.sqlite3.OperationalError("database is locked")
+        return mark(run_id, key, status, *args, **kwargs)
+
+    monkeypatch.setattr(AutoMailer, "mark_campaign_recipient", flaky_mark)
+    monkeypatch.setattr(AutoMailer, "CAMPAIGN_MARK_RETRIES", 1)
+    run(recipients(2), run_id="run-9")
+    assert AutoMailer.get_campaign_run("run-9")["recipients"] == {"in_flight": 2}
+
+    monkeypatch.setattr(AutoMailer, "mark_campaign_recipient", mark)
+    run(recipients(2), run_id="run-9", retry_failed=True)
+
+    assert len(smtp_pool.sent) == 2
+    assert AutoMailer.get_campaign_run("run-9")["recipients"] == {"sent": 2}
+
+
+def test_blank_addresses_are_skipped(tracking_db, smtp_pool):
+    rows = recipients(2) + [{"Company": "Blank", "Gmail": ""}, {"Company": "Missing", "Gmail": None}]
+
+    run(rows, run_id="run-10", campaign_id="campaign-10")
+
+    assert sorted(smtp_pool.sent) == ["user0@example.com", "user1@example.com"]
+    assert AutoMailer.get_campaign_run("run-10")["recipients"] == {"sent": 2}
+    assert AutoMailer.get_campaign_progress("campaign-10")["skipped"] == 2
+
+
+def test_run_campaign_resumes_through_the_pipeline(tracking_db, smtp_pool):
+    df = pd.DataFrame(recipients(3))
+
+    results, campaign_id = AutoMailer.run_campaign(df, "Company", "Hi {company_name}", "Hello {company_name}",
+                                                   provider="test", run_id="run-11")
+    again, _ = AutoMailer.run_campaign(df, "Company", "Hi {company_name}", "Hello {company_name}",
+                                       provider="test", run_id="run-11", retry_failed=True)
+
+    assert campaign_id == "run-11"
+    assert results["success"].tolist() == [True, True, True]
+    assert again.empty
+    assert sorted(smtp_pool.sent) == sorted(row["Gmail"] for row in recipients(3))
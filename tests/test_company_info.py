@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+import AutoMailer
+
+
+def test_series_matches_per_row_info():
+    df = pd.DataFrame({
+        "Company": ["Acme", "Globex", np.nan],
+        "Gmail": ["a@acme.com", "b@globex.com", "c@x.com"],
+        "Founded": pd.to_datetime(["2020-01-01", None, "1999-12-31"]),
+        "Employees": [10, 250, 3],
+        "Revenue": [1.5, np.nan, 2.0],
+        "City": ["  Paris ", "null", None],
+        "Public": [True, False, True],
+        "Offices": pd.array([2, None, 7], dtype="Int64"),
+        "_valid": [True, True, False],
+    })
+
+    series = AutoMailer.build_company_info_series(df, "Company")
+
+    for index, row in df.iterrows():
+        assert series[index] == AutoMailer.create_comprehensive_company_info(row, "Company")
+    assert "Founded: 2020-01-01 00:00:00" in series[0]
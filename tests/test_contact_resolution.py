@@ -0,0 +1,64 @@
+import pytest
+
+import AutoMailer
+
+RESULTS = {
+    "knowledge_graph": {"website": "https://acme.com", "description": "Write to info@acme.com"},
+    "organic_results": [
+        {"title": "Acme contact", "snippet": "Reach us at info@acme.com, 1 Main St, Springfield",
+         "link": "https://acme.com/contact"},
+    ],
+}
+
+
+def _resolve(question, **kwargs):
+    calls = []
+
+    def extract(question, company, context):
+        calls.append(question)
+        return "llm answer"
+
+    answer, report = AutoMailer.resolve_contact(question, "Acme", RESULTS, extract, **kwargs)
+    return answer, report, calls
+
+
+@pytest.mark.parametrize("question", ["What is the email?", "Contact e-mail address", "EMAILS for sales"])
+def test_email_questions_skip_llm(question):
+    answer, report, calls = _resolve(question)
+    assert answer == "info@acme.com"
+    assert report["llm_skipped"] and not calls
+
+
+@pytest.mark.parametrize("question", ["What is the mailing address?", "Mail-in rebate terms", "Gmail workspace?"])
+def test_other_questions_go_to_llm(question):
+    answer, report, calls = _resolve(question)
+    assert answer == "llm answer"
+    assert not report["llm_skipped"] and calls == [question]
+
+
+def test_explicit_flag_overrides_question():
+    assert _resolve("Contact", expects_email=True)[0] == "info@acme.com"
+    assert _resolve("Work email", expects_email=False)[0] == "llm answer"
+
+
+@pytest.mark.parametrize("domain, company, matches", [
+    ("acme.com", "Acme Inc", True),
+    ("mail.acme-labs.io", "Acme", True),
+    ("acme.co.uk", "Acme Ltd", True),
+    ("generalelectric.com", "General Electric", True),
+    ("pacmeco.com", "Acme", False),
+    ("coolstartup.io", "Co Ai", False),
+    ("brainiac.com", "Ai Co", False),
+    ("company.com", "Acme Company", False),
+])
+def test_company_words_match_on_domain_tokens(domain, company, matches):
+    words = AutoMailer.normalize_company_query(company).split()
+    assert AutoMailer._domain_matches_company(domain, words) == matches
+
+
+def test_unrelated_domains_do_not_gain_confidence():
+    results = {"organic_results": [{"title": "Directory", "snippet": "hello@pacmeco.com and sales@acme.com"}]}
+
+    candidates = AutoMailer.extract_contact_candidates(results, "Acme")
+
+    assert [(c["email"], c["confidence"]) for c in candidates] == [("sales@acme.com", 0.6), ("hello@pacmeco.com", 0.3)]
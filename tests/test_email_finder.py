@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+import AutoMailer
+
+COMPANIES = [f"Company {n}" for n in range(8)]
+
+
+class FakeGoogleSearch:
+    """Stands in for serpapi.GoogleSearch, recording calls and peak concurrency"""
+    calls = []
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, params):
+        self.params = params
+
+    def get_dict(self):
+        cls = FakeGoogleSearch
+        with cls.lock:
+            cls.calls.append(self.params["q"])
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        time.sleep(0.05)
+        with cls.lock:
+            cls.active -= 1
+        return {"organic_results": [{"title": self.params["q"], "snippet": "Founded in 1999", "link": "https://x.example"}]}
+
+
+class CountingBucket(AutoMailer.TokenBucket):
+    def __init__(self):
+        super().__init__(rate=1000)
+        self.acquired = 0
+
+    def acquire(self, tokens=1):
+        self.acquired += tokens
+        super().acquire(tokens)
+
+
+@pytest.fixture
+def finder(tmp_path, monkeypatch, groq_stub, llm_cache):
+    FakeGoogleSearch.calls, FakeGoogleSearch.active, FakeGoogleSearch.peak = [], 0, 0
+    monkeypatch.setattr(AutoMailer, "GoogleSearch", FakeGoogleSearch)
+    monkeypatch.setattr(AutoMailer, "_serp_cache", AutoMailer.LLMResponseCache(str(tmp_path / "serp.db")))
+    buckets = {"serpapi": CountingBucket(), "groq": CountingBucket()}
+    monkeypatch.setattr(AutoMailer, "get_rate_limiter", buckets.__getitem__)
+
+    def find():
+        return AutoMailer.find_emails_bulk(COMPANIES + COMPANIES[:2], "{column_name} founder", "Who is the CEO?",
+                                           serp_api_key="serp-key", groq_api_key="groq-key")
+
+    return find, buckets, groq_stub
+
+
+def test_lookups_run_concurrently_once_per_company(finder):
+    find, buckets, groq_stub = finder
+
+    answers = find()
+
+    assert len(answers) == 10 and answers[8:] == answers[:2]
+    assert sorted(FakeGoogleSearch.calls) == sorted(f"{company} founder" for company in COMPANIES)
+    assert 1 < FakeGoogleSearch.peak <= AutoMailer.PROVIDER_LIMITS["serpapi"]["max_connections"]
+    assert len(groq_stub.requests) == len(COMPANIES)
+    assert buckets["serpapi"].acquired == buckets["groq"].acquired == len(COMPANIES)
+
+
+def test_cached_rerun_takes_no_rate_tokens(finder):
+    find, buckets, groq_stub = finder
+    first = find()
+    for bucket in buckets.values():
+        bucket.acquired = 0
+
+    assert find() == first
+    assert len(FakeGoogleSearch.calls) == len(groq_stub.requests) == len(COMPANIES)
+    assert buckets["serpapi"].acquired == buckets["groq"].acquired == 0
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import AutoMailer
+
+
+def test_combined_generation_returns_json_subject_and_body(groq_stub, llm_cache):
+    groq_stub.responses.append('{"subject": "Hello Acme", "body": "Dear Acme team"}')
+
+    subject, body = AutoMailer.generate_email_with_subject(
+        "Quick question for {company_name}", "Write a short intro email", "Acme", "Company Name: Acme", "test-key"
+    )
+
+    assert (subject, body) == ("Hello Acme", "Dear Acme team")
+    assert len(groq_stub.requests) == 1
+
+
+def test_fallback_uses_the_original_templates(groq_stub, llm_cache):
+    groq_stub.responses.append("Sure! Here is your email: Dear Acme team")
+
+    subject, body = AutoMailer.generate_email_with_subject(
+        "Quick question for {company_name}", "Write a short intro email", "Acme", "Company Name: Acme", "test-key"
+    )
+
+    assert (subject, body) == ("completion 2", "completion 3")
+    fallback_prompts = [request["messages"][1]["content"] for request in groq_stub.requests[1:]]
+    assert all("Subject line guidance" not in prompt for prompt in fallback_prompts)
+    assert "Template/Instructions: Quick question for {company_name}" in fallback_prompts[0]
+    assert "Template/Instructions: Write a short intro email" in fallback_prompts[1]
+
+
+def test_api_errors_raise_without_fallback(groq_stub, llm_cache):
+    groq_stub.status = 401
+
+    with pytest.raises(AutoMailer.EmailGenerationError, match="401"):
+        AutoMailer.generate_email_with_subject("Hi {company_name}", "Intro", "Acme", "Company Name: Acme", "test-key")
+
+    assert len(groq_stub.requests) == 1
+
+
+class CountingGovernor(AutoMailer.GroqRateGovernor):
+    def __init__(self):
+        super().__init__(max_concurrency=2)
+        self.posts = 0
+
+    async def post(self, payload, api_key, max_retries=5):
+        self.posts += 1
+        return await super().post(payload, api_key, max_retries)
+
+
+def agenerate(governor):
+    return asyncio.run(AutoMailer.agenerate_email_with_subject(
+        governor, "Hi {company_name}", "Intro", "Acme", "Company Name: Acme", "test-key"))
+
+
+def test_async_api_errors_raise_without_fallback(groq_stub, llm_cache):
+    groq_stub.status = 401
+    governor = CountingGovernor()
+
+    with pytest.raises(AutoMailer.EmailGenerationError, match="boom"):
+        agenerate(governor)
+
+    assert governor.posts == len(groq_stub.requests) == 1
+
+
+def test_async_fallback_goes_through_the_governor(groq_stub, llm_cache):
+    groq_stub.responses.append("not json")
+    governor = CountingGovernor()
+
+    assert agenerate(governor) == ("completion 2", "completion 3")
+    assert governor.posts == len(groq_stub.requests) == 3
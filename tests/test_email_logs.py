@@ -0,0 +1,76 @@
+import logging
+
+import AutoMailer
+
+
+def logged_rows(conn):
+    return conn.execute("SELECT id, status, delivery_status FROM email_logs ORDER BY id").fetchall()
+
+
+def test_rows_are_visible_after_flush(tracking_db):
+    for n in range(5):
+        AutoMailer.log_email_status(f"id{n}", f"user{n}@example.com", "Acme", "Hi", "sent", "primary")
+
+    assert AutoMailer.flush_email_logs() is True
+    assert logged_rows(tracking_db) == [(f"id{n}", "sent", "primary") for n in range(5)]
+
+
+def test_close_drains_the_queue(tracking_db):
+    writer = AutoMailer.EmailLogWriter(batch_size=1000, flush_interval=60)
+    for n in range(3):
+        writer.write((f"id{n}", "a@example.com", "Acme", "Hi", "2024-01-01 10:00:00", "sent", "primary", None))
+
+    writer.close()
+
+    assert len(logged_rows(tracking_db)) == 3
+
+
+def test_failed_batches_are_logged_and_retried(tracking_db, caplog):
+    path = "unmigrated.db"
+    writer = AutoMailer.EmailLogWriter(db_path=path, flush_interval=60)
+    writer.write(("id0", "a@example.com", "Acme", "Hi", "2024-01-01 10:00:00", "sent", "primary", None))
+
+    with caplog.at_level(logging.ERROR, logger=AutoMailer.logger.name):
+        assert writer.flush() is False
+    assert "failed to write 1 rows" in caplog.text
+    assert "no such table" in writer.last_error
+
+    conn = AutoMailer.connect_database(path)
+    conn.execute("CREATE TABLE email_logs (id TEXT PRIMARY KEY, recipient_email TEXT, company_name TEXT, subject TEXT, "
+                 "sent_time TIMESTAMP, status TEXT, delivery_status TEXT, error_message TEXT)")
+    conn.commit()
+
+    assert writer.flush() is True
+    assert writer.last_error is None
+    assert conn.execute("SELECT id FROM email_logs").fetchall() == [("id0",)]
+    writer.close()
+
+
+def rollup(conn):
+    return sorted(conn.execute("SELECT date, hour, status, delivery_status, domain, count, opened, clicked "
+                               "FROM email_stats_daily WHERE count != 0 OR opened != 0 OR clicked != 0").fetchall())
+
+
+def test_rollup_matches_a_rebuild_after_replaces_and_flag_updates(tracking_db):
+    for n in range(6):
+        AutoMailer.log_email_status(f"id{n}", f"user{n}@{'acme' if n % 2 else 'globex'}.com", "Co", "Hi", "sent",
+                                    "primary")
+    AutoMailer.flush_email_logs()
+
+    # Re-logging an id replaces its row; opens and clicks flip flags on existing rows
+    AutoMailer.log_email_status("id0", "user0@globex.com", "Co", "Hi", "failed", "send_error", "boom")
+    AutoMailer.log_email_status("id1", "user1@acme.com", "Co", "Hi", "sent", "spam_risk")
+    AutoMailer.flush_email_logs()
+    tracking_db.execute("UPDATE email_logs SET opened = 1 WHERE id IN ('id2', 'id3')")
+    tracking_db.execute("UPDATE email_logs SET clicked = 1 WHERE id = 'id3'")
+    tracking_db.execute("DELETE FROM email_logs WHERE id = 'id5'")
+    tracking_db.commit()
+
+    incremental = rollup(tracking_db)
+    AutoMailer.rebuild_daily_rollup()
+
+    assert incremental == rollup(tracking_db)
+    summary = AutoMailer.get_email_summary()
+    assert summary["total"] == 5
+    assert summary["by_status"] == {"sent": 4, "failed": 1}
+    assert summary["by_domain"].set_index("domain").loc["acme.com", ["count", "opened", "clicked"]].tolist() == [2, 1, 1]
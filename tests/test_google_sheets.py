@@ -0,0 +1,169 @@
+import pandas as pd
+import pytest
+from gspread.utils import a1_range_to_grid_range
+
+import AutoMailer
+
+
+class FakeWorksheet:
+    """In-memory worksheet that applies batch updates the way the Sheets API does"""
+
+    def __init__(self, grid, rows=None, cols=None):
+        self.id = 0
+        self.spreadsheet_id = "sheet-1"
+        self.cells = [list(row) for row in grid]
+        self.row_count = rows or len(grid)
+        self.col_count = cols or max((len(row) for row in grid), default=0)
+        self.batches = []
+
+    def row_values(self, row):
+        return list(self.cells[row - 1]) if row <= len(self.cells) else []
+
+    def get(self, range_name):
+        """Values in the range, dropping trailing empty rows and cells like the API does"""
+        grid = a1_range_to_grid_range(range_name)
+        rows = [[str(value) for value in row[grid["startColumnIndex"]:grid["endColumnIndex"]]]
+                for row in self.cells[grid["startRowIndex"]:grid["endRowIndex"]]]
+        rows = [row[:max((i + 1 for i, value in enumerate(row) if value), default=0)] for row in rows]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def get_all_values(self):
+        width = max((len(row) for row in self.cells), default=0)
+        return [[str(value) for value in row] + [""] * (width - len(row)) for row in self.cells]
+
+    def add_rows(self, count):
+        self.row_count += count
+
+    def add_cols(self, count):
+        self.col_count += count
+
+    def batch_update(self, data):
+        self.batches.append(data)
+        for update in data:
+            grid = a1_range_to_grid_range(update["range"])
+            assert grid["endRowIndex"] <= self.row_count and grid["endColumnIndex"] <= self.col_count
+            assert len(update["values"]) == grid["endRowIndex"] - grid["startRowIndex"]
+            for r, row in enumerate(update["values"], grid["startRowIndex"]):
+                assert len(row) == grid["endColumnIndex"] - grid["startColumnIndex"]
+                while len(self.cells) <= r:
+                    self.cells.append([])
+                for c, value in enumerate(row, grid["startColumnIndex"]):
+                    self.cells[r].extend([""] * (c + 1 - len(self.cells[r])))
+                    self.cells[r][c] = value
+
+
+@pytest.fixture(autouse=True)
+def no_snapshots(monkeypatch):
+    monkeypatch.setattr(AutoMailer, "_sheet_snapshots", {})
+
+
+def test_changed_ranges_merges_runs_into_rectangles():
+    old = [["Company", "Email", "Status"], ["Acme", "", ""], ["Globex", "", ""], ["Initech", "x", ""]]
+    new = [["Company", "Email", "Status"], ["Acme", "a@acme.com", "sent"], ["Globex", "b@globex.com", "sent"],
+           ["Initech", "x", "failed"]]
+
+    assert AutoMailer._changed_ranges(old, new) == [
+        {"range": "B2:C3", "values": [["a@acme.com", "sent"], ["b@globex.com", "sent"]]},
+        {"range": "C4:C4", "values": [["failed"]]},
+    ]
+
+
+def test_changed_ranges_ignores_number_formatting_and_clears_removed_cells():
+    old = [["n", "extra"], ["3", "gone"]]
+    new = [["n"], [3.0]]
+
+    assert AutoMailer._changed_ranges(old, new) == [{"range": "B1:B2", "values": [[""], [""]]}]
+    assert AutoMailer._changed_ranges(new, new) == []
+
+
+def test_update_writes_only_changed_cells():
+    worksheet = FakeWorksheet([["Company", "Email"], ["Acme", ""], ["Globex", ""]])
+    df = pd.DataFrame({"Company": ["Acme", "Globex"], "Email": ["a@acme.com", None]})
+
+    ok, message = AutoMailer.update_google_sheet(worksheet, df)
+
+    assert ok, message
+    assert worksheet.batches == [[{"range": "B2:B2", "values": [["a@acme.com"]]}]]
+    assert worksheet.get_all_values() == [["Company", "Email"], ["Acme", "a@acme.com"], ["Globex", ""]]
+    assert AutoMailer.update_google_sheet(worksheet, df) == (True, "Google Sheet already up to date.")
+    assert len(worksheet.batches) == 1
+
+
+def test_update_grows_sheet_and_chunks_requests(monkeypatch):
+    monkeypatch.setattr(AutoMailer, "SHEETS_MAX_CELLS_PER_REQUEST", 4)
+    worksheet = FakeWorksheet([["Company"], ["Acme"]])
+    df = pd.DataFrame({"Company": ["Acme", "Globex", "Initech"], "Status": ["sent", "sent", "failed"]})
+
+    ok, message = AutoMailer.update_google_sheet(worksheet, df)
+
+    assert ok, message
+    assert (worksheet.row_count, worksheet.col_count) == (4, 2)
+    assert len(worksheet.batches) > 1
+    assert all(sum(len(u["values"]) * len(u["values"][0]) for u in batch) <= 4 for batch in worksheet.batches)
+    assert worksheet.get_all_values() == [["Company", "Status"], ["Acme", "sent"], ["Globex", "sent"],
+                                          ["Initech", "failed"]]
+
+
+def test_update_reports_api_errors(monkeypatch):
+    class BrokenWorksheet(FakeWorksheet):
+        def batch_update(self, data):
+            raise RuntimeError("quota exceeded")
+
+    errors = []
+    monkeypatch.setattr(AutoMailer.st, "error", errors.append)
+
+    ok, message = AutoMailer.update_google_sheet(BrokenWorksheet([["a"]]), pd.DataFrame({"a": ["b"]}))
+
+    assert not ok and "quota exceeded" in message
+    assert errors == [message]
+
+
+def test_pages_continue_past_blank_gaps():
+    grid = [["Company", "Email"], ["Acme", "a@acme.com"], ["", ""], ["", ""], ["", ""], ["", ""],
+            ["Globex", ""], ["Initech", "i@initech.com"], ["", ""], ["", ""]]
+    worksheet = FakeWorksheet(grid)
+
+    pages = list(AutoMailer.iter_google_sheet_pages(worksheet, page_size=2))
+    df = pd.concat(pages, ignore_index=True)
+
+    # Row positions must match the sheet so results can be written back in place
+    assert df.values.tolist() == [row for row in grid[1:8]]
+    assert AutoMailer._changed_ranges(grid, AutoMailer._sheet_grid(df)) == []
+
+
+def test_pages_stop_at_row_count():
+    worksheet = FakeWorksheet([["Company"], ["Acme"]], rows=5)
+    calls = []
+    get = worksheet.get
+    worksheet.get = lambda range_name: calls.append(range_name) or get(range_name)
+
+    pages = list(AutoMailer.iter_google_sheet_pages(worksheet, page_size=3))
+
+    assert [page.values.tolist() for page in pages] == [[["Acme"]]]
+    assert calls == ["A2:A4", "A5:A5"]
+
+
+class FakeClient:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def open_by_key(self, key):
+        return self
+
+    def get_worksheet(self, index):
+        return self.worksheet
+
+
+def test_full_load_and_pages_share_dtypes(monkeypatch):
+    grid = [["Company", "Employees", "Revenue"], ["Acme", "10", "1.5"], ["Globex", "250", "2"]]
+    worksheet = FakeWorksheet(grid)
+    monkeypatch.setattr(AutoMailer, "authenticate_google_sheets", lambda: FakeClient(worksheet))
+
+    df, _, _ = AutoMailer.load_google_sheet("https://docs.google.com/spreadsheets/d/sheet-1/edit", use_snapshot=False)
+    page = next(AutoMailer.iter_google_sheet_pages(worksheet))
+
+    assert df.values.tolist() == [["Acme", 10, 1.5], ["Globex", 250, 2]]
+    pd.testing.assert_series_equal(df.dtypes, page.dtypes)
+    assert AutoMailer._sheet_snapshots[("sheet-1", 0)] == AutoMailer._sheet_grid(df)
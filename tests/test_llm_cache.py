@@ -0,0 +1,107 @@
+import pytest
+
+import AutoMailer
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(AutoMailer.time, "time", lambda: now[0])
+    return now
+
+
+def generate(**kwargs):
+    return AutoMailer.generate_email_content("Say hi", "Acme", "Company Name: Acme", "test-key", **kwargs)
+
+
+def test_repeat_request_is_served_from_cache(groq_stub, llm_cache):
+    first = generate()
+    second = generate()
+
+    assert first == second == "completion 1"
+    assert len(groq_stub.requests) == 1
+    assert llm_cache.stats() == {"hits": 1, "misses": 1, "entries": 1}
+
+
+def test_different_prompt_misses(groq_stub, llm_cache):
+    generate()
+    AutoMailer.generate_email_content("Say bye", "Acme", "Company Name: Acme", "test-key")
+
+    assert len(groq_stub.requests) == 2
+    assert llm_cache.stats()["misses"] == 2
+
+
+def test_use_cache_false_bypasses_cache(groq_stub, llm_cache):
+    generate(use_cache=False)
+    generate(use_cache=False)
+
+    assert len(groq_stub.requests) == 2
+    assert llm_cache.stats() == {"hits": 0, "misses": 0, "entries": 0}
+
+
+def test_refresh_cache_replaces_entry(groq_stub, llm_cache):
+    generate()
+    assert generate(refresh_cache=True) == "completion 2"
+    assert generate() == "completion 2"
+    assert len(groq_stub.requests) == 2
+
+
+def test_error_responses_are_not_cached(groq_stub, llm_cache):
+    groq_stub.status = 500
+    with pytest.raises(AutoMailer.EmailGenerationError, match="500"):
+        generate()
+
+    groq_stub.status = 200
+    assert generate() == "completion 2"
+    assert llm_cache.stats()["entries"] == 1
+
+
+def test_entries_expire_after_ttl(groq_stub, tmp_path, monkeypatch, clock):
+    cache = AutoMailer.LLMResponseCache(str(tmp_path / "ttl.db"), ttl=60)
+    monkeypatch.setattr(AutoMailer, "_llm_cache", cache)
+
+    generate()
+    clock[0] += 59
+    assert generate() == "completion 1"
+    clock[0] += 2
+    assert generate() == "completion 2"
+    assert len(groq_stub.requests) == 2
+
+
+def test_purge_expired_removes_old_rows(tmp_path, clock):
+    cache = AutoMailer.LLMResponseCache(str(tmp_path / "purge.db"), ttl=60)
+    cache.set("old", "a")
+    clock[0] += 120
+    cache.set("new", "b")
+
+    cache.purge_expired()
+
+    assert cache.get("old") is None
+    assert cache.get("new") == "b"
+    assert cache.stats()["entries"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    cache = AutoMailer.LLMResponseCache(str(tmp_path / "lru.db"), max_entries=2)
+    cache.set("a", "1")
+    clock[0] += 1
+    cache.set("b", "2")
+    clock[0] += 1
+    assert cache.get("a") == "1"
+    clock[0] += 1
+
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_cache_persists_across_instances(groq_stub, tmp_path, monkeypatch):
+    path = str(tmp_path / "persist.db")
+    monkeypatch.setattr(AutoMailer, "_llm_cache", AutoMailer.LLMResponseCache(path))
+    generate()
+
+    monkeypatch.setattr(AutoMailer, "_llm_cache", AutoMailer.LLMResponseCache(path))
+    assert generate() == "completion 1"
+    assert len(groq_stub.requests) == 1
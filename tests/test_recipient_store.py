@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+import AutoMailer
+
+
+def recipients():
+    return pd.DataFrame({
+        "Company": ["Acme", "Globex", None],
+        "Gmail": ["a@acme.com", "not-an-email", "c@initech.com"],
+        "Employees": [10, 250, 3],
+        "Revenue": [1.5, np.nan, 2.0],
+        "Founded": [2001, "unknown", None],
+    })
+
+
+def test_recipient_list_round_trip():
+    df = recipients()
+    AutoMailer.save_recipient_list(df, "leads", "Gmail", "Company")
+
+    loaded, email_col, company_col = AutoMailer.load_recipient_list("leads")
+
+    assert (email_col, company_col) == ("Gmail", "Company")
+    pd.testing.assert_frame_equal(loaded[["Company", "Gmail", "Employees", "Revenue"]],
+                                  df[["Company", "Gmail", "Employees", "Revenue"]])
+    # Mixed-type columns come back as strings, missing values stay missing
+    assert loaded["Founded"].tolist()[:2] == ["2001", "unknown"]
+    assert pd.isna(loaded["Founded"][2])
+    assert loaded["_valid"].tolist() == [True, False, True]
+    assert loaded["_domain"].tolist()[0] == "acme.com"
+    assert AutoMailer.list_recipient_lists() == ["leads"]
+
+
+def test_recipient_list_reads_only_requested_columns():
+    AutoMailer.save_recipient_list(recipients(), "leads", "Gmail", "Company")
+
+    loaded, email_col, _ = AutoMailer.load_recipient_list("leads", columns=["_valid", "Gmail", "Missing"])
+
+    assert email_col == "Gmail"
+    assert list(loaded.columns) == ["Gmail", "_valid"]
+    assert loaded["Gmail"].tolist() == ["a@acme.com", "not-an-email", "c@initech.com"]
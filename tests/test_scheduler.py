@@ -0,0 +1,186 @@
+import pandas as pd
+import pytest
+
+import AutoMailer
+
+T0 = 1_700_000_000.0
+HOUR = 3600
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [T0]
+    monkeypatch.setattr(AutoMailer.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def handled(tracking_db, clock, monkeypatch):
+    """A "test" job kind whose handler records the jobs it runs and can be told to fail"""
+    calls = []
+    failures = []
+
+    def handler(job):
+        calls.append(dict(job))
+        if failures:
+            raise failures.pop(0)
+
+    monkeypatch.setitem(AutoMailer.SCHEDULED_JOB_HANDLERS, "test", handler)
+    return calls, failures
+
+
+def worker(name, lease_seconds=300):
+    return AutoMailer.SchedulerWorker(max_concurrent=1, worker_id=name, lease_seconds=lease_seconds)
+
+
+def job_row(job_id):
+    row = AutoMailer.get_db_connection().execute(
+        "SELECT status, next_run, run_id, lease_owner, attempts, last_error FROM scheduled_jobs WHERE job_id = ?",
+        (job_id,)
+    ).fetchone()
+    return dict(zip(["status", "next_run", "run_id", "lease_owner", "attempts", "last_error"], row))
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(handled, clock):
+    job_id = AutoMailer.schedule_job("test", {}, run_at=T0)
+    first, second = worker("w1"), worker("w2")
+
+    job = first.claim(job_id, T0)
+    assert job["run_id"] == f"{job_id}-{int(T0)}"
+    assert second.claim(job_id, T0 + 299) is None
+
+    # w1 died holding the lease; once it lapses w2 takes over the same occurrence
+    taken = second.claim(job_id, T0 + 301)
+    assert taken["run_id"] == job["run_id"]
+    assert job_row(job_id)["lease_owner"] == "w2"
+
+    # The stale owner can no longer release the job
+    first.release(job)
+    assert job_row(job_id)["status"] == "running"
+    second.execute(taken)
+    assert job_row(job_id)["status"] == "done"
+
+
+def test_renewed_lease_is_not_reclaimed(handled, clock):
+    job_id = AutoMailer.schedule_job("test", {}, run_at=T0)
+    first, second = worker("w1"), worker("w2")
+    first.running[job_id] = T0
+    first.claim(job_id, T0)
+
+    clock[0] = T0 + 250
+    first.renew_leases()
+
+    assert second.claim(job_id, T0 + 301) is None
+
+
+def late_recurring_job(policy):
+    # Due at T0 every hour, one-minute grace; the worker comes back 2.5 hours late
+    job_id = AutoMailer.schedule_job("test", {}, run_at=T0, interval=HOUR, misfire_policy=policy, misfire_grace=60)
+    return job_id, T0 + 2.5 * HOUR
+
+
+def test_skip_policy_drops_late_runs(handled, clock):
+    calls, _ = handled
+    job_id, now = late_recurring_job("skip")
+    clock[0] = now
+
+    assert worker("w1").claim(job_id, now) is None
+    assert calls == []
+    assert job_row(job_id) == {"status": "scheduled", "next_run": T0 + 3 * HOUR, "run_id": None,
+                               "lease_owner": None, "attempts": 0, "last_error": "Misfired"}
+
+
+def test_run_once_policy_coalesces_missed_runs(handled, clock):
+    calls, _ = handled
+    job_id, now = late_recurring_job("run_once")
+    clock[0] = now
+    scheduler = worker("w1")
+
+    scheduler.execute(scheduler.claim(job_id, now))
+
+    assert [call["occurrence"] for call in calls] == [T0]
+    assert job_row(job_id)["next_run"] == T0 + 3 * HOUR
+
+
+def test_catch_up_policy_runs_every_missed_occurrence(handled, clock):
+    calls, _ = handled
+    job_id, now = late_recurring_job("catch_up")
+    clock[0] = now
+    scheduler = worker("w1")
+
+    while (job := scheduler.claim(job_id, now)) is not None:
+        scheduler.execute(job)
+
+    assert [call["occurrence"] for call in calls] == [T0, T0 + HOUR, T0 + 2 * HOUR]
+    assert job_row(job_id)["next_run"] == T0 + 3 * HOUR
+
+
+def test_recurring_job_is_rescheduled_and_one_off_job_finishes(handled, clock):
+    calls, _ = handled
+    recurring = AutoMailer.schedule_job("test", {}, run_at=T0, interval=HOUR)
+    once = AutoMailer.schedule_job("test", {}, run_at=T0)
+    scheduler = worker("w1")
+
+    for job_id in (recurring, once):
+        scheduler.execute(scheduler.claim(job_id, T0))
+    assert scheduler.claim(recurring, T0 + 10) is None
+
+    assert job_row(recurring) == {"status": "scheduled", "next_run": T0 + HOUR, "run_id": None,
+                                  "lease_owner": None, "attempts": 0, "last_error": None}
+    assert job_row(once)["status"] == "done"
+    assert (T0 + HOUR, recurring) in scheduler.heap
+
+    clock[0] = T0 + HOUR
+    scheduler.execute(scheduler.claim(recurring, T0 + HOUR))
+    assert [call["run_id"] for call in calls] == [f"{recurring}-{int(T0)}", f"{once}-{int(T0)}",
+                                                  f"{recurring}-{int(T0 + HOUR)}"]
+
+
+def test_failed_pass_retries_the_same_occurrence(handled, clock):
+    calls, failures = handled
+    job_id = AutoMailer.schedule_job("test", {}, run_at=T0, interval=HOUR)
+    scheduler = worker("w1")
+    failures.append(RuntimeError("smtp down"))
+
+    scheduler.execute(scheduler.claim(job_id, T0))
+    row = job_row(job_id)
+    assert row["status"] == "scheduled" and row["attempts"] == 1 and row["last_error"] == "smtp down"
+    assert row["next_run"] == T0 + AutoMailer.SCHEDULER_RETRY_DELAY
+
+    scheduler.execute(scheduler.claim(job_id, row["next_run"]))
+    assert calls[0]["run_id"] == calls[1]["run_id"] == f"{job_id}-{int(T0)}"
+    assert job_row(job_id)["next_run"] == T0 + HOUR
+
+
+def test_scheduled_campaign_resumes_its_run(tracking_db, smtp_pool, clock, monkeypatch):
+    recipients = pd.DataFrame({"Company": [f"Company {n}" for n in range(5)],
+                               "Gmail": [f"user{n}@example.com" for n in range(5)]})
+    AutoMailer.save_recipient_list(recipients, "leads", "Gmail", "Company")
+    job_id = AutoMailer.schedule_campaign("leads", "Hi {company_name}", "Hello {company_name}", run_at=T0,
+                                          provider="test")
+    scheduler = worker("w1")
+
+    # The first pass dies partway through its recipient list
+    normalize = AutoMailer.normalize_email
+
+    def failing_normalize(email):
+        if email == "user3@example.com":
+            raise ValueError("bad row")
+        return normalize(email)
+
+    monkeypatch.setattr(AutoMailer, "normalize_email", failing_normalize)
+    scheduler.execute(scheduler.claim(job_id, T0))
+    run_id = f"{job_id}-{int(T0)}"
+    assert sorted(smtp_pool.sent) == [f"user{n}@example.com" for n in range(3)]
+    assert job_row(job_id)["run_id"] == run_id
+
+    monkeypatch.setattr(AutoMailer, "normalize_email", normalize)
+    retry_at = job_row(job_id)["next_run"]
+    clock[0] = retry_at
+    scheduler.execute(scheduler.claim(job_id, retry_at))
+
+    assert sorted(smtp_pool.sent) == [f"user{n}@example.com" for n in range(5)]
+    assert AutoMailer.get_campaign_run(run_id)["recipients"] == {"sent": 5}
+    runs = tracking_db.execute("SELECT run_id FROM campaign_runs").fetchall()
+    assert [row[0] for row in runs] == [run_id]
+    assert job_row(job_id)["status"] == "done"
@@ -0,0 +1,25 @@
+import numpy as np
+
+import AutoMailer
+
+
+def log_sent(email_id, email):
+    AutoMailer.log_email_status(email_id, email, "Company", "Hi", "sent", "inbox")
+
+
+def test_snapshot_keeps_counts_and_domain_index_in_step(tracking_db):
+    log_sent("m1", "a@acme.com")
+    optimizer = AutoMailer.SendTimeOptimizer().refresh()
+    snapshot = optimizer.snapshot()
+
+    # A refresh that adds domains must not change what an earlier snapshot scores against
+    log_sent("m2", "b@globex.com")
+    optimizer.refresh()
+
+    (sent, _, _), domain_index = snapshot
+    assert list(domain_index) == ["acme.com"]
+    assert sent.shape == (1, AutoMailer.HOURS_PER_WEEK)
+    curves = optimizer.engagement_curves(["acme.com", "globex.com"], snapshot)
+    assert curves.shape == (2, AutoMailer.HOURS_PER_WEEK)
+    np.testing.assert_array_equal(curves[1], optimizer.engagement_curves([None], snapshot)[0])
+    assert set(optimizer.snapshot()[1]) == {"acme.com", "globex.com"}
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+import AutoMailer
+
+MESSAGE = b"Subject: hi\r\n\r\nhello\r\n"
+
+
+def make_pool(stub, **kwargs):
+    return AutoMailer.SMTPConnectionPool("127.0.0.1", stub.port, use_tls=False, timeout=5, **kwargs)
+
+
+def send(pool, n=0):
+    return pool.sendmail("sender@example.com", f"user{n}@example.com", MESSAGE)
+
+
+def test_sessions_are_reused(smtp_stub):
+    pool = make_pool(smtp_stub, size=2)
+
+    for n in range(5):
+        send(pool, n)
+
+    assert smtp_stub.sessions == 1
+    assert len(smtp_stub.messages) == 5
+    assert smtp_stub.verbs("RSET") == [1] * 4
+
+
+def test_sessions_are_recycled_after_max_messages(smtp_stub):
+    pool = make_pool(smtp_stub, max_messages_per_connection=2)
+
+    for n in range(5):
+        send(pool, n)
+
+    assert smtp_stub.sessions == 3
+
+
+def test_dropped_session_is_replaced(smtp_stub):
+    pool = make_pool(smtp_stub)
+    send(pool)
+
+    smtp_stub.drop_on_mail = 1
+    send(pool, 1)
+
+    assert smtp_stub.sessions == 2
+    assert [session for session, _ in smtp_stub.messages] == [1, 2]
+
+
+def test_pool_size_caps_open_sessions(smtp_stub):
+    smtp_stub.data_delay = 0.05
+    pool = make_pool(smtp_stub, size=1)
+    finished = []
+
+    def worker(n):
+        send(pool, n)
+        finished.append(time.monotonic())
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(3)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert smtp_stub.sessions == 1
+    assert smtp_stub.peak_active == 1
+    # Each sender waited for the single session to come back
+    assert max(finished) - started >= 3 * smtp_stub.data_delay
+
+
+def test_idle_sessions_are_probed_with_noop(smtp_stub):
+    pool = make_pool(smtp_stub, keepalive_interval=0.05)
+    send(pool)
+    send(pool, 1)
+    assert smtp_stub.verbs("NOOP") == []
+
+    time.sleep(0.1)
+    send(pool, 2)
+
+    assert smtp_stub.verbs("NOOP") == [1]
+    assert smtp_stub.sessions == 1
+
+
+def test_idle_session_that_fails_noop_is_replaced(smtp_stub, monkeypatch):
+    pool = make_pool(smtp_stub, keepalive_interval=0.05)
+    send(pool)
+    time.sleep(0.1)
+    monkeypatch.setattr(AutoMailer.smtplib.SMTP, "noop", lambda self: (421, b"closing"))
+
+    send(pool, 1)
+
+    assert smtp_stub.sessions == 2
+
+
+def test_close_quits_idle_sessions_and_discards_busy_ones(smtp_stub):
+    smtp_stub.data_delay = 0.1
+    pool = make_pool(smtp_stub, size=2)
+    threads = [threading.Thread(target=send, args=(pool, n)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+
+    pool.close()
+    for thread in threads:
+        thread.join()
+
+    assert pool._idle.empty()
+    assert sorted(smtp_stub.verbs("QUIT")) == [1, 2]
+
+
+def test_rejections_are_not_retried(smtp_stub, monkeypatch):
+    pool = make_pool(smtp_stub)
+    calls = []
+
+    def reject(self, *args, **kwargs):
+        calls.append(args)
+        raise AutoMailer.smtplib.SMTPDataError(554, b"rejected")
+
+    monkeypatch.setattr(AutoMailer.smtplib.SMTP, "sendmail", reject)
+
+    with pytest.raises(AutoMailer.smtplib.SMTPDataError):
+        send(pool)
+    assert len(calls) == 1
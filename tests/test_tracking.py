@@ -0,0 +1,139 @@
+import asyncio
+import email
+from urllib.parse import quote
+
+import pytest
+
+import AutoMailer
+
+BODY = "Hi Acme — see https://example.com/offer?a=1&b=2. Thanks!"
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.events = []
+
+    def write(self, event):
+        self.events.append(event)
+
+
+@pytest.fixture
+def secret(monkeypatch):
+    monkeypatch.setattr(AutoMailer, "TRACKING_SECRET", "s3cret")
+    monkeypatch.setattr(AutoMailer, "TRACKING_BASE_URL", "https://t.example")
+
+
+def click_path(email_id, url, sig):
+    return f"/click/{email_id}?url={quote(url, safe='')}&sig={sig}"
+
+
+def test_click_is_refused_without_secret(monkeypatch):
+    monkeypatch.setattr(AutoMailer, "TRACKING_SECRET", "")
+    writer = RecordingWriter()
+    server = AutoMailer.TrackingServer(writer=writer)
+    url = "https://evil.example/"
+
+    response = server.handle("GET", click_path("m1", url, AutoMailer._click_signature("m1", url)), {}, None, True)
+
+    assert response.startswith(b"HTTP/1.1 404")
+    assert writer.events == []
+    assert AutoMailer.tracking_click_url("m1", url) == url
+
+
+def test_signed_clicks_redirect_and_tampered_ones_do_not(secret):
+    writer = RecordingWriter()
+    server = AutoMailer.TrackingServer(writer=writer)
+    url = "https://example.com/offer"
+    sig = AutoMailer._click_signature("m1", url)
+
+    assert server.handle("GET", click_path("m1", url, sig), {}, None, True).startswith(
+        b"HTTP/1.1 302 Found\r\nLocation: https://example.com/offer\r\n")
+    assert server.handle("GET", click_path("m1", "https://evil.example/", sig), {}, None, True).startswith(
+        b"HTTP/1.1 400")
+    assert [event[:3] for event in writer.events] == [("m1", "click", url)]
+
+
+def test_html_body_links_are_tracked(secret):
+    markup = AutoMailer.create_html_email_body(BODY, "Acme", "m1")
+
+    tracked = AutoMailer.tracking_click_url("m1", "https://example.com/offer?a=1&b=2")
+    assert f'href="{AutoMailer.html.escape(tracked)}"' in markup
+    assert ">https://example.com/offer?a=1&amp;b=2</a>. Thanks!" in markup
+    assert AutoMailer.render_html_email_batch([BODY], ["Acme"], ["m1"]) == [markup]
+
+
+def test_html_body_links_are_plain_without_tracking_id(secret):
+    markup = AutoMailer.create_html_email_body(BODY, "Acme")
+
+    assert '<a href="https://example.com/offer?a=1&amp;b=2">' in markup
+
+
+def html_part(message_bytes):
+    message = email.message_from_bytes(message_bytes, policy=email.policy.default)
+    return message.get_body(("html",)).get_content()
+
+
+@pytest.mark.parametrize("tracking", [True, False])
+def test_factory_renders_per_recipient_links(monkeypatch, tracking):
+    monkeypatch.setattr(AutoMailer, "TRACKING_SECRET", "s3cret" if tracking else "")
+    factory = AutoMailer.CampaignMessageFactory("Hello", BODY, sender_email="sender@example.com")
+    assert factory.fast and factory.tracks_clicks == tracking
+
+    for email_id in ("m1", "m2"):
+        rendered = html_part(factory.render("user@example.com", email_id))
+        expected = AutoMailer.create_html_email_body(BODY, "", email_id)
+        assert rendered.split() == expected.split()
+
+
+def test_factory_slow_path_keeps_the_sender(monkeypatch):
+    monkeypatch.setattr(AutoMailer, "TRACKING_SECRET", "")
+    factory = AutoMailer.CampaignMessageFactory("Hello", BODY, sender_email="sender@example.com",
+                                                sender_name="Sales Team")
+
+    # Non-ASCII addresses bypass the byte template
+    message = email.message_from_bytes(factory.render("usér@example.com", "m1"), policy=email.policy.default)
+
+    assert message["From"] == "Sales Team <sender@example.com>"
+
+
+def test_personalized_messages_skip_the_factory_cache(monkeypatch):
+    monkeypatch.setattr(AutoMailer, "EMAIL", "sender@example.com")
+    AutoMailer.get_message_factory.cache_clear()
+
+    for n in range(3):
+        AutoMailer.build_email_bytes("user@example.com", f"Hi {n}", f"Body {n}", "Acme", f"m{n}")
+    assert AutoMailer.get_message_factory.cache_info().currsize == 0
+
+    for n in range(3):
+        AutoMailer.build_email_bytes("user@example.com", "Hi", "Body", "Acme", f"m{n}", shared=True)
+    assert AutoMailer.get_message_factory.cache_info().currsize == 1
+
+
+def test_only_signed_pixels_record_opens(secret):
+    writer = RecordingWriter()
+    server = AutoMailer.TrackingServer(writer=writer)
+
+    assert AutoMailer.tracking_pixel_path("m1") == f"/pixel/m1?sig={AutoMailer._pixel_signature('m1')}"
+    for path in (AutoMailer.tracking_pixel_path("m1"), "/pixel/m2", "/pixel/m2?sig=" + AutoMailer._pixel_signature("m1")):
+        assert server.handle("GET", path, {}, None, True).startswith(b"HTTP/1.1 200 OK\r\nContent-Type: image/gif")
+
+    assert [event[:2] for event in writer.events] == [("m1", "open")]
+    assert server.stats["rejected"] == 2
+    assert f'src="https://t.example{AutoMailer.tracking_pixel_path("m1")}"' in AutoMailer.tracking_pixel_html("m1")
+
+
+def test_oversized_request_bodies_are_refused():
+    server = AutoMailer.TrackingServer(writer=RecordingWriter())
+
+    async def exchange(length):
+        listener = await asyncio.start_server(server._serve_client, "127.0.0.1", 0)
+        async with listener:
+            reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname())
+            writer.write(f"POST /pixel/m1 HTTP/1.1\r\nHost: t\r\nContent-Length: {length}\r\n\r\n".encode("ascii"))
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+
+    assert asyncio.run(exchange(AutoMailer.TRACKING_MAX_BODY_BYTES + 1)).startswith(b"HTTP/1.1 413")
+    assert asyncio.run(exchange(-5)).startswith(b"HTTP/1.1 400")
@@ -0,0 +1,62 @@
+import pandas as pd
+
+import AutoMailer
+
+
+def test_bulk_and_single_validation_agree():
+    emails = pd.Series([" a@b.com", "a@b.com ", "a@b.com", "", "   ", None, "no-at-sign", "x@y"])
+
+    bulk = AutoMailer.validate_emails_bulk(emails)
+
+    assert bulk["valid"].tolist() == [AutoMailer.is_valid_email(email) for email in emails]
+    assert bulk["valid"].tolist() == [True, True, True, False, False, False, False, False]
+    assert bulk.loc[0, "domain"] == "b.com"
+
+
+def test_malformed_domain_does_not_fail_the_batch(tracking_db):
+    def resolver(domain):
+        if domain == "x..com":
+            raise UnicodeError("label empty or too long")
+        return {"status": "ok", "mx_hosts": ["mx." + domain]}
+
+    result = AutoMailer.validate_emails_bulk(pd.Series(["a@x..com", "b@gmail.com"]), check_dns=True, resolver=resolver)
+
+    assert result["score"].tolist() == [100, 90]
+    cached = dict(tracking_db.execute("SELECT domain, status FROM domain_dns_cache"))
+    assert cached == {"gmail.com": "ok"}
+
+
+def test_resolve_mail_domain_handles_malformed_names():
+    assert AutoMailer.resolve_mail_domain("x..com")["status"] == "unknown"
+
+
+def test_missing_address_record_is_unknown_without_dnspython(monkeypatch):
+    def getaddrinfo(*args, **kwargs):
+        raise AutoMailer.socket.gaierror(AutoMailer.socket.EAI_NONAME, "Name or service not known")
+
+    monkeypatch.setattr(AutoMailer, "dns", None)
+    monkeypatch.setattr(AutoMailer.socket, "getaddrinfo", getaddrinfo)
+
+    assert AutoMailer.resolve_mail_domain("mx-only.example")["status"] == "unknown"
+
+
+def test_domains_share_one_resolver(monkeypatch):
+    created = []
+
+    class FakeResolver:
+        def __init__(self):
+            created.append(self)
+
+        def resolve(self, domain, rdtype, lifetime=None):
+            raise AutoMailer.dns.resolver.NXDOMAIN()
+
+    monkeypatch.setattr(AutoMailer.dns.resolver, "Resolver", FakeResolver)
+    AutoMailer._dns_resolver.cache_clear()
+    try:
+        for domain in ("a.example", "b.example", "c.example"):
+            assert AutoMailer.resolve_mail_domain(domain, nameservers=["192.0.2.1"])["status"] == "no_mail"
+    finally:
+        AutoMailer._dns_resolver.cache_clear()
+
+    assert len(created) == 1
+    assert created[0].nameservers == ["192.0.2.1"]